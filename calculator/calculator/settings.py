@@ -49,6 +49,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'farmer.querybudget.QueryBudgetMiddleware',
 
 ]
 
@@ -89,6 +90,17 @@ DATABASES = {
     }
 }
 
+# Cache
+# Справочник рецептов хранится в общем для всех процессов кэше
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache',
+    }
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
@@ -120,6 +132,28 @@ MEDIA_ROOT = BASE_DIR / 'media'
 
 MEDIA_URL = '/media/'
 
+# Количество процессов для фоновой генерации документов
+DOCUMENT_JOB_WORKERS = 2
+# Сколько секунд может выполняться задача документов, прежде чем run_document_jobs
+# вернёт её в очередь, и сколько попыток у неё есть
+DOCUMENT_JOB_TIMEOUT = 30 * 60
+DOCUMENT_JOB_ATTEMPTS = 2
+# Количество процессов общего пула рендеринга документов отделов. Пул один на процесс
+# и используется командой run_document_jobs; процессы DOCUMENT_JOB_WORKERS рендерят сами
+DOCUMENT_RENDER_WORKERS = 4
+
+# Количество потоков, в которых асинхронные представления выполняют расчёты и запись в БД
+# (0 — без пула, в общем потоке синхронного кода)
+PLANNING_WORKERS = 4
+
+# Порядок распределения дефицитного сырья по умолчанию (см. farmer.feasibility.PRIORITY_CHOICES)
+PLANNING_PRIORITY = 'due_date'
+
+# Превышение бюджета SQL-запросов представления: запись в лог. Исключение включают
+# только тесты — middleware проверяет бюджет, когда транзакция представления уже
+# зафиксирована, и ошибка вместо ответа скрыла бы записанные данные
+QUERY_BUDGET_RAISE = False
+
 LANGUAGE_CODE = 'ru-RU'
 
 TIME_ZONE = 'UTC'
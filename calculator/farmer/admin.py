@@ -10,11 +10,13 @@ class ProductAdmin(admin.ModelAdmin):
     list_display = ('name', 'production_department', 'is_active')
     search_fields = ('name',)
     list_filter = ('production_department', 'is_active')
+    list_select_related = ('production_department',)
 
 class ManagementOrderAdmin(admin.ModelAdmin):
     list_display = ('Order_id', 'product_code', 'start_date', 'end_date', 'quantity')
     search_fields = ('Order_id', 'product_code__name')
     list_filter = ('start_date', 'end_date')
+    list_select_related = ('product_code',)
 
 class StockAdmin(admin.ModelAdmin):
     list_display = ('name',)
@@ -24,14 +26,17 @@ class RawMaterialStockAdmin(admin.ModelAdmin):
     list_display = ('name', 'quantity', 'stok_id')
     search_fields = ('name',)
     list_filter = ('stok_id',)
+    list_select_related = ('stok_id',)
 
 class RecipeAdmin(admin.ModelAdmin):
     list_display = ('product', 'raw_material', 'required_quantity')
     search_fields = ('product__name', 'raw_material__name')
+    list_select_related = ('product', 'raw_material')
 
 class ProductionPlanAdmin(admin.ModelAdmin):
     list_display = ('order', 'product', 'planned_quantity')
     search_fields = ('order__Order_id', 'product__name')
+    list_select_related = ('order__product_code', 'product')
 
 admin.site.register(ProductionDepartment, ProductionDepartmentAdmin)
 admin.site.register(Product, ProductAdmin)
@@ -0,0 +1,197 @@
+# allocation.py
+# Распределение сырья между складами для пачки заявок.
+# Одноимённое сырьё на разных складах считается одним материалом: заявку
+# можно обеспечить с любого склада. Цель — принять заявки наибольшей суммарной
+# ценности (по умолчанию ценность каждой заявки 1, т. е. максимум заявок).
+# Эвристика «жадный выбор + ремонт»: сначала заявки принимаются в порядке ранга
+# (например, срока), а внутри ранга — по убыванию ценности на долю дефицитного
+# сырья, как в жадном решении задачи о рюкзаке; затем отказанная заявка пробует
+# вытеснить одну принятую, если после обмена ценность растёт (или не меняется,
+# а вытесняемая заявка стоит в очереди дальше). В конце принятым заявкам
+# назначаются склады. Ремонт ограничен числом проходов и попыток обмена,
+# а не временем: при одних и тех же данных результат всегда один и тот же.
+
+# Сколько раз ремонт проходит по отказанным заявкам
+REPAIR_PASSES = 3
+# Сколько обменов всего можно попробовать за ремонт
+REPAIR_MAX_SWAPS = 20000
+# Сколько принятых заявок пробовать вытеснить ради одной отказанной
+REPAIR_CANDIDATES = 8
+
+
+class Allocation:
+    """
+    Итог распределения.
+
+    ``accepted`` — индексы принятых заявок, ``draws`` — {индекс заявки: {id строки остатков: количество}},
+    ``shortages`` — {индекс отказанной заявки: {материал: нехватка}}, ``remaining`` — остатки по строкам.
+    """
+
+    def __init__(self, accepted, draws, shortages, remaining):
+        self.accepted = accepted
+        self.draws = draws
+        self.shortages = shortages
+        self.remaining = remaining
+
+
+class _Solver:
+    def __init__(self, demands, supply, values=None, rank=None):
+        self.materials = list(supply)
+        index = {material: i for i, material in enumerate(self.materials)}
+        self.total = [sum(quantity for _, quantity in supply[material]) for material in self.materials]
+        self.left = list(self.total)
+
+        # Потребность заявок — разреженные списки (номер материала, количество)
+        self.demands = []
+        self.users = [[] for _ in self.materials]
+        for order, demand in enumerate(demands):
+            items = []
+            for material, amount in demand.items():
+                if amount <= 0:
+                    continue
+                if material not in index:
+                    # Сырья нет ни на одном складе
+                    index[material] = len(self.materials)
+                    self.materials.append(material)
+                    self.total.append(0)
+                    self.left.append(0)
+                    self.users.append([])
+                items.append((index[material], amount))
+                self.users[index[material]].append(order)
+            self.demands.append(items)
+
+        # «Тяжесть» заявки — доля запасов, которую она забирает
+        self.score = [sum(amount / self.total[m] if self.total[m] else float('inf') for m, amount in items)
+                      for items in self.demands]
+        self.values = list(values) if values is not None else [1] * len(self.demands)
+        self.rank = list(rank) if rank is not None else [0] * len(self.demands)
+        self.accepted = [False] * len(self.demands)
+
+    def fits(self, order):
+        left = self.left
+        return all(left[m] >= amount for m, amount in self.demands[order])
+
+    def take(self, order):
+        for m, amount in self.demands[order]:
+            self.left[m] -= amount
+        self.accepted[order] = True
+
+    def release(self, order):
+        for m, amount in self.demands[order]:
+            self.left[m] += amount
+        self.accepted[order] = False
+
+    def greedy(self, orders):
+        taken = []
+        for order in orders:
+            if not self.accepted[order] and self.fits(order):
+                self.take(order)
+                taken.append(order)
+        return taken
+
+    def _refill(self, freed):
+        # Отказанные заявки, которым могло хватить освободившегося сырья
+        candidates = {order for m, _ in self.demands[freed] for order in self.users[m] if not self.accepted[order]}
+        return self.greedy(sorted(candidates, key=self._key))
+
+    def _key(self, order):
+        # Ранг, затем «плотность» — расход на единицу ценности, затем исходный порядок
+        value = self.values[order]
+        density = self.score[order] / value if value > 0 else float('inf')
+        return self.rank[order], density, order
+
+    def repair(self, passes, max_swaps):
+        swaps = 0
+        improved = True
+        while improved and passes > 0 and swaps < max_swaps:
+            passes -= 1
+            improved = False
+            rejected = sorted((order for order, accepted in enumerate(self.accepted) if not accepted), key=self._key)
+            for order in rejected:
+                if self.accepted[order]:
+                    continue
+                if swaps >= max_swaps:
+                    break
+                deficit = [(m, amount - self.left[m]) for m, amount in self.demands[order] if amount > self.left[m]]
+                if not deficit:
+                    self.take(order)
+                    improved = True
+                    continue
+                if any(self.total[m] < amount for m, amount in self.demands[order]):
+                    continue  # заявке не хватит даже всех запасов
+                bottleneck = max(deficit, key=lambda item: item[1])[0]
+                # Принятые заявки, освобождающие весь дефицит
+                candidates = [other for other in self.users[bottleneck] if self.accepted[other]
+                              and all(dict(self.demands[other]).get(m, 0) >= need for m, need in deficit)]
+                candidates.sort(key=self._key, reverse=True)
+                for other in candidates[:REPAIR_CANDIDATES]:
+                    swaps += 1
+                    self.release(other)
+                    self.take(order)
+                    added = self._refill(other)
+                    gain = self.values[order] + sum(self.values[extra] for extra in added) - self.values[other]
+                    if gain > 0 or (gain == 0 and self._key(order) < self._key(other)):
+                        improved = True
+                        break
+                    for extra in added:
+                        self.release(extra)
+                    # Обмен ничего не дал — откатываем
+                    self.release(order)
+                    self.take(other)
+
+    def assign(self, supply, preferred):
+        """Назначить склады принятым заявкам: сначала склад из рецепта, затем наиболее подходящий."""
+        remaining = {row_id: quantity for material in supply for row_id, quantity in supply[material]}
+        rows = {material: [row_id for row_id, _ in supply[material]] for material in supply}
+        draws = {}
+        for order, accepted in enumerate(self.accepted):
+            if not accepted:
+                continue
+            order_draws = {}
+            for m, amount in self.demands[order]:
+                material = self.materials[m]
+                first = preferred[order].get(material) if preferred else None
+                # Склад, который покрывает всё количество с наименьшим остатком, иначе — самые полные
+                whole = [row_id for row_id in rows[material] if remaining[row_id] >= amount]
+                if first is not None and remaining.get(first, 0) >= amount:
+                    order_rows = [first]
+                elif whole:
+                    order_rows = [min(whole, key=lambda row_id: remaining[row_id])]
+                else:
+                    order_rows = sorted(rows[material], key=lambda row_id: remaining[row_id], reverse=True)
+                for row_id in order_rows:
+                    if amount <= 0:
+                        break
+                    drawn = min(amount, remaining[row_id])
+                    if drawn:
+                        remaining[row_id] -= drawn
+                        order_draws[row_id] = order_draws.get(row_id, 0) + drawn
+                        amount -= drawn
+            draws[order] = order_draws
+        return draws, remaining
+
+
+def allocate(demands, supply, preferred=None, values=None, rank=None, passes=REPAIR_PASSES,
+             max_swaps=REPAIR_MAX_SWAPS):
+    """
+    Распределить сырьё между заявками.
+
+    ``demands`` — список {материал: количество} по заявкам,
+    ``supply`` — {материал: [(id строки остатков, количество), ...]} по складам,
+    ``preferred`` — список {материал: id строки остатков из рецепта} по заявкам,
+    ``values`` — ценность заявок, ``rank`` — ранг заявок (меньше — раньше в жадном проходе).
+    """
+    solver = _Solver(demands, supply, values, rank)
+    solver.greedy(sorted(range(len(solver.demands)), key=solver._key))
+    solver.repair(passes, max_swaps)
+    # После обменов могло освободиться сырьё для оставшихся заявок
+    solver.greedy(sorted(range(len(solver.demands)), key=solver._key))
+
+    shortages = {}
+    for order, accepted in enumerate(solver.accepted):
+        if not accepted:
+            shortages[order] = {solver.materials[m]: amount - solver.left[m]
+                                for m, amount in solver.demands[order] if amount > solver.left[m]}
+    draws, remaining = solver.assign(supply, preferred)
+    accepted = {order for order, accepted in enumerate(solver.accepted) if accepted}
+    return Allocation(accepted, draws, shortages, remaining)
@@ -0,0 +1,125 @@
+# api.py
+# Пакетная проверка возможности производства в JSON для внешних систем (ERP).
+# Запрос: {"lines": [{"product_id", "start_date", "end_date", "quantity", "priority"?}, ...],
+#          "priority": "due_date" | "quantity" | "priority" | "none"?}.
+# Ответ — по строке на каждую строку запроса в том же порядке: статус, нехватка
+# по id сырья, просрочка в днях, расчётная дата завершения и уже утверждённая
+# загрузка отдела в сроки строки (в месяц), а для обеспеченных сырьём строк — откуда
+# оно берётся: {id склада: {id сырья: количество}}. Весь пакет
+# считается одним FeasibilityEngine — фиксированное число запросов на пакет.
+
+from datetime import date
+
+from .feasibility import FeasibilityEngine, OrderLine, ALLOCATION_OPTIMIZED, PRIORITY_CHOICES, STATUS_SHORTAGE
+
+# Наибольшее число строк в одном запросе
+MAX_API_LINES = 10000
+# Наибольшие id продукта и количество: столько помещается в поля моделей, а большие
+# числа не дошли бы до базы или переполнили бы матрицу потребности в сырье
+MAX_API_ID = 2 ** 63 - 1
+MAX_API_QUANTITY = 2 ** 31 - 1
+
+
+class ApiError(Exception):
+    """Некорректный запрос: сообщение и, при необходимости, ошибки по строкам."""
+
+    def __init__(self, message, errors=None):
+        super().__init__(message)
+        self.errors = errors or []
+
+
+def _positive_int(value, limit):
+    if isinstance(value, bool) or not isinstance(value, int) or not 0 < value <= limit:
+        raise ValueError
+    return value
+
+
+def parse_line(data):
+    """Строка запроса → OrderLine; ValueError с описанием, если строка некорректна."""
+    if not isinstance(data, dict):
+        raise ValueError("строка должна быть объектом")
+    try:
+        product_id = _positive_int(data['product_id'], MAX_API_ID)
+        start_date = date.fromisoformat(data['start_date'])
+        end_date = date.fromisoformat(data['end_date'])
+        quantity = _positive_int(data['quantity'], MAX_API_QUANTITY)
+    except KeyError as error:
+        raise ValueError(f"нет поля {error.args[0]}")
+    except (TypeError, ValueError):
+        raise ValueError("product_id и quantity — целые больше нуля, даты — в формате ГГГГ-ММ-ДД")
+    priority = data.get('priority', 0)
+    if isinstance(priority, bool) or not isinstance(priority, int) or priority < 0:
+        raise ValueError("priority — целое не меньше нуля")
+    if end_date < start_date:
+        raise ValueError("дата окончания раньше даты начала")
+    return OrderLine(product_id, start_date, end_date, quantity, priority=priority)
+
+
+def parse_form_line(product_id, start_date, end_date, quantity):
+    """Строка HTML-формы (все поля — строки) → OrderLine с теми же проверками, что parse_line."""
+    try:
+        product_id, quantity = int(product_id), int(quantity)
+    except (TypeError, ValueError):
+        raise ValueError("продукт и количество — целые больше нуля")
+    return parse_line({'product_id': product_id, 'start_date': start_date, 'end_date': end_date,
+                       'quantity': quantity})
+
+
+def parse_request(payload, default_priority):
+    """Разобрать тело запроса: (строки, порядок распределения сырья). Ошибки — ApiError."""
+    if not isinstance(payload, dict) or not isinstance(payload.get('lines'), list):
+        raise ApiError("Ожидается объект с массивом lines")
+    if len(payload['lines']) > MAX_API_LINES:
+        raise ApiError(f"Не больше {MAX_API_LINES} строк в одном запросе")
+    priority = payload.get('priority', default_priority)
+    if priority not in dict(PRIORITY_CHOICES):
+        raise ApiError("Неизвестный порядок распределения сырья (priority)")
+
+    lines, errors = [], []
+    for index, data in enumerate(payload['lines']):
+        try:
+            lines.append(parse_line(data))
+        except ValueError as error:
+            errors.append({'index': index, 'error': str(error)})
+    if errors:
+        raise ApiError("Некорректные строки", errors)
+    return lines, priority
+
+
+def line_result(index, verdict):
+    result = {
+        'index': index,
+        'product_id': verdict.line.product_id,
+        'status': verdict.status,
+        'feasible': verdict.feasible,
+        'shortages': {},
+        'delay_days': None,
+        'completion_date': None,
+        'department_load': None,
+        'draws': {},
+    }
+    if verdict.status == STATUS_SHORTAGE:
+        result['shortages'] = {str(material_id): amount for material_id, amount in verdict.shortages.items()}
+        return result
+    if verdict.completion_date is not None:
+        result['delay_days'] = verdict.delay
+        result['completion_date'] = verdict.completion_date.isoformat()
+    if verdict.department_load is not None:
+        result['department_load'] = round(verdict.department_load, 2)
+    result['draws'] = {str(stock_id): {str(material_id): amount for material_id, amount in draws.items()}
+                       for stock_id, draws in verdict.draws.items()}
+    return result
+
+
+def evaluate_request(payload, default_priority):
+    """Проверить пакет строк и вернуть тело ответа."""
+    lines, priority = parse_request(payload, default_priority)
+    engine = FeasibilityEngine(lines, allocation=ALLOCATION_OPTIMIZED, priority=priority)
+    unknown = sorted({line.product_id for line in lines} - set(engine.products))
+    if unknown:
+        raise ApiError("Неизвестные продукты", [{'product_id': product_id} for product_id in unknown])
+    verdicts = engine.evaluate()
+    return {
+        'priority': priority,
+        'results': [line_result(index, verdict) for index, verdict in enumerate(verdicts)],
+    }
@@ -0,0 +1,148 @@
+# bom.py
+# Разузлование (bill of materials) для большой пачки заявок.
+# Рецепты хранятся как разреженная матрица продукт × сырьё в формате COO,
+# потребность в сырье считается одним умножением матрицы на вектор количеств.
+# Потребность по отдельным строкам пачки (для распределения сырья) собирается
+# из той же матрицы. Количества везде целые (int64), без перевода во float.
+
+from collections import defaultdict
+
+try:
+    import numpy as np
+except ImportError:  # NumPy не обязателен, без него считаем обычным циклом
+    np = None
+
+
+class BillOfMaterials:
+    """
+    Разреженная матрица рецептов.
+
+    ``recipes`` — словарь {product_id: [(material_id, required_quantity), ...]},
+    в том же виде, в каком его собирает FeasibilityEngine. Сырьё — целые id,
+    поэтому столбцы матрицы и остатки сопоставляются без хеширования строк.
+    """
+
+    def __init__(self, recipes):
+        self.recipes = recipes
+        self.product_index = {product_id: row for row, product_id in enumerate(recipes)}
+        self.materials = []
+        self.material_index = {}
+
+        rows, cols, values = [], [], []
+        for product_id, items in recipes.items():
+            for material, required_quantity in items:
+                if material not in self.material_index:
+                    self.material_index[material] = len(self.materials)
+                    self.materials.append(material)
+                rows.append(self.product_index[product_id])
+                cols.append(self.material_index[material])
+                values.append(required_quantity)
+
+        if np is not None:
+            self.rows = np.asarray(rows, dtype=np.int64)
+            self.cols = np.asarray(cols, dtype=np.int64)
+            self.values = np.asarray(values, dtype=np.int64)
+            # Элементы идут подряд по продуктам: где начинается и сколько элементов у каждого продукта
+            self.row_counts = np.bincount(self.rows, minlength=len(self.product_index)).astype(np.int64)
+            self.row_starts = np.cumsum(self.row_counts) - self.row_counts
+        else:
+            self.rows, self.cols, self.values = rows, cols, values
+
+    def product_vector(self, lines):
+        """Суммарное количество по каждому продукту пачки."""
+        # Продукты без рецептов сырья не требуют
+        lines = [line for line in lines if line.product_id in self.product_index]
+        if np is not None:
+            vector = np.zeros(len(self.product_index), dtype=np.int64)
+            if lines:
+                index = np.fromiter((self.product_index[line.product_id] for line in lines), dtype=np.int64)
+                quantity = np.fromiter((line.quantity for line in lines), dtype=np.int64)
+                np.add.at(vector, index, quantity)
+            return vector
+        vector = [0] * len(self.product_index)
+        for line in lines:
+            vector[self.product_index[line.product_id]] += line.quantity
+        return vector
+
+    def demand(self, lines):
+        """Потребность в каждом сырье для всей пачки (вектор по ``materials``)."""
+        vector = self.product_vector(lines)
+        if np is not None:
+            demand = np.zeros(len(self.materials), dtype=np.int64)
+            np.add.at(demand, self.cols, self.values * vector[self.rows])
+            return demand
+        demand = [0] * len(self.materials)
+        for row, col, value in zip(self.rows, self.cols, self.values):
+            demand[col] += value * vector[row]
+        return demand
+
+    def _line_entries(self, lines):
+        # Ненулевые элементы потребности строк: (номер строки, столбец сырья, количество)
+        count = len(lines)
+        product_rows = np.fromiter((self.product_index.get(line.product_id, -1) for line in lines),
+                                   dtype=np.int64, count=count)
+        quantity = np.fromiter((line.quantity for line in lines), dtype=np.int64, count=count)
+        line_index = np.flatnonzero(product_rows >= 0)
+        rows = product_rows[line_index]
+        counts = self.row_counts[rows]
+        line_index = np.repeat(line_index, counts)
+        # Номер элемента матрицы: начало продукта плюс смещение внутри него
+        offsets = np.arange(counts.sum(), dtype=np.int64) - np.repeat(np.cumsum(counts) - counts, counts)
+        entries = np.repeat(self.row_starts[rows], counts) + offsets
+        return line_index, self.cols[entries], self.values[entries] * quantity[line_index]
+
+    def line_demands(self, lines, group=None):
+        """
+        Потребность каждой строки пачки: список {сырьё: количество} в порядке ``lines``.
+        ``group`` — {сырьё: ключ}; потребность сырья с одним ключом складывается
+        (например, одноимённого сырья разных складов).
+        """
+        group = group or {}
+        demands = [{} for _ in lines]
+        if np is None:
+            for demand, line in zip(demands, lines):
+                for material, required_quantity in self.recipes.get(line.product_id, ()):
+                    key = group.get(material, material)
+                    demand[key] = demand.get(key, 0) + required_quantity * line.quantity
+            return demands
+
+        keys = {}
+        key_columns = np.fromiter((keys.setdefault(group.get(material, material), len(keys))
+                                   for material in self.materials), dtype=np.int64, count=len(self.materials))
+        keys = list(keys)
+        line_index, cols, amounts = self._line_entries(lines)
+        # Складываем элементы с одной парой (строка, ключ)
+        pairs, inverse = np.unique(line_index * max(len(keys), 1) + key_columns[cols], return_inverse=True)
+        totals = np.zeros(len(pairs), dtype=np.int64)
+        np.add.at(totals, inverse, amounts)
+        for pair, amount in zip(pairs.tolist(), totals.tolist()):
+            line, key = divmod(pair, len(keys))
+            demands[line][keys[key]] = amount
+        return demands
+
+    def stock_vector(self, stock):
+        """Остатки ``stock`` ({material: quantity}) в порядке ``materials``."""
+        if np is not None:
+            return np.fromiter((stock.get(material, 0) for material in self.materials),
+                               dtype=np.int64, count=len(self.materials))
+        return [stock.get(material, 0) for material in self.materials]
+
+    def shortages(self, lines, stock):
+        """Нехватка сырья по всей пачке: {material: недостающее количество}."""
+        demand = self.demand(lines)
+        available = self.stock_vector(stock)
+        if np is not None:
+            missing = demand - available
+            short = np.flatnonzero(missing > 0)
+            return {self.materials[i]: int(missing[i]) for i in short}
+        return {material: need - have
+                for material, need, have in zip(self.materials, demand, available) if need > have}
+
+    def totals(self, lines):
+        """Потребность в сырье словарём {material: количество}."""
+        demand = self.demand(lines)
+        result = defaultdict(int)
+        for material, amount in zip(self.materials, demand):
+            if amount:
+                result[material] = int(amount)
+        return result
@@ -0,0 +1,70 @@
+# catalog.py
+# Кэш справочника рецептов в кэше Django.
+# Для каждого продукта хранится кортеж (id сырья, название сырья, необходимое количество).
+# Все ключи содержат номер версии; сигналы на Recipe и RawMaterialStock увеличивают
+# версию, поэтому устаревшие рецепты никогда не читаются.
+
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import Recipe
+
+VERSION_KEY = 'farmer:recipe_catalog:version'
+
+
+def catalog_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # Начальная версия от текущего времени: если ключ версии вытеснен из кэша,
+        # старые записи с прежними номерами всё равно не совпадут
+        cache.add(VERSION_KEY, int(time.time() * 1000), timeout=None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def _bump():
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, int(time.time() * 1000), timeout=None)
+
+
+def invalidate():
+    """Сбросить справочник сейчас и ещё раз после фиксации транзакции."""
+    _bump()
+    transaction.on_commit(_bump)
+
+
+def _key(version, product_id):
+    return f'farmer:recipes:{version}:{product_id}'
+
+
+def get_recipes(product_ids):
+    """Рецепты продуктов: {product_id: ((material_id, material_name, required_quantity), ...)}."""
+    product_ids = set(product_ids)
+    version = catalog_version()
+    keys = {product_id: _key(version, product_id) for product_id in product_ids}
+    cached = cache.get_many(keys.values())
+
+    result = {}
+    missing = set()
+    for product_id, key in keys.items():
+        if key in cached:
+            result[product_id] = cached[key]
+        else:
+            missing.add(product_id)
+
+    if missing:
+        # Недостающие продукты дочитываем одним запросом
+        loaded = {product_id: [] for product_id in missing}
+        rows = Recipe.objects.filter(product_id__in=missing).order_by('id').values_list(
+            'product_id', 'raw_material_id', 'raw_material__name', 'required_quantity')
+        for product_id, material_id, material_name, required_quantity in rows:
+            loaded[product_id].append((material_id, material_name, required_quantity))
+        loaded = {product_id: tuple(items) for product_id, items in loaded.items()}
+        cache.set_many({keys[product_id]: items for product_id, items in loaded.items()}, timeout=None)
+        result.update(loaded)
+
+    return result
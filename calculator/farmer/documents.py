@@ -0,0 +1,175 @@
+# documents.py
+# Генерация документов производственного плана (.docx) и архива с ними.
+# Документ отдела строится из заготовки, разобранной один раз на поток: для
+# каждого отдела в неё подставляется копия исходного тела документа, а строки
+# плана записываются в таблицу одним проходом. Документы собираются
+# в памяти, архив пишется потоково: ничего не складывается на диск
+# и архив целиком в памяти не держится.
+
+import threading
+from collections import defaultdict
+from copy import deepcopy
+from functools import lru_cache
+from io import BytesIO
+from zipfile import ZipFile, ZIP_DEFLATED
+
+from docx import Document
+
+# Колонки таблицы в документе отдела
+DEPARTMENT_COLUMNS = ('Продукт', 'Запланированное количество', 'Дата начала', 'Дата окончания')
+
+# Размер куска, которым содержимое файла пишется в архив
+ZIP_WRITE_CHUNK = 64 * 1024
+
+
+def _document_bytes(document):
+    buffer = BytesIO()
+    document.save(buffer)
+    return buffer.getvalue()
+
+
+_local = threading.local()
+
+
+@lru_cache(maxsize=None)
+def _department_template():
+    """Заготовка документа отдела: заголовок и таблица с шапкой. Строится один раз на процесс."""
+    document = Document()
+    document.add_heading('', 0)
+    table = document.add_table(rows=2, cols=len(DEPARTMENT_COLUMNS))
+    table.style = 'Table Grid'
+    for cell, title in zip(table.rows[0].cells, DEPARTMENT_COLUMNS):
+        cell.text = title
+    return _document_bytes(document)
+
+
+def _department_document():
+    """
+    Разобранная заготовка с чистым телом. Документ и копия его исходного тела
+    хранятся в потоке; на каждый вызов тело заменяется копией, без разбора .docx.
+    """
+    if not hasattr(_local, 'document'):
+        _local.document = Document(BytesIO(_department_template()))
+        _local.body = deepcopy(_local.document.element.body)
+    document = _local.document
+    document.element.replace(document.element.body, deepcopy(_local.body))
+    return document
+
+
+def render_department_document(department, rows):
+    """
+    Документ одного отдела. ``rows`` — строки таблицы
+    (продукт, количество, дата начала, дата окончания).
+    """
+    document = _department_document()
+    # Тело заменено, поэтому работаем с его XML, а не с обёртками python-docx
+    body = document.element.body
+    body.p_lst[0].add_r().text = f'План производства для отдела {department}'
+
+    # Строки таблицы собираются копированием строки-заготовки прямо в XML,
+    # без поячеечных вызовов python-docx
+    table = body.tbl_lst[0]
+    row_template = table.tr_lst[1]
+    table.remove(row_template)
+    for values in rows:
+        tr = deepcopy(row_template)
+        for tc, value in zip(tr.tc_lst, values):
+            tc.p_lst[0].add_r().text = str(value)
+        table.append(tr)
+
+    return f'{department}_production_plan.docx', _document_bytes(document)
+
+
+def _render_department_item(item):
+    return render_department_document(*item)
+
+
+def generate_department_documents(production_plans, executor=None):
+    """
+    Документы отделов: пары (имя файла, содержимое).
+    Если передан пул процессов ``executor``, документы отделов рендерятся в нём параллельно;
+    пул создаёт и держит вызывающий код (см. jobs.get_render_executor).
+    """
+    department_plans = defaultdict(list)
+    for plan in production_plans:
+        department_plans[plan.product.production_department.name].append(
+            (plan.product.name, plan.planned_quantity, plan.order.start_date, plan.order.end_date))
+
+    items = list(department_plans.items())
+    if executor is not None and len(items) > 1:
+        yield from executor.map(_render_department_item, items)
+    else:
+        for item in items:
+            yield _render_department_item(item)
+
+
+def generate_manager_report(manager_report):
+    document = Document()
+    document.add_heading('Отчет для менеджеров', 0)
+
+    for product_name, issue in manager_report:
+        document.add_heading(product_name, level=1)
+        document.add_paragraph(issue)
+
+    return 'manager_report.docx', _document_bytes(document)
+
+
+def plan_documents(production_plans, manager_report, executor=None):
+    """Все файлы архива плана: документы отделов и отчёт для менеджеров."""
+    yield from generate_department_documents(production_plans, executor)
+    yield generate_manager_report(manager_report)
+
+
+class _ZipSink:
+    """Приёмник для ZipFile без seek: копит записанные байты до следующей выдачи."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _content_chunks(content):
+    if isinstance(content, (bytes, bytearray)):
+        for start in range(0, len(content), ZIP_WRITE_CHUNK):
+            yield content[start:start + ZIP_WRITE_CHUNK]
+    else:
+        yield from content
+
+
+def stream_zip(files):
+    """
+    Потоковая сборка zip-архива из пар (имя файла, содержимое).
+
+    Содержимое — bytes или итератор кусков bytes (для файлов, которые
+    сами генерируются потоково). Генератор отдаёт готовые куски архива
+    по мере добавления файлов, поэтому его можно передать прямо
+    в StreamingHttpResponse.
+    """
+    sink = _ZipSink()
+    with ZipFile(sink, 'w', ZIP_DEFLATED) as zip_file:
+        for filename, content in files:
+            # Размер потокового содержимого заранее неизвестен
+            force_zip64 = not isinstance(content, (bytes, bytearray)) or len(content) > 0x7FFFFFFF
+            with zip_file.open(filename, 'w', force_zip64=force_zip64) as entry:
+                for piece in _content_chunks(content):
+                    entry.write(piece)
+                    chunk = sink.drain()
+                    if chunk:
+                        yield chunk
+            chunk = sink.drain()
+            if chunk:
+                yield chunk
+    chunk = sink.drain()
+    if chunk:
+        yield chunk
@@ -0,0 +1,153 @@
+# exports.py
+# Выгрузка производственных планов в CSV, NDJSON и XLSX.
+# Планы читаются из БД курсором на стороне сервера (.iterator(chunk_size=...)),
+# строки сразу пишутся в ответ, поэтому память не зависит от объёма истории.
+
+import csv
+import json
+from io import StringIO
+from xml.sax.saxutils import escape
+
+from .documents import stream_zip
+from .models import ProductionPlan
+from .periods import overlapping
+
+# Сколько строк читать из курсора за раз
+EXPORT_CHUNK_SIZE = 2000
+# Сколько строк собирать в один кусок ответа
+ROWS_PER_PIECE = 500
+
+# Колонки выгрузки: имя колонки и поле запроса
+EXPORT_COLUMNS = (
+    ('plan_id', 'pk'),
+    ('order_id', 'order__Order_id'),
+    ('product_id', 'product_id'),
+    ('product', 'product__name'),
+    ('department_id', 'product__production_department_id'),
+    ('department', 'product__production_department__name'),
+    ('start_date', 'order__start_date'),
+    ('end_date', 'order__end_date'),
+    ('order_quantity', 'order__quantity'),
+    ('planned_quantity', 'planned_quantity'),
+)
+
+EXPORT_FORMATS = {
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'xlsx'),
+}
+
+
+def plan_rows(date_from=None, date_to=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """Строки планов вместе с заявкой, продуктом и отделом в порядке id."""
+    plans = ProductionPlan.objects.all()
+    if date_from and date_to:
+        plans = overlapping(plans, date_from, date_to, prefix='order__')
+    elif date_from:
+        plans = plans.filter(order__end_date__gte=date_from)
+    elif date_to:
+        plans = plans.filter(order__start_date__lte=date_to)
+    return plans.order_by('pk').values_list(*[field for _, field in EXPORT_COLUMNS]).iterator(
+        chunk_size=chunk_size)
+
+
+def _pieces(rows, render_row):
+    """Склеивает отрисованные строки в куски по ROWS_PER_PIECE."""
+    piece = []
+    for row in rows:
+        piece.append(render_row(row))
+        if len(piece) >= ROWS_PER_PIECE:
+            yield ''.join(piece).encode('utf-8')
+            piece = []
+    if piece:
+        yield ''.join(piece).encode('utf-8')
+
+
+def csv_stream(rows):
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+
+    def render_row(row):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerow(row)
+        return buffer.getvalue()
+
+    # BOM, чтобы Excel открывал файл в UTF-8
+    yield '\ufeff'.encode('utf-8') + render_row([name for name, _ in EXPORT_COLUMNS]).encode('utf-8')
+    yield from _pieces(rows, render_row)
+
+
+def ndjson_stream(rows):
+    names = [name for name, _ in EXPORT_COLUMNS]
+
+    def render_row(row):
+        return json.dumps(dict(zip(names, row)), ensure_ascii=False, default=str) + '\n'
+
+    yield from _pieces(rows, render_row)
+
+
+def _xlsx_cell(value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return f'<c t="n"><v>{value}</v></c>'
+    return f'<c t="inlineStr"><is><t>{escape(str(value))}</t></is></c>'
+
+
+def _xlsx_sheet(rows):
+    yield (b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+           b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>')
+    yield ('<row>' + ''.join(_xlsx_cell(name) for name, _ in EXPORT_COLUMNS) + '</row>').encode('utf-8')
+    yield from _pieces(rows, lambda row: '<row>' + ''.join(_xlsx_cell(value) for value in row) + '</row>')
+    yield b'</sheetData></worksheet>'
+
+
+XLSX_PARTS = (
+    ('[Content_Types].xml',
+     b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+     b'<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+     b'<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+     b'<Default Extension="xml" ContentType="application/xml"/>'
+     b'<Override PartName="/xl/workbook.xml" '
+     b'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+     b'<Override PartName="/xl/worksheets/sheet1.xml" '
+     b'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+     b'</Types>'),
+    ('_rels/.rels',
+     b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+     b'<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+     b'<Relationship Id="rId1" '
+     b'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+     b'Target="xl/workbook.xml"/>'
+     b'</Relationships>'),
+    ('xl/workbook.xml',
+     b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+     b'<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+     b'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+     b'<sheets><sheet name="Plans" sheetId="1" r:id="rId1"/></sheets>'
+     b'</workbook>'),
+    ('xl/_rels/workbook.xml.rels',
+     b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+     b'<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+     b'<Relationship Id="rId1" '
+     b'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+     b'Target="worksheets/sheet1.xml"/>'
+     b'</Relationships>'),
+)
+
+
+def xlsx_stream(rows):
+    """Минимальная книга XLSX с одним листом; лист пишется потоково внутри zip."""
+    files = list(XLSX_PARTS) + [('xl/worksheets/sheet1.xml', _xlsx_sheet(rows))]
+    yield from stream_zip(files)
+
+
+EXPORT_WRITERS = {
+    'csv': csv_stream,
+    'ndjson': ndjson_stream,
+    'xlsx': xlsx_stream,
+}
+
+
+def export_plans(export_format, date_from=None, date_to=None):
+    """Итератор кусков файла выгрузки в формате ``export_format``."""
+    return EXPORT_WRITERS[export_format](plan_rows(date_from, date_to))
@@ -0,0 +1,390 @@
+# feasibility.py
+# Общий расчёт возможности производства для пачки заявок.
+# Все рецепты, остатки сырья и загрузка отделов загружаются фиксированным
+# числом запросов, дальше расчёт идёт в памяти. Загрузка отделов читается один
+# раз на расчёт в LoadTimeline: по ней планировщик раскладывает заявки по дням,
+# а загрузка отдела в любом окне считается по префиксным суммам за O(log n).
+
+from collections import defaultdict
+from datetime import datetime
+
+from . import catalog
+from .allocation import allocate
+from .bom import BillOfMaterials
+from .scheduler import ScheduleJob, load_timeline, schedule
+from .models import ManagementOrder, Product, RawMaterialStock
+
+# Режимы распределения сырья
+ALLOCATION_SEQUENTIAL = 'sequential'  # строки по порядку, каждая со своей строки остатков из рецепта
+ALLOCATION_OPTIMIZED = 'optimized'  # одноимённое сырьё со всех складов, максимум обеспеченных заявок
+
+# Порядок, в котором строки получают дефицитное сырьё
+PRIORITY_NONE = 'none'  # в порядке строк заявки
+PRIORITY_DUE_DATE = 'due_date'  # сначала с ранним сроком окончания
+PRIORITY_QUANTITY = 'quantity'  # сначала небольшие заявки — больше заявок выполнено
+PRIORITY_VALUE = 'priority'  # по приоритету заявки: максимум суммарного приоритета
+PRIORITY_CHOICES = [
+    (PRIORITY_DUE_DATE, 'Сначала ранние сроки'),
+    (PRIORITY_QUANTITY, 'Сначала небольшие заявки'),
+    (PRIORITY_VALUE, 'По приоритету заявки'),
+    (PRIORITY_NONE, 'В порядке заявки'),
+]
+
+# Статусы вердикта
+STATUS_OK = 'ok'
+STATUS_DELAY = 'delay'
+STATUS_SHORTAGE = 'shortage'
+
+
+def to_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    return value
+
+
+class OrderLine:
+    """Одна строка заявки: продукт, сроки и количество."""
+
+    __slots__ = ('product_id', 'start_date', 'end_date', 'quantity', 'priority', 'source')
+
+    def __init__(self, product_id, start_date, end_date, quantity, source=None, priority=0):
+        self.product_id = int(product_id)
+        self.start_date = to_date(start_date)
+        self.end_date = to_date(end_date)
+        self.quantity = int(quantity)
+        self.priority = int(priority)
+        # Исходный объект (ManagementOrder или словарь из формы)
+        self.source = source
+
+    @classmethod
+    def from_order(cls, order):
+        return cls(order.product_code_id, order.start_date, order.end_date, order.quantity, source=order,
+                   priority=order.priority)
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['product_id'], data['start_date'], data['end_date'], data['quantity'], source=data,
+                   priority=data.get('priority', 0))
+
+
+class Verdict:
+    """
+    Результат проверки одной строки заявки.
+    ``shortages`` — нехватка по id сырья, ``material_names`` — подписи сырья для сообщений.
+    """
+
+    def __init__(self, line, product, status, shortages=None, delay=0, required_months=0, material_names=None,
+                 completion_date=None, department_load=None, draws=None, warehouses=''):
+        self.line = line
+        self.product = product
+        self.status = status
+        self.shortages = shortages or {}
+        self.delay = delay
+        self.required_months = required_months
+        self.material_names = material_names or {}
+        # День завершения по расписанию отдела
+        self.completion_date = completion_date
+        # Уже утверждённая загрузка отдела в сроки заявки, в месяц
+        self.department_load = department_load
+        # Откуда берётся сырьё строки: {id склада: {id сырья: количество}} и то же строкой для вывода
+        self.draws = draws or {}
+        self.warehouses = warehouses
+
+    @property
+    def feasible(self):
+        return self.status == STATUS_OK
+
+    def message(self, unit='единиц'):
+        if self.status == STATUS_SHORTAGE:
+            return f"Недостаточно сырья: {shortage_info(self.shortages, self.material_names)}"
+        completion = f", завершение {self.completion_date:%d.%m.%Y}" if self.completion_date else ''
+        if self.status == STATUS_DELAY and self.completion_date is None:
+            return "Производственный отдел не сможет уложиться в сроки: не хватает мощности"
+        if self.status == STATUS_DELAY:
+            load = ''
+            if self.department_load is not None:
+                load = (f" (отдел уже загружен на {self.department_load:.2f} в месяц"
+                        f" при мощности {self.product.production_department.average_output})")
+            return (f"Производственный отдел не сможет уложиться в сроки, просрочка составит {self.delay:.2f} дней"
+                    f"{completion}{load}")
+        return f"Можно произвести {self.line.quantity} {unit} за {self.required_months:.2f} месяцев{completion}"
+
+
+def rank_lines(lines, priority=PRIORITY_NONE):
+    """
+    Порядок строк для распределения сырья: (ранг, ценность) по каждой строке.
+    Меньший ранг получает сырьё раньше; ценность — вес строки при максимизации.
+    """
+    if priority == PRIORITY_DUE_DATE:
+        return [(line.end_date.toordinal(), 1) for line in lines]
+    if priority == PRIORITY_QUANTITY:
+        return [(line.quantity, 1) for line in lines]
+    if priority == PRIORITY_VALUE:
+        # Нулевой приоритет всё же лучше, чем ничего: ценность 1 + приоритет
+        return [(0, 1 + line.priority) for line in lines]
+    return [(index, 1) for index in range(len(lines))]
+
+
+def shortage_info(shortages, material_names=None):
+    material_names = material_names or {}
+    return ', '.join([f"{material_names.get(material, material)}: недостает {amount} ед."
+                      for material, amount in shortages.items()])
+
+
+class FeasibilityEngine:
+    """
+    Проверка наличия сырья и мощности отделов для пачки заявок.
+
+    Сырьё везде идёт по id строки остатков (RawMaterialStock), а не по названию:
+    одноимённое сырьё на разных складах не сливается. Сырьё списывается
+    с временных остатков в порядке ``priority`` (по умолчанию — в порядке строк),
+    остатки после расчёта доступны в ``remaining`` ({id сырья: количество}),
+    а списание по строкам, которым хватило сырья, — в ``draws``
+    ({индекс строки: {id сырья: количество}}; склад — у строки остатков).
+
+    В режиме ALLOCATION_OPTIMIZED сырьё распределяется между складами
+    модулем allocation, а порядок строк не даёт преимущества первым.
+    """
+
+    def __init__(self, lines, allocation=ALLOCATION_SEQUENTIAL, priority=PRIORITY_NONE):
+        self.lines = list(lines)
+        self.allocation_mode = allocation
+        self.priority = priority
+        self.allocation = None
+        self.draws = {}
+        self._load()
+
+    def _load(self):
+        product_ids = {line.product_id for line in self.lines}
+
+        # Продукты вместе с отделами — один запрос
+        self.products = Product.objects.select_related('production_department').in_bulk(product_ids)
+
+        # Рецепты всех продуктов — из кэша справочника, недостающие одним запросом
+        recipes = catalog.get_recipes(product_ids)
+        self.recipes = {
+            product_id: [(material_id, required_quantity) for material_id, _, required_quantity in items]
+            for product_id, items in recipes.items()
+        }
+
+        # Остатки сырья — один запрос: по первичному ключу или, при распределении
+        # между складами, все строки остатков с теми же названиями
+        materials = RawMaterialStock.objects.select_related('stok_id')
+        if self.allocation_mode == ALLOCATION_OPTIMIZED:
+            material_names = {name for items in recipes.values() for _, name, _ in items}
+            self.materials = {material.id: material for material in materials.filter(name__in=material_names)}
+        else:
+            material_ids = {material_id for items in self.recipes.values() for material_id, _ in items}
+            self.materials = materials.in_bulk(material_ids)
+        self.remaining = {material_id: material.quantity for material_id, material in self.materials.items()}
+        self.material_names = self._material_names()
+        self._bom = None
+        self._timeline = None
+
+    def _material_names(self):
+        if self.allocation_mode == ALLOCATION_OPTIMIZED:
+            # Одноимённое сырьё всех складов — один материал
+            return {material_id: material.name for material_id, material in self.materials.items()}
+        # Одноимённое сырьё с разных складов подписываем названием склада
+        counts = defaultdict(int)
+        for material in self.materials.values():
+            counts[material.name] += 1
+        names = {}
+        for material_id, material in self.materials.items():
+            if counts[material.name] > 1 and material.stok_id is not None:
+                names[material_id] = f"{material.name} ({material.stok_id.name})"
+            else:
+                names[material_id] = material.name
+        return names
+
+    def named(self, amounts):
+        """Словарь {id сырья: количество} с подписями сырья вместо id — для вывода."""
+        return {self.material_names.get(material_id, material_id): amount for material_id, amount in amounts.items()}
+
+    def bill_of_materials(self):
+        """Матрица рецептов пачки для векторного расчёта потребности."""
+        if self._bom is None:
+            self._bom = BillOfMaterials(self.recipes)
+        return self._bom
+
+    def total_required_materials(self):
+        """Общая потребность в сырье для всех строк пачки: {id сырья: количество}."""
+        return self.bill_of_materials().totals(self.lines)
+
+    def required_by_warehouse(self):
+        """Потребность пачки с разбивкой по складам: {id склада: {id сырья: количество}}."""
+        breakdown = defaultdict(dict)
+        for material_id, amount in self.total_required_materials().items():
+            material = self.materials.get(material_id)
+            breakdown[material.stok_id_id if material else None][material_id] = amount
+        return dict(breakdown)
+
+    def batch_shortages(self):
+        """Нехватка сырья по всей пачке относительно исходных остатков: {id сырья: количество}."""
+        if self.allocation_mode == ALLOCATION_OPTIMIZED:
+            # Потребность и остатки суммируются по названию сырья со всех складов
+            stock = defaultdict(int)
+            for material in self.materials.values():
+                stock[material.name] += material.quantity
+            shortages = {}
+            required = defaultdict(int)
+            representative = {}
+            for material_id, amount in self.total_required_materials().items():
+                name = self.material_names.get(material_id, material_id)
+                required[name] += amount
+                representative.setdefault(name, material_id)
+            for name, amount in required.items():
+                if amount > stock[name]:
+                    shortages[representative[name]] = amount - stock[name]
+            return shortages
+        stock = {material_id: material.quantity for material_id, material in self.materials.items()}
+        return self.bill_of_materials().shortages(self.lines, stock)
+
+    def consumed(self):
+        """Сколько сырья израсходовано расчётом: {id сырья: количество} — для списания."""
+        return {material_id: material.quantity - self.remaining[material_id]
+                for material_id, material in self.materials.items()}
+
+    def reserved(self, indexes=None):
+        """Сколько сырья забирают строки ``indexes`` (по умолчанию все обеспеченные): {id сырья: количество}."""
+        total = defaultdict(int)
+        for index, draws in self.draws.items():
+            if indexes is None or index in indexes:
+                for material_id, amount in draws.items():
+                    total[material_id] += amount
+        return dict(total)
+
+    def _allocate(self):
+        # Потребность строк по названиям сырья — из матрицы рецептов пачки
+        demands = self.bill_of_materials().line_demands(self.lines, group=self.material_names)
+        # Предпочтительная строка остатков для каждого сырья — первая из рецепта продукта
+        preferred_rows = {}
+        for product_id, items in self.recipes.items():
+            rows = preferred_rows[product_id] = {}
+            for material_id, _ in items:
+                rows.setdefault(self.material_names.get(material_id, material_id), material_id)
+        preferred = [preferred_rows.get(line.product_id, {}) for line in self.lines]
+        supply = defaultdict(list)
+        for material_id, material in self.materials.items():
+            supply[material.name].append((material_id, material.quantity))
+
+        ranks = rank_lines(self.lines, self.priority)
+        self.allocation = allocate(demands, supply, preferred,
+                                   values=[value for _, value in ranks], rank=[rank for rank, _ in ranks])
+        self.remaining.update(self.allocation.remaining)
+        self.draws = self.allocation.draws
+        # Нехватку показываем по строке остатков из рецепта
+        return {index: {preferred[index][name]: amount for name, amount in shortages.items()}
+                for index, shortages in self.allocation.shortages.items()}
+
+    def warehouse_draws(self, index):
+        """Откуда берётся сырьё для строки ``index``: {id склада: {id сырья: количество}}."""
+        draws = defaultdict(dict)
+        for material_id, amount in self.draws.get(index, {}).items():
+            draws[self.materials[material_id].stok_id_id][material_id] = amount
+        return dict(draws)
+
+    def warehouse_info(self, index):
+        """То же, что warehouse_draws, строкой для вывода: «Склад: сырьё — количество, ...; ...»."""
+        parts = []
+        for draws in self.warehouse_draws(index).values():
+            stock = self.materials[next(iter(draws))].stok_id
+            items = ', '.join(f"{self.materials[material_id].name} — {amount}"
+                              for material_id, amount in draws.items())
+            parts.append(f"{stock.name if stock else 'Без склада'}: {items}")
+        return '; '.join(sorted(parts))
+
+    def _check_materials(self, line):
+        shortages = {}
+        for material_id, required_quantity in self.recipes.get(line.product_id, ()):
+            required_amount = required_quantity * line.quantity
+            available_quantity = self.remaining.get(material_id, 0)
+            if available_quantity < required_amount:
+                shortages[material_id] = required_amount - available_quantity
+            else:
+                # Временно вычитаем необходимое количество из доступного
+                self.remaining[material_id] = available_quantity - required_amount
+        return shortages
+
+    def _check_materials_ranked(self):
+        # Строки получают сырьё в порядке ранга (при равенстве — по убыванию ценности)
+        ranks = rank_lines(self.lines, self.priority)
+        order = sorted(range(len(self.lines)), key=lambda index: (ranks[index][0], -ranks[index][1], index))
+        allocated = {}
+        for index in order:
+            line = self.lines[index]
+            allocated[index] = self._check_materials(line)
+            if not allocated[index]:
+                draws = defaultdict(int)
+                for material_id, required_quantity in self.recipes.get(line.product_id, ()):
+                    draws[material_id] += required_quantity * line.quantity
+                self.draws[index] = dict(draws)
+        return allocated
+
+    def load_timeline(self):
+        """Загрузка отделов пачки на окне планирования — читается один раз на расчёт."""
+        if self._timeline is None:
+            # Уже сохранённый план проверяемой заявки не занимает мощность у неё самой
+            order_ids = {line.source.pk for line in self.lines if isinstance(line.source, ManagementOrder)}
+            self._timeline = load_timeline(min(line.start_date for line in self.lines),
+                                           max(line.end_date for line in self.lines),
+                                           {product.production_department_id for product in self.products.values()},
+                                           order_ids)
+        return self._timeline
+
+    def current_load(self, department_id, start_date, end_date):
+        """Утверждённая загрузка отдела в окне, в месяц, без планов самих проверяемых заявок."""
+        return self.load_timeline().monthly_load(department_id, start_date, end_date)
+
+    def schedule(self, indexes):
+        """Расписание строк ``indexes`` по дневной мощности отделов: {индекс строки: ScheduleResult}."""
+        if not indexes:
+            return {}
+        ranks = rank_lines(self.lines, self.priority)
+        jobs = []
+        for index in indexes:
+            line = self.lines[index]
+            rank, value = ranks[index]
+            jobs.append(ScheduleJob(index, self.products[line.product_id].production_department_id,
+                                    line.start_date, line.end_date, line.quantity, rank=(rank, -value)))
+        capacities = {product.production_department_id: product.production_department.average_output
+                      for product in self.products.values()}
+        return schedule(jobs, capacities, timeline=self.load_timeline())
+
+    def evaluate(self, delay_threshold=0):
+        """Вердикты по всем строкам в исходном порядке. Мощность отделов — по расписанию (scheduler)."""
+        if self.allocation_mode == ALLOCATION_OPTIMIZED:
+            allocated = self._allocate()
+        else:
+            allocated = self._check_materials_ranked()
+        # Строки, которым хватило сырья, делят мощность отделов между собой
+        scheduled = self.schedule([index for index in range(len(self.lines)) if not allocated.get(index)])
+        verdicts = []
+        for index, line in enumerate(self.lines):
+            product = self.products[line.product_id]
+            shortages = allocated.get(index)
+            if shortages:
+                verdicts.append(Verdict(line, product, STATUS_SHORTAGE, shortages=shortages,
+                                        material_names=self.material_names))
+            else:
+                verdict = self._scheduled_verdict(line, product, scheduled[index], delay_threshold)
+                verdict.draws = self.warehouse_draws(index)
+                verdict.warehouses = self.warehouse_info(index)
+                verdicts.append(verdict)
+        return verdicts
+
+    def _scheduled_verdict(self, line, product, result, delay_threshold):
+        if result.completion is None:
+            # У отдела нет мощности или срок за пределами календаря — заявка не будет выполнена
+            return Verdict(line, product, STATUS_DELAY, delay=float('inf'))
+        required_months = line.quantity / product.production_department.average_output
+        status = STATUS_DELAY if result.delay_days > delay_threshold else STATUS_OK
+        return Verdict(line, product, status, delay=result.delay_days, required_months=required_months,
+                       completion_date=result.completion,
+                       department_load=self.current_load(product.production_department_id, line.start_date,
+                                                         line.end_date))
+
+
+def evaluate_lines(lines, delay_threshold=0, allocation=ALLOCATION_SEQUENTIAL, priority=PRIORITY_NONE):
+    engine = FeasibilityEngine(lines, allocation=allocation, priority=priority)
+    return engine, engine.evaluate(delay_threshold=delay_threshold)
@@ -1,6 +1,6 @@
 # forms.py
 from django import forms
-from .models import Product
+from .models import Product, RawMaterialStock, Scenario, ScenarioStock, ScenarioCapacity, ScenarioOrder
 from django.contrib.auth.models import User
 class ProductionPlanForm(forms.Form):
     product = forms.ModelChoiceField(queryset=Product.objects.all(), label="Продукт")
@@ -13,4 +13,55 @@ class UserCreationForm(forms.ModelForm):
 
     class Meta:
         model = User
-        fields = ['username', 'email', 'password']
\ No newline at end of file
+        fields = ['username', 'email', 'password']
+
+
+class ScenarioForm(forms.ModelForm):
+    class Meta:
+        model = Scenario
+        fields = ['name', 'order_code']
+        labels = {'name': "Название", 'order_code': "Код заказа"}
+
+
+class MaterialChoiceField(forms.ModelChoiceField):
+    # Одноимённое сырьё на разных складах различаем по складу
+    def label_from_instance(self, material):
+        return f"{material.name} ({material.stok_id.name})" if material.stok_id else material.name
+
+
+class ScenarioStockForm(forms.ModelForm):
+    material = MaterialChoiceField(queryset=RawMaterialStock.objects.select_related('stok_id').order_by('name'),
+                                   label="Сырье")
+    quantity = forms.IntegerField(min_value=0, label="Остаток")
+
+    class Meta:
+        model = ScenarioStock
+        fields = ['material', 'quantity']
+
+
+class ScenarioCapacityForm(forms.ModelForm):
+    average_output = forms.IntegerField(min_value=1, label="Мощность в месяц")
+
+    class Meta:
+        model = ScenarioCapacity
+        fields = ['department', 'average_output']
+        labels = {'department': "Отдел"}
+
+
+class ScenarioOrderForm(forms.ModelForm):
+    quantity = forms.IntegerField(min_value=1, label="Количество")
+
+    class Meta:
+        model = ScenarioOrder
+        fields = ['product', 'start_date', 'end_date', 'quantity', 'priority']
+        labels = {'product': "Продукт", 'start_date': "Дата начала", 'end_date': "Дата окончания",
+                  'priority': "Приоритет"}
+        widgets = {'start_date': forms.DateInput(attrs={'type': 'date'}),
+                   'end_date': forms.DateInput(attrs={'type': 'date'})}
+
+    def clean(self):
+        cleaned_data = super().clean()
+        start_date, end_date = cleaned_data.get('start_date'), cleaned_data.get('end_date')
+        if start_date and end_date and end_date < start_date:
+            raise forms.ValidationError("Дата окончания раньше даты начала")
+        return cleaned_data
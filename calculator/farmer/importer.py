@@ -0,0 +1,304 @@
+# importer.py
+# Пакетный импорт заявок от менеджеров из JSON.
+# Продукты и дубликаты проверяются одним запросом на всю пачку,
+# заявки записываются через bulk_create в одной транзакции.
+# Большие файлы читаются потоково и записываются пачками фиксированного размера.
+
+import codecs
+import json
+
+from django.db import IntegrityError, transaction
+from django.utils.dateparse import parse_date
+
+from .models import Product, ManagementOrder
+from .progress import Progress, STAGE_IMPORT
+
+REQUIRED_FIELDS = ('Order_id', 'product_code', 'start_date', 'end_date', 'quantity')
+
+# Размер пачки, которая проверяется и записывается в одной транзакции
+IMPORT_CHUNK_SIZE = 1000
+# Запросов к БД на одну пачку: продукты, существующие заявки и запись в транзакции
+# (SQLite ограничивает число параметров, поэтому вставка пачки идёт несколькими INSERT)
+IMPORT_BATCH_QUERIES = 10
+# Наибольшая длина кода заказа и наибольшее количество — столько помещается в поля модели
+MAX_ORDER_ID_LENGTH = ManagementOrder._meta.get_field('Order_id').max_length
+MAX_QUANTITY = 2 ** 31 - 1
+# Сколько ошибок хранить в отчёте, чтобы он не рос вместе с файлом
+MAX_REPORTED_ERRORS = 1000
+# Наибольший размер одной строки файла в символах. Строка, которая не разобралась
+# и в таком буфере, считается ошибочной — буфер не дочитывается до конца файла
+MAX_ITEM_SIZE = 1024 * 1024
+# Ошибка JSON дальше этого числа символов от конца буфера не может быть
+# следствием обрезанного куска (самый длинный обрезаемый литерал — -Infinity)
+TRUNCATION_MARGIN = 16
+
+
+class ImportFormatError(ValueError):
+    """
+    Файл не является массивом JSON или NDJSON. ``row`` — номер строки, на которой
+    остановился разбор, ``report`` — отчёт о строках, записанных до неё.
+    """
+
+    def __init__(self, message, row=None, report=None):
+        super().__init__(message)
+        self.row = row
+        self.report = report
+
+
+class ImportReport:
+    """Итог импорта: количество созданных заявок и ошибки по строкам."""
+
+    def __init__(self):
+        self.created = 0
+        self.error_count = 0
+        self.errors = []
+        # Сколько пачек записано в БД
+        self.batches = 0
+
+    def add_error(self, row, error):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'row': row, 'error': error})
+
+    def as_dict(self):
+        return {
+            'created': self.created,
+            'error_count': self.error_count,
+            'errors': sorted(self.errors, key=lambda error: error['row']),
+        }
+
+
+def _parse_item(item):
+    """Проверка одной строки. Возвращает словарь полей или текст ошибки."""
+    if not isinstance(item, dict):
+        return None, 'Строка должна быть объектом JSON.'
+
+    missing = [field for field in REQUIRED_FIELDS if field not in item]
+    if missing:
+        return None, f'Отсутствуют поля: {", ".join(missing)}.'
+
+    try:
+        start_date = parse_date(str(item['start_date']))
+        end_date = parse_date(str(item['end_date']))
+    except ValueError:
+        start_date = end_date = None
+    if start_date is None or end_date is None:
+        return None, 'Неверный формат даты, требуется ГГГГ-ММ-ДД.'
+
+    try:
+        product_code = int(item['product_code'])
+        quantity = int(item['quantity'])
+        # Приоритет необязателен
+        priority = int(item.get('priority', 0))
+    except (TypeError, ValueError):
+        return None, 'Код продукта, количество и приоритет должны быть целыми числами.'
+    if priority < 0:
+        return None, 'Приоритет не может быть отрицательным.'
+    if not 0 < quantity <= MAX_QUANTITY:
+        return None, 'Количество должно быть больше нуля.'
+    if end_date < start_date:
+        return None, 'Дата окончания раньше даты начала.'
+    if len(str(item['Order_id'])) > MAX_ORDER_ID_LENGTH:
+        return None, f'Код заказа длиннее {MAX_ORDER_ID_LENGTH} символов.'
+
+    return {
+        'Order_id': str(item['Order_id']),
+        'product_code': product_code,
+        'start_date': start_date,
+        'end_date': end_date,
+        'quantity': quantity,
+        'priority': priority,
+    }, None
+
+
+def import_batch(items, report, first_row=1):
+    """Импорт одной пачки строк. Ошибочные строки пропускаются и попадают в отчёт."""
+    parsed = []
+    for row, item in enumerate(items, start=first_row):
+        fields, error = _parse_item(item)
+        if error:
+            report.add_error(row, error)
+        else:
+            parsed.append((row, fields))
+
+    if not parsed:
+        return
+
+    # Все продукты пачки — один запрос
+    product_codes = {fields['product_code'] for _, fields in parsed}
+    products = Product.objects.in_bulk(product_codes)
+
+    # Уже существующие заявки с теми же продуктами и датами — один запрос
+    existing = set(ManagementOrder.objects.filter(
+        product_code_id__in=product_codes,
+        start_date__in={fields['start_date'] for _, fields in parsed},
+    ).values_list('product_code_id', 'start_date'))
+
+    new_orders = []
+    new_rows = []
+    for row, fields in parsed:
+        product_code = fields['product_code']
+        key = (product_code, fields['start_date'])
+        if product_code not in products:
+            report.add_error(row, f'Продукт с кодом {product_code} не найден.')
+        elif key in existing:
+            report.add_error(row, f'Заявка с кодом продукта {product_code} на дату {fields["start_date"]} уже существует.')
+        else:
+            # Дубликаты внутри самой пачки тоже отсекаем
+            existing.add(key)
+            new_orders.append(ManagementOrder(
+                Order_id=fields['Order_id'],
+                product_code_id=product_code,
+                start_date=fields['start_date'],
+                end_date=fields['end_date'],
+                quantity=fields['quantity'],
+                priority=fields['priority'],
+            ))
+            new_rows.append(row)
+
+    try:
+        with transaction.atomic():
+            ManagementOrder.objects.bulk_create(new_orders, batch_size=1000)
+    except IntegrityError:
+        # Ограничение уникальности сработало: такие заявки успели добавить параллельно
+        for row in new_rows:
+            report.add_error(row, 'Пачка не записана: заявки с теми же продуктами и датами добавлены параллельно.')
+        report.batches += 1
+        return
+    report.created += len(new_orders)
+    report.batches += 1
+
+
+def import_orders(items, chunk_size=IMPORT_CHUNK_SIZE):
+    """Импорт уже разобранного списка заявок пачками по ``chunk_size`` строк."""
+    report = ImportReport()
+    for start in range(0, len(items), chunk_size):
+        import_batch(items[start:start + chunk_size], report, first_row=start + 1)
+    return report
+
+
+def _decoded(chunks):
+    """Байтовые куски файла -> текстовые куски (UTF-8, с BOM или без)."""
+    decoder = codecs.getincrementaldecoder('utf-8-sig')()
+    for chunk in chunks:
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+    tail = decoder.decode(b'', final=True)
+    if tail:
+        yield tail
+
+
+def iter_json_items(chunks):
+    """
+    Потоковый разбор загруженного файла по одной строке за раз.
+
+    Поддерживается массив JSON (``[{...}, {...}]``) и NDJSON (один объект
+    на строку). В памяти держится только текущий, ещё не разобранный кусок.
+    """
+    decoder = json.JSONDecoder()
+    texts = _decoded(chunks)
+    buffer = ''
+    pos = 0
+    eof = False
+
+    def fill():
+        nonlocal buffer, pos, eof
+        try:
+            buffer = buffer[pos:] + next(texts)
+        except StopIteration:
+            buffer = buffer[pos:]
+            eof = True
+        pos = 0
+
+    def skip(chars):
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos] in chars:
+                pos += 1
+            if pos < len(buffer) or eof:
+                return
+            fill()
+
+    skip(' \t\r\n')
+    if pos >= len(buffer):
+        return
+    is_array = buffer[pos] == '['
+    if is_array:
+        pos += 1
+
+    while True:
+        skip(' \t\r\n,' if is_array else ' \t\r\n')
+        if pos >= len(buffer):
+            if is_array:
+                raise ImportFormatError('Массив JSON не закрыт.')
+            return
+        if is_array and buffer[pos] == ']':
+            return
+        try:
+            item, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError as error:
+            # Дочитываем файл, только если строку мог оборвать край буфера:
+            # иначе на битом файле каждая попытка разбирала бы весь растущий буфер
+            truncated = (error.msg.startswith('Unterminated string')
+                         or len(buffer) - error.pos <= TRUNCATION_MARGIN)
+            if eof or not truncated or len(buffer) - pos > MAX_ITEM_SIZE:
+                raise ImportFormatError('Файл содержит некорректный JSON.')
+            fill()
+            continue
+        # Значение у самого края буфера могло быть обрезано (например, число)
+        if end == len(buffer) and not eof:
+            if len(buffer) - pos > MAX_ITEM_SIZE:
+                raise ImportFormatError('Строка файла слишком большая.')
+            fill()
+            continue
+        pos = end
+        yield item
+
+
+def _counting(chunks, counter):
+    # Сколько байт файла уже прочитано — для оценки оставшегося времени импорта
+    for chunk in chunks:
+        counter[0] += len(chunk)
+        yield chunk
+
+
+def import_stream(chunks, chunk_size=IMPORT_CHUNK_SIZE, progress=None, size=None):
+    """
+    Потоковый импорт: строки разбираются по одной и записываются пачками.
+    В ``progress`` отмечаются записанные строки; ``size`` — размер файла в байтах для оценки остатка.
+    Если файл оказался некорректным, строки до ошибки всё равно записываются,
+    а ImportFormatError несёт номер строки и отчёт о записанном.
+    """
+    progress = progress or Progress()
+    report = ImportReport()
+    read = [0]
+    batch = []
+    first_row = 1
+
+    def flush():
+        import_batch(batch, report, first_row)
+        progress.advance(len(batch), fraction=read[0] / size if size else None)
+
+    progress.start(STAGE_IMPORT)
+    try:
+        for item in iter_json_items(_counting(chunks, read)):
+            batch.append(item)
+            if len(batch) >= chunk_size:
+                flush()
+                first_row += len(batch)
+                batch = []
+        if batch:
+            flush()
+    except ImportFormatError as error:
+        if batch:
+            flush()
+        error.row = first_row + len(batch)
+        error.report = report
+        progress.fail(error)
+        raise
+    except Exception as error:
+        progress.fail(error)
+        raise
+    progress.finish(created=report.created, errors=report.error_count)
+    return report
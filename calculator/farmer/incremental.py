@@ -0,0 +1,217 @@
+# incremental.py
+# Инкрементальный пересчёт возможности производства для группы заявок (заказа).
+# Состояние группы хранится в кэше Django: вердикты заявок и граф зависимостей
+# заявка → рецепт → сырьё → отдел вместе с отпечатками входных данных.
+# При обновлении входные данные читаются фиксированным числом запросов
+# (заявки, остатки сырья, загрузка отделов по дням) и сравниваются с отпечатками;
+# отпечаток загрузки отдела — хэш всех его дней, а не сумма, поэтому перенос
+# загрузки между днями тоже замечается.
+# Пересчитываются только заявки из компонент графа, задетых изменениями:
+# заявки разных компонент не делят ни сырьё, ни мощность отдела, поэтому
+# распределение сырья и расписание внутри компоненты от остальных не зависят.
+# Каждое обновление — новая ревизия состояния; для заявок запоминается ревизия,
+# в которой изменился их вердикт. Поэтому страница плана и клиенты ленты
+# изменений не отбирают изменения друг у друга: каждый спрашивает, что
+# изменилось после ревизии, которую видел он сам.
+
+import hashlib
+import uuid
+from collections import defaultdict
+from datetime import timedelta
+
+from django.core.cache import cache
+
+from . import catalog
+from .feasibility import FeasibilityEngine, OrderLine, ALLOCATION_OPTIMIZED, PRIORITY_NONE
+from .models import DepartmentDailyLoad, ManagementOrder, RawMaterialStock
+from .progress import Progress, STAGE_EVALUATE
+from .scheduler import SCHEDULE_HORIZON_DAYS
+
+# Сколько хранить состояние группы в кэше, секунд
+STATE_TIMEOUT = 24 * 60 * 60
+
+
+def _key(order_code):
+    # Версия в ключе: состояние прежнего формата просто не находится
+    return f'farmer:plan_state:v3:{order_code}'
+
+
+class PlanState:
+    """Сохранённый расчёт группы заявок: вердикты, граф зависимостей и отпечатки входных данных."""
+
+    def __init__(self, priority, version):
+        self.priority = priority
+        self.version = version  # версия справочника рецептов
+        self.orders = {}  # {id заявки: (продукт, отдел, начало, конец, количество, приоритет)}
+        self.requirements = {}  # {id заявки: {название сырья: количество}}
+        self.verdicts = {}  # {id заявки: (статус, сообщение, склады сырья)}
+        self.stock = {}  # {название сырья: ((id строки остатков, количество), ...)}
+        self.departments = {}  # {id отдела: (мощность в месяц, хэш загрузки по дням)}
+        # Состояние с другим поколением (вытеснено из кэша или пересчитано целиком) ревизий не сравнивает
+        self.generation = uuid.uuid4().hex
+        self.revision = 0
+        self.changed_at = {}  # {id заявки: ревизия, в которой изменился вердикт}
+        self.removed_at = {}  # {id удалённой заявки: ревизия удаления}
+
+
+class Refresh:
+    """
+    Итог обновления. ``changed`` — заявки, вердикт которых изменился (в т. ч. новые),
+    ``recomputed`` — пересчитанные заявки, ``removed`` — удалённые из группы.
+    """
+
+    def __init__(self, state, orders, changed, recomputed, removed):
+        self.state = state
+        self.orders = orders
+        self.changed = changed
+        self.recomputed = recomputed
+        self.removed = removed
+
+    @property
+    def token(self):
+        """Ревизия состояния для клиента: её передают обратно в changes_since."""
+        return f'{self.state.generation}:{self.state.revision}'
+
+    def changes_since(self, token):
+        """
+        Заявки, изменившиеся и удалённые после ревизии ``token``: (changed, removed).
+        None, если ревизия не из этого состояния, — тогда клиенту нужен весь заказ заново.
+        """
+        generation, _, revision = (token or '').partition(':')
+        if generation != self.state.generation or not revision.isdigit() or int(revision) > self.state.revision:
+            return None
+        revision = int(revision)
+        return ({order_id for order_id, changed in self.state.changed_at.items() if changed > revision},
+                {order_id for order_id, removed in self.state.removed_at.items() if removed > revision})
+
+    def shortages(self):
+        """Нехватка сырья по всей группе: {название сырья: количество}."""
+        required = defaultdict(int)
+        for materials in self.state.requirements.values():
+            for name, amount in materials.items():
+                required[name] += amount
+        stock = {name: sum(quantity for _, quantity in rows) for name, rows in self.state.stock.items()}
+        return {name: amount - stock.get(name, 0) for name, amount in required.items()
+                if amount > stock.get(name, 0)}
+
+
+def _components(state, seeds):
+    """Все заявки, связанные с ``seeds`` через общее сырьё или отдел."""
+    by_material, by_department = defaultdict(set), defaultdict(set)
+    for order_id, materials in state.requirements.items():
+        for name in materials:
+            by_material[name].add(order_id)
+        by_department[state.orders[order_id][1]].add(order_id)
+
+    affected = set()
+    stack = [order_id for order_id in seeds if order_id in state.orders]
+    while stack:
+        order_id = stack.pop()
+        if order_id in affected:
+            continue
+        affected.add(order_id)
+        neighbours = set(by_department[state.orders[order_id][1]])
+        for name in state.requirements[order_id]:
+            neighbours |= by_material[name]
+        stack.extend(neighbours - affected)
+    return affected
+
+
+def _load_digests(orders, department_ids):
+    # Хэш загрузки отделов по дням за то же окно, что читает планировщик, — один запрос
+    if not orders:
+        return {}
+    start = min(order.start_date for order in orders)
+    end = max(order.end_date for order in orders) + timedelta(days=SCHEDULE_HORIZON_DAYS)
+    rows = DepartmentDailyLoad.objects.filter(day__range=(start, end), department_id__in=department_ids)
+    digests = {}
+    for department_id, day, quantity in rows.order_by('department_id', 'day').values_list(
+            'department_id', 'day', 'quantity'):
+        if not quantity:
+            continue  # пустой день и отсутствующий день для расписания одинаковы
+        if department_id not in digests:
+            digests[department_id] = hashlib.blake2b(digest_size=16)
+        digests[department_id].update(f'{day.isoformat()}={quantity!r};'.encode('ascii'))
+    return {department_id: digest.hexdigest() for department_id, digest in digests.items()}
+
+
+def refresh(order_code, priority=PRIORITY_NONE, progress=None):
+    """
+    Обновить расчёт заказа ``order_code`` и вернуть Refresh.
+    Если сохранённого состояния нет или сменились порядок распределения или рецепты, пересчитывается всё.
+    В ``progress`` отмечаются проверенные заявки.
+    """
+    progress = progress or Progress()
+    orders = list(ManagementOrder.objects.filter(Order_id=order_code).select_related(
+        'product_code', 'product_code__production_department').order_by('pk'))
+    version = catalog.catalog_version()
+    recipes = catalog.get_recipes({order.product_code_id for order in orders})
+
+    previous = cache.get(_key(order_code))
+    if previous is None or previous.priority != priority or previous.version != version:
+        previous = PlanState(priority, version)
+    state = PlanState(priority, version)
+
+    for order in orders:
+        state.orders[order.pk] = (order.product_code_id, order.product_code.production_department_id,
+                                  order.start_date, order.end_date, order.quantity, order.priority)
+        materials = defaultdict(int)
+        for _, name, required_quantity in recipes.get(order.product_code_id, ()):
+            materials[name] += required_quantity * order.quantity
+        state.requirements[order.pk] = dict(materials)
+
+    names = {name for materials in state.requirements.values() for name in materials}
+    stock = defaultdict(list)
+    for material_id, name, quantity in RawMaterialStock.objects.filter(name__in=names).order_by('id').values_list(
+            'id', 'name', 'quantity'):
+        stock[name].append((material_id, quantity))
+    state.stock = {name: tuple(rows) for name, rows in stock.items()}
+
+    department_ids = {department_id for _, department_id, *_ in state.orders.values()}
+    load = _load_digests(orders, department_ids)
+    outputs = {order.product_code.production_department_id: order.product_code.production_department.average_output
+               for order in orders}
+    state.departments = {department_id: (outputs[department_id], load.get(department_id))
+                         for department_id in department_ids}
+
+    # Изменившиеся узлы графа: заявки, сырьё и отделы
+    removed = set(previous.orders) - set(state.orders)
+    dirty_materials = {name for name in names | set(previous.stock)
+                       if state.stock.get(name) != previous.stock.get(name)}
+    dirty_departments = {department_id for department_id in department_ids | set(previous.departments)
+                         if state.departments.get(department_id) != previous.departments.get(department_id)}
+    # Удалённая заявка освобождает сырьё и мощность своих соседей
+    for order_id in removed:
+        dirty_materials |= set(previous.requirements[order_id])
+        dirty_departments.add(previous.orders[order_id][1])
+
+    seeds = {order_id for order_id in state.orders
+             if state.orders[order_id] != previous.orders.get(order_id) or order_id not in previous.verdicts}
+    seeds |= {order_id for order_id, materials in state.requirements.items() if dirty_materials & set(materials)}
+    seeds |= {order_id for order_id, order in state.orders.items() if order[1] in dirty_departments}
+    recomputed = _components(state, seeds)
+
+    # Вердикты незатронутых заявок переносим, затронутые пересчитываем вместе
+    state.verdicts = {order_id: verdict for order_id, verdict in previous.verdicts.items()
+                      if order_id in state.orders and order_id not in recomputed}
+    progress.start(STAGE_EVALUATE, len(recomputed))
+    if recomputed:
+        lines = [OrderLine.from_order(order) for order in orders if order.pk in recomputed]
+        engine = FeasibilityEngine(lines, allocation=ALLOCATION_OPTIMIZED, priority=priority)
+        for verdict in engine.evaluate():
+            state.verdicts[verdict.line.source.pk] = (verdict.status, verdict.message(), verdict.warehouses)
+        progress.advance(len(recomputed))
+
+    changed = {order_id for order_id in recomputed
+               if state.verdicts.get(order_id) != previous.verdicts.get(order_id)}
+    # Ревизии продолжают прежнее поколение, если расчёт не начинался заново
+    state.generation = previous.generation
+    state.revision = previous.revision + 1
+    state.changed_at = {order_id: revision for order_id, revision in previous.changed_at.items()
+                        if order_id in state.orders}
+    state.changed_at.update(dict.fromkeys(changed, state.revision))
+    state.removed_at = dict(previous.removed_at)
+    state.removed_at.update(dict.fromkeys(removed, state.revision))
+    cache.set(_key(order_code), state, timeout=STATE_TIMEOUT)
+    progress.finish(evaluated=len(recomputed), changed=len(changed))
+    return Refresh(state, orders, changed, recomputed, removed)
@@ -0,0 +1,131 @@
+# jobs.py
+# Фоновая генерация документов плана.
+# Задачи хранятся в таблице DocumentJob и выполняются локальным пулом процессов,
+# поэтому веб-воркер не ждёт построения .docx и архива. Задача, которая
+# выполняется дольше DOCUMENT_JOB_TIMEOUT (процесс пула упал или сервер
+# перезапущен), возвращается в очередь, после DOCUMENT_JOB_ATTEMPTS попыток — ошибка.
+# Процесс пула задач рендерит документы сам: параллельность уже даёт пул задач.
+# Отдельный пул рендеринга (DOCUMENT_RENDER_WORKERS) один на процесс и нужен
+# только там, где задачи выполняются по одной, — в команде run_document_jobs.
+
+import multiprocessing
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.db import close_old_connections, connections, transaction
+from django.db.models import F, Q
+from django.urls import reverse
+from django.utils import timezone
+
+from .documents import plan_documents, stream_zip
+from .models import DocumentJob, ProductionPlan
+from .progress import Progress, job_progress_id, STAGE_DOCUMENTS
+
+# Архив до этого размера собирается в памяти, больший — во временном файле
+SPOOL_MAX_SIZE = 10 * 1024 * 1024
+# Сколько может выполняться одна попытка, секунд, и сколько попыток даётся задаче
+DOCUMENT_JOB_TIMEOUT = 30 * 60
+DOCUMENT_JOB_ATTEMPTS = 2
+
+_executor = None
+_render_executor = None
+# Процесс выполняется внутри пула задач
+_in_job_worker = False
+
+
+def _init_worker():
+    global _in_job_worker
+    _in_job_worker = True
+    # В дочернем процессе нельзя использовать соединения с БД родителя
+    import django
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'calculator.settings')
+    django.setup()
+    for connection in connections.all():
+        connection.close()
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        # fork скопировал бы в дочерний процесс потоки и соединения веб-воркера
+        _executor = ProcessPoolExecutor(max_workers=getattr(settings, 'DOCUMENT_JOB_WORKERS', 2),
+                                        mp_context=multiprocessing.get_context('spawn'),
+                                        initializer=_init_worker)
+    return _executor
+
+
+def get_render_executor():
+    """
+    Общий пул рендеринга документов отделов или None — рендерить в текущем процессе.
+    В процессах пула задач свой пул не создаётся: иначе каждая задача держала бы ещё
+    DOCUMENT_RENDER_WORKERS процессов.
+    """
+    global _render_executor
+    workers = getattr(settings, 'DOCUMENT_RENDER_WORKERS', 1)
+    if _in_job_worker or workers <= 1:
+        return None
+    if _render_executor is None:
+        _render_executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+    return _render_executor
+
+
+def submit(job):
+    """Поставить задачу в пул после фиксации транзакции, в которой она создана."""
+    transaction.on_commit(lambda: get_executor().submit(run_job, job.pk))
+
+
+def run_job(job_id):
+    """Выполнить задачу. Вызывается в процессе пула или из команды run_document_jobs."""
+    close_old_connections()
+    # Забираем задачу, только если её ещё никто не начал выполнять
+    if not DocumentJob.objects.filter(pk=job_id, status=DocumentJob.STATUS_PENDING).update(
+            status=DocumentJob.STATUS_RUNNING, started_at=timezone.now(), attempts=F('attempts') + 1):
+        return
+    job = DocumentJob.objects.get(pk=job_id)
+    progress = Progress(job_progress_id(job_id))
+    try:
+        plans = list(ProductionPlan.objects.filter(pk__in=job.plan_ids)
+                     .select_related('order', 'product__production_department').order_by('pk'))
+        # Документ на каждый отдел и отчёт для менеджеров
+        total = len({plan.product.production_department.name for plan in plans}) + 1
+        # Архив пишется потоково; в памяти держится не больше SPOOL_MAX_SIZE байт
+        with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE) as archive:
+            documents = plan_documents(plans, job.manager_report, get_render_executor())
+            files = progress.iterate(documents, STAGE_DOCUMENTS, total)
+            for chunk in stream_zip(files):
+                archive.write(chunk)
+            archive.seek(0)
+            job.result.save(f'{job.order_code}_{job.pk}.zip', File(archive), save=False)
+        job.status = DocumentJob.STATUS_DONE
+    except Exception as e:
+        job.status = DocumentJob.STATUS_FAILED
+        job.error = str(e)
+    job.finished_at = timezone.now()
+    job.save()
+    if job.status == DocumentJob.STATUS_DONE:
+        progress.finish(download_url=reverse('farmer:document_job_download', args=[job.pk]))
+    else:
+        progress.fail(job.error)
+    return job.status
+
+
+def recover_stale_jobs():
+    """
+    Задачи, которые выполняются дольше DOCUMENT_JOB_TIMEOUT, вернуть в очередь,
+    а исчерпавшие попытки — завершить с ошибкой. Возвращает (возвращено, завершено).
+    """
+    now = timezone.now()
+    cutoff = now - timedelta(seconds=getattr(settings, 'DOCUMENT_JOB_TIMEOUT', DOCUMENT_JOB_TIMEOUT))
+    attempts = getattr(settings, 'DOCUMENT_JOB_ATTEMPTS', DOCUMENT_JOB_ATTEMPTS)
+    stale = DocumentJob.objects.filter(
+        Q(started_at__lt=cutoff) | Q(started_at__isnull=True, created_at__lt=cutoff),
+        status=DocumentJob.STATUS_RUNNING,
+    )
+    failed = stale.filter(attempts__gte=attempts).update(
+        status=DocumentJob.STATUS_FAILED, error='Задача не завершилась за отведённое время.', finished_at=now)
+    requeued = stale.filter(attempts__lt=attempts).update(status=DocumentJob.STATUS_PENDING)
+    return requeued, failed
@@ -0,0 +1,173 @@
+# listing.py
+# Общая инфраструктура списков: поиск и фильтры на стороне сервера
+# (те же поля, что объявлены в admin.py), постраничный вывод по ключу
+# (keyset/cursor) вместо OFFSET и необязательный вывод в JSON (?format=json).
+
+import base64
+import json
+from datetime import date
+
+from django.core.exceptions import ValidationError
+from django.db.models import BooleanField, Q
+from django.http import JsonResponse
+
+# Размер страницы по умолчанию и максимальный, который можно запросить через ?limit=
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+SEARCH_PARAM = 'q'
+CURSOR_PARAM = 'after'
+LIMIT_PARAM = 'limit'
+FORMAT_PARAM = 'format'
+
+
+def encode_cursor(values):
+    data = json.dumps([value.isoformat() if isinstance(value, date) else value for value in values])
+    return base64.urlsafe_b64encode(data.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+    except (ValueError, UnicodeError):
+        return None
+    return values if isinstance(values, list) else None
+
+
+def _field_value(obj, field):
+    if isinstance(obj, dict):
+        return obj[field]
+    for part in field.split('__'):
+        if obj is None:
+            return None
+        obj = getattr(obj, part)
+    return obj
+
+
+def _after(keyset, values):
+    """Условие «строго после курсора» для сортировки по возрастанию полей ``keyset``."""
+    condition = Q()
+    for i in reversed(range(len(keyset))):
+        step = Q(**{f'{keyset[i]}__gt': values[i]})
+        if i < len(keyset) - 1:
+            step |= Q(**{keyset[i]: values[i]}) & condition
+        condition = step
+    return condition
+
+
+class KeysetPage:
+    """Одна страница списка и курсор следующей страницы."""
+
+    def __init__(self, object_list, next_cursor, params):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.has_next = next_cursor is not None
+        # Параметры запроса без курсора — для ссылок «далее» и «в начало»
+        self.params = params
+
+    @property
+    def next_query(self):
+        params = self.params.copy()
+        params[CURSOR_PARAM] = self.next_cursor
+        return params.urlencode()
+
+    @property
+    def first_query(self):
+        return self.params.urlencode()
+
+
+def search_queryset(queryset, params, search_fields=(), list_filter=()):
+    """
+    Поиск по ``search_fields`` (как в admin) и точные фильтры по ``list_filter``.
+    Значение фильтра, которое не подходит полю (например, дата «xx»), не применяется.
+    """
+    term = params.get(SEARCH_PARAM, '').strip()
+    if term and search_fields:
+        condition = Q()
+        for field in search_fields:
+            condition |= Q(**{f'{field}__icontains': term})
+        queryset = queryset.filter(condition)
+
+    for field in list_filter:
+        value = params.get(field)
+        if value in (None, ''):
+            continue
+        model_field = queryset.model._meta.get_field(field)
+        if isinstance(model_field, BooleanField):
+            value = value.lower() in ('1', 'true', 'yes', 'да')
+        else:
+            try:
+                value = model_field.to_python(value)
+            except ValidationError:
+                continue
+        queryset = queryset.filter(**{field: value})
+    return queryset
+
+
+def paginate_keyset(request, queryset, keyset=('pk',), search_fields=(), list_filter=(), page_size=PAGE_SIZE):
+    """
+    Страница ``queryset`` после курсора ?after=..., отсортированная по ``keyset``.
+    Последнее поле ``keyset`` должно быть уникальным (обычно pk).
+    """
+    params = request.GET.copy()
+    queryset = search_queryset(queryset, params, search_fields, list_filter)
+
+    try:
+        limit = max(1, min(int(params.get(LIMIT_PARAM, page_size)), MAX_PAGE_SIZE))
+    except ValueError:
+        limit = page_size
+
+    cursor = params.pop(CURSOR_PARAM, [None])[-1]
+    values = decode_cursor(cursor) if cursor else None
+    if values is not None and len(values) == len(keyset):
+        queryset = queryset.filter(_after(keyset, values))
+
+    rows = list(queryset.order_by(*keyset)[:limit + 1])
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor([_field_value(rows[-1], field) for field in keyset])
+    return KeysetPage(rows, next_cursor, params)
+
+
+def wants_json(request):
+    return request.GET.get(FORMAT_PARAM) == 'json'
+
+
+def page_json(page, rows):
+    return JsonResponse({'results': rows, 'next': page.next_cursor}, json_dumps_params={'ensure_ascii': False})
+
+
+class KeysetListMixin:
+    """
+    Примесь для ListView: поиск, фильтры и keyset-пагинация.
+
+    ``admin_class`` — класс из admin.py, откуда берутся search_fields и list_filter.
+    ``json_fields`` — поля для вывода в JSON (?format=json).
+    """
+
+    admin_class = None
+    keyset = ('pk',)
+    page_size = PAGE_SIZE
+    json_fields = ()
+
+    def get_page(self):
+        search_fields = getattr(self.admin_class, 'search_fields', ())
+        list_filter = getattr(self.admin_class, 'list_filter', ())
+        return paginate_keyset(self.request, self.get_queryset(), self.keyset, search_fields, list_filter,
+                               self.page_size)
+
+    def get(self, request, *args, **kwargs):
+        self.page = self.get_page()
+        self.object_list = self.page.object_list
+        if wants_json(request):
+            return page_json(self.page, [{field: _field_value(obj, field) for field in self.json_fields}
+                                         for obj in self.object_list])
+        context = self.get_context_data()
+        return self.render_to_response(context)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['page'] = self.page
+        context['search'] = self.request.GET.get(SEARCH_PARAM, '')
+        return context
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from farmer import timeline
+
+
+class Command(BaseCommand):
+    help = 'Полный пересчёт загрузки производственных отделов по дням'
+
+    def handle(self, *args, **options):
+        days = timeline.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Пересчитано записей загрузки: {days}'))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from farmer import jobs
+from farmer.models import DocumentJob
+
+
+class Command(BaseCommand):
+    help = 'Выполнить задачи генерации документов, оставшиеся в очереди, и зависшие задачи'
+
+    def handle(self, *args, **options):
+        requeued, failed = jobs.recover_stale_jobs()
+        if requeued or failed:
+            self.stdout.write(f'Зависших задач: возвращено в очередь {requeued}, завершено с ошибкой {failed}')
+        job_ids = DocumentJob.objects.filter(status=DocumentJob.STATUS_PENDING).order_by('pk').values_list(
+            'pk', flat=True)
+        for job_id in job_ids:
+            status = jobs.run_job(job_id)
+            self.stdout.write(f'Задача {job_id}: {status}')
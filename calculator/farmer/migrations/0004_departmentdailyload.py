@@ -0,0 +1,50 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:49
+
+from collections import defaultdict
+from datetime import timedelta
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def fill_daily_load(apps, schema_editor):
+    # Заполняем таблицу загрузки по уже существующим планам
+    ProductionPlan = apps.get_model('farmer', 'ProductionPlan')
+    DepartmentDailyLoad = apps.get_model('farmer', 'DepartmentDailyLoad')
+    load = defaultdict(float)
+    plans = ProductionPlan.objects.values_list('product__production_department_id', 'order__start_date',
+                                               'order__end_date', 'planned_quantity')
+    for department_id, start_date, end_date, planned_quantity in plans.iterator():
+        days = (end_date - start_date).days + 1
+        if days <= 0:
+            continue
+        for offset in range(days):
+            load[(department_id, start_date + timedelta(days=offset))] += planned_quantity / days
+    DepartmentDailyLoad.objects.bulk_create(
+        [DepartmentDailyLoad(department_id=department_id, day=day, quantity=quantity)
+         for (department_id, day), quantity in load.items()],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('farmer', '0003_stock_rawmaterialstock_stok_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DepartmentDailyLoad',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('quantity', models.FloatField(default=0)),
+                ('department', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='farmer.productiondepartment')),
+            ],
+            options={
+                'unique_together': {('department', 'day')},
+            },
+        ),
+        migrations.RunPython(fill_daily_load, migrations.RunPython.noop),
+    ]
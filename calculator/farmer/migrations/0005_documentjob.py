@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('farmer', '0004_departmentdailyload'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('order_code', models.CharField(max_length=100)),
+                ('status', models.CharField(choices=[('pending', 'В очереди'), ('running', 'Выполняется'), ('done', 'Готово'), ('failed', 'Ошибка')], default='pending', max_length=20)),
+                ('plan_ids', models.JSONField(default=list)),
+                ('manager_report', models.JSONField(default=list)),
+                ('result', models.FileField(blank=True, upload_to='plan_documents/')),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
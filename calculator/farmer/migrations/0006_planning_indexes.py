@@ -0,0 +1,73 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:03
+
+from django.db import migrations, models
+from django.db.models import Count
+
+# GiST-индекс по периоду заявки для запросов пересечения (&&) на PostgreSQL.
+# На других СУБД используется обычный индекс farmer_order_period_idx.
+PERIOD_GIST_INDEX = 'farmer_order_period_gist'
+
+
+def check_order_periods(apps, schema_editor):
+    # daterange не строится, если конец раньше начала, — сообщаем, какие заявки мешают индексу
+    ManagementOrder = apps.get_model('farmer', 'ManagementOrder')
+    invalid = list(ManagementOrder.objects.filter(end_date__lt=models.F('start_date'))
+                   .values_list('id', 'start_date', 'end_date')[:20])
+    if invalid:
+        info = ', '.join(f"заявка {pk}: {start_date} — {end_date}" for pk, start_date, end_date in invalid)
+        raise RuntimeError(f"Найдены заявки с окончанием раньше начала, исправьте их перед миграцией: {info}")
+
+
+def create_period_gist_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        f"CREATE INDEX IF NOT EXISTS {PERIOD_GIST_INDEX} ON farmer_managementorder "
+        f"USING gist (daterange(start_date, end_date, '[]'))"
+    )
+
+
+def drop_period_gist_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(f"DROP INDEX IF EXISTS {PERIOD_GIST_INDEX}")
+
+
+def check_duplicate_orders(apps, schema_editor):
+    # Ограничение уникальности не создастся, если дубликаты уже есть, — сообщаем, какие именно
+    ManagementOrder = apps.get_model('farmer', 'ManagementOrder')
+    duplicates = list(ManagementOrder.objects.values('product_code_id', 'start_date')
+                      .annotate(total=Count('id')).filter(total__gt=1)[:20])
+    if duplicates:
+        info = ', '.join(f"продукт {row['product_code_id']} на {row['start_date']} ({row['total']} шт.)"
+                         for row in duplicates)
+        raise RuntimeError(f"Найдены повторяющиеся заявки, удалите их перед миграцией: {info}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('farmer', '0005_documentjob'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='managementorder',
+            index=models.Index(fields=['Order_id'], name='farmer_order_code_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='managementorder',
+            index=models.Index(fields=['start_date', 'end_date'], name='farmer_order_period_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='rawmaterialstock',
+            index=models.Index(fields=['name'], name='farmer_stock_name_idx'),
+        ),
+        migrations.RunPython(check_order_periods, migrations.RunPython.noop),
+        migrations.RunPython(create_period_gist_index, drop_period_gist_index),
+        migrations.RunPython(check_duplicate_orders, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='managementorder',
+            constraint=models.UniqueConstraint(fields=('product_code', 'start_date'), name='farmer_order_product_start_uniq'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('farmer', '0006_planning_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='managementorder',
+            name='priority',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:11
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('farmer', '0007_managementorder_priority'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Scenario',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('order_code', models.CharField(blank=True, max_length=100)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ScenarioOrder',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start_date', models.DateField()),
+                ('end_date', models.DateField()),
+                ('quantity', models.IntegerField()),
+                ('priority', models.PositiveIntegerField(default=0)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='farmer.product')),
+                ('scenario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='extra_orders', to='farmer.scenario')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ScenarioCapacity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('average_output', models.IntegerField()),
+                ('department', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='farmer.productiondepartment')),
+                ('scenario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='capacity_overrides', to='farmer.scenario')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('scenario', 'department'), name='farmer_scenario_capacity_uniq')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ScenarioStock',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.IntegerField()),
+                ('material', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='farmer.rawmaterialstock')),
+                ('scenario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_overrides', to='farmer.scenario')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('scenario', 'material'), name='farmer_scenario_stock_uniq')],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('farmer', '0008_scenarios'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='documentjob',
+            name='attempts',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='documentjob',
+            name='started_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
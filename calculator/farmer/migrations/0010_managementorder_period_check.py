@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 21:10
+
+from django.db import migrations, models
+
+
+def check_order_periods(apps, schema_editor):
+    # Ограничение не создастся, если такие заявки уже есть, — сообщаем, какие именно
+    ManagementOrder = apps.get_model('farmer', 'ManagementOrder')
+    invalid = list(ManagementOrder.objects.filter(end_date__lt=models.F('start_date'))
+                   .values_list('id', 'start_date', 'end_date')[:20])
+    if invalid:
+        info = ', '.join(f"заявка {pk}: {start_date} — {end_date}" for pk, start_date, end_date in invalid)
+        raise RuntimeError(f"Найдены заявки с окончанием раньше начала, исправьте их перед миграцией: {info}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('farmer', '0009_documentjob_attempts'),
+    ]
+
+    operations = [
+        migrations.RunPython(check_order_periods, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='managementorder',
+            constraint=models.CheckConstraint(condition=models.Q(end_date__gte=models.F('start_date')),
+                                              name='farmer_order_period_check'),
+        ),
+    ]
@@ -35,9 +35,30 @@ class ManagementOrder(models.Model):   # Заявки от менеджеров
     end_date = models.DateField()  # дата конца
     # Запланированное количество продукции
     quantity = models.IntegerField()  # количество
+    # Приоритет заявки при распределении дефицитного сырья (больше — важнее)
+    priority = models.PositiveIntegerField(default=0)  # приоритет
+
+    class Meta:
+        indexes = [
+            # Выборка всех строк заказа по коду
+            models.Index(fields=['Order_id'], name='farmer_order_code_idx'),
+            # Пересечение сроков; на PostgreSQL дополнительно есть GiST-индекс по daterange (миграция 0006)
+            models.Index(fields=['start_date', 'end_date'], name='farmer_order_period_idx'),
+        ]
+        constraints = [
+            # Одна заявка на продукт и дату начала; проверка дубликатов при импорте идёт по этому индексу
+            models.UniqueConstraint(fields=['product_code', 'start_date'], name='farmer_order_product_start_uniq'),
+            # Период заявки не бывает пустым: на нём строится GiST-индекс по daterange
+            models.CheckConstraint(condition=models.Q(end_date__gte=models.F('start_date')),
+                                   name='farmer_order_period_check'),
+        ]
 
     def __str__(self):
-        return f"Order {self.Order_id} for {self.product_code.name}"
+        # Название продукта выводим, только если он уже загружен (select_related),
+        # иначе каждая выведенная заявка стоила бы отдельного запроса
+        if ManagementOrder.product_code.is_cached(self):
+            return f"Order {self.Order_id} for {self.product_code.name}"
+        return f"Order {self.Order_id} for product #{self.product_code_id}"
 
 
 
@@ -55,6 +76,12 @@ class RawMaterialStock(models.Model):  # Остатки на складах
     # Склад
     stok_id = models.ForeignKey(Stock, on_delete=models.CASCADE, null=True)
 
+    class Meta:
+        indexes = [
+            # Поиск сырья по названию в списках и справочниках
+            models.Index(fields=['name'], name='farmer_stock_name_idx'),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -82,3 +109,114 @@ class ProductionPlan(models.Model):  # Производственный план
     def __str__(self):
         return f"{self.order} - {self.product}"
 
+
+class DepartmentDailyLoad(models.Model):  # Загрузка отделов по дням
+    # Производственный отдел
+    department = models.ForeignKey(ProductionDepartment, on_delete=models.CASCADE)  # отдел
+    # День
+    day = models.DateField()  # день
+    # Запланированное на этот день количество продукции
+    quantity = models.FloatField(default=0)  # количество
+
+    class Meta:
+        unique_together = ('department', 'day')
+
+    def __str__(self):
+        return f"{self.department} - {self.day}: {self.quantity}"
+
+class DocumentJob(models.Model):  # Фоновая генерация документов плана
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'В очереди'),
+        (STATUS_RUNNING, 'Выполняется'),
+        (STATUS_DONE, 'Готово'),
+        (STATUS_FAILED, 'Ошибка'),
+    ]
+
+    # Код заказа, для которого создаются документы
+    order_code = models.CharField(max_length=100)  # код заказа
+    # Статус задачи
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING)  # статус
+    # Сохранённые планы, по которым строятся документы отделов
+    plan_ids = models.JSONField(default=list)  # планы
+    # Отчёт для менеджеров: список пар [продукт, проблема]
+    manager_report = models.JSONField(default=list)  # отчёт
+    # Готовый архив с документами
+    result = models.FileField(upload_to='plan_documents/', blank=True)  # архив
+    # Текст ошибки, если генерация не удалась
+    error = models.TextField(blank=True)  # ошибка
+    # Сколько раз задачу начинали выполнять
+    attempts = models.PositiveIntegerField(default=0)  # попытки
+    # Время создания, начала последней попытки и завершения
+    created_at = models.DateTimeField(auto_now_add=True)  # создана
+    started_at = models.DateTimeField(null=True, blank=True)  # начата
+    finished_at = models.DateTimeField(null=True, blank=True)  # завершена
+
+    def __str__(self):
+        return f"Job {self.pk} for {self.order_code}: {self.status}"
+
+
+class Scenario(models.Model):  # Сценарий «что если»
+    # Название сценария
+    name = models.CharField(max_length=100)  # название
+    # Код заказа, заявки которого входят в сценарий (может быть пустым)
+    order_code = models.CharField(max_length=100, blank=True)  # код заказа
+    # Время создания
+    created_at = models.DateTimeField(auto_now_add=True)  # создан
+
+    def __str__(self):
+        return self.name
+
+
+class ScenarioStock(models.Model):  # Остаток сырья в сценарии
+    # Сценарий
+    scenario = models.ForeignKey(Scenario, on_delete=models.CASCADE, related_name='stock_overrides')  # сценарий
+    # Сырьё, остаток которого подменяется
+    material = models.ForeignKey(RawMaterialStock, on_delete=models.CASCADE)  # сырье
+    # Остаток в сценарии вместо текущего
+    quantity = models.IntegerField()  # количество
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['scenario', 'material'], name='farmer_scenario_stock_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.scenario} - {self.material}: {self.quantity}"
+
+
+class ScenarioCapacity(models.Model):  # Мощность отдела в сценарии
+    # Сценарий
+    scenario = models.ForeignKey(Scenario, on_delete=models.CASCADE, related_name='capacity_overrides')  # сценарий
+    # Отдел, мощность которого подменяется
+    department = models.ForeignKey(ProductionDepartment, on_delete=models.CASCADE)  # отдел
+    # Среднее количество продукции в месяц в сценарии
+    average_output = models.IntegerField()  # среднее количество
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['scenario', 'department'], name='farmer_scenario_capacity_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.scenario} - {self.department}: {self.average_output}"
+
+
+class ScenarioOrder(models.Model):  # Дополнительная заявка в сценарии
+    # Сценарий
+    scenario = models.ForeignKey(Scenario, on_delete=models.CASCADE, related_name='extra_orders')  # сценарий
+    # Продукт
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)  # продукт
+    # Сроки производства
+    start_date = models.DateField()  # дата начала
+    end_date = models.DateField()  # дата конца
+    # Количество продукции
+    quantity = models.IntegerField()  # количество
+    # Приоритет заявки при распределении дефицитного сырья
+    priority = models.PositiveIntegerField(default=0)  # приоритет
+
+    def __str__(self):
+        return f"{self.scenario} - {self.product}: {self.quantity}"
@@ -0,0 +1,88 @@
+# offload.py
+# Синхронная работа асинхронных представлений: расчёт плана, импорт, запись в БД.
+# Функция выполняется в пуле потоков, у каждого потока своё соединение с БД,
+# поэтому цикл событий не блокируется и долгий расчёт одного планировщика не
+# задерживает запросы остальных. Контекст (contextvars) копируется в поток,
+# чтобы запросы учитывались в бюджете текущего HTTP-запроса.
+# PLANNING_WORKERS = 0 выполняет функцию через sync_to_async в общем потоке
+# синхронного кода — с тем же соединением с БД (для отладки и тестов).
+# Здесь же разбор тела запроса для асинхронных представлений и потоковые
+# ответы из синхронных генераторов, которые под ASGI не должны собираться целиком.
+
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import close_old_connections
+
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=getattr(settings, 'PLANNING_WORKERS', 4),
+                                       thread_name_prefix='farmer-planning')
+    return _executor
+
+
+def _run(func, args, kwargs):
+    # Как в начале и в конце обычного запроса: закрываем устаревшие соединения потока
+    close_old_connections()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+async def run_in_pool(func, *args, **kwargs):
+    """Выполнить синхронную ``func`` в пуле потоков и дождаться результата."""
+    if not getattr(settings, 'PLANNING_WORKERS', 4):
+        return await sync_to_async(func)(*args, **kwargs)
+    context = contextvars.copy_context()
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), partial(context.run, _run, func, args, kwargs))
+
+
+def _load_body(request):
+    # Обращение к FILES разбирает тело запроса целиком: и поля формы, и файлы
+    return request.FILES
+
+
+async def load_body(request):
+    """
+    Разобрать POST и FILES в пуле потоков. Разбор multipart читает тело и пишет
+    большие файлы на диск синхронно — в цикле событий он задержал бы все запросы.
+    """
+    await run_in_pool(_load_body, request)
+
+
+async def aiterate(iterable):
+    """
+    Асинхронный итератор поверх синхронного: каждый следующий кусок берётся
+    через sync_to_async. Все куски берутся в одном потоке синхронного кода,
+    поэтому курсор БД генератора не переходит между соединениями.
+    """
+    iterator = iter(iterable)
+    done = object()
+    next_chunk = sync_to_async(next)
+    while True:
+        chunk = await next_chunk(iterator, done)
+        if chunk is done:
+            return
+        yield chunk
+
+
+def streaming_content(request, iterable):
+    """
+    Содержимое StreamingHttpResponse из синхронного генератора. Под ASGI Django
+    собрал бы синхронный генератор в список целиком, поэтому отдаётся асинхронный
+    итератор по одному куску; под WSGI — сам генератор.
+    """
+    if isinstance(request, ASGIRequest):
+        return aiterate(iterable)
+    return iterable
@@ -0,0 +1,38 @@
+# periods.py
+# Условие «период заявки пересекается с окном» для фильтров ORM.
+# На PostgreSQL условие записывается как пересечение диапазонов daterange (&&),
+# чтобы использовать GiST-индекс farmer_order_period_gist; на других СУБД —
+# обычными сравнениями дат по индексу farmer_order_period_idx.
+
+from django.db.models import BooleanField, F, Func, Value
+from django.db.models.fields import DateField
+
+
+class PeriodOverlaps(Func):
+    """Истина, если период [start_field, end_field] пересекается с [start, end] (границы включительно)."""
+
+    output_field = BooleanField()
+
+    def __init__(self, start, end, prefix=''):
+        super().__init__(F(f'{prefix}start_date'), F(f'{prefix}end_date'),
+                         Value(start, output_field=DateField()), Value(end, output_field=DateField()))
+
+    def _compile(self, compiler):
+        return [compiler.compile(expression) for expression in self.get_source_expressions()]
+
+    def as_sql(self, compiler, connection, **extra_context):
+        (start_field, start_field_params), (end_field, end_field_params), (start, start_params), (end, end_params) = \
+            self._compile(compiler)
+        sql = f'({end_field} >= {start} AND {start_field} <= {end})'
+        return sql, (*end_field_params, *start_params, *start_field_params, *end_params)
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        (start_field, start_field_params), (end_field, end_field_params), (start, start_params), (end, end_params) = \
+            self._compile(compiler)
+        sql = f"daterange({start_field}, {end_field}, '[]') && daterange({start}, {end}, '[]')"
+        return sql, (*start_field_params, *end_field_params, *start_params, *end_params)
+
+
+def overlapping(queryset, start, end, prefix=''):
+    """Строки ``queryset``, период которых (поля ``prefix``start_date/end_date) пересекается с окном."""
+    return queryset.filter(PeriodOverlaps(start, end, prefix))
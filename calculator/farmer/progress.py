@@ -0,0 +1,185 @@
+# progress.py
+# Прогресс долгих операций: импорт заявок, расчёт и сохранение плана, документы.
+# Операция пишет состояние текущего этапа в кэш Django по id прогресса: сколько
+# сделано из скольких, скорость и оставшееся время, а также время уже пройденных
+# этапов. Id прогресса создаёт страница и передаёт вместе с формой, у задачи
+# документов это «job-<id задачи>». Кэш общий для процессов, поэтому прогресс
+# виден и из пула документов. Представление progress_events отдаёт состояние
+# потоком server-sent events. Поток держится асинхронным генератором и работает
+# только под ASGI: под WSGI Django собрал бы его целиком, поэтому там (и по
+# ?format=json) представление отвечает текущим состоянием, а страница его опрашивает.
+
+import asyncio
+import json
+import re
+import time
+
+from django.core.cache import cache
+
+# Сколько хранить состояние в кэше, секунд
+PROGRESS_TIMEOUT = 60 * 60
+# Как часто писать состояние в кэш и опрашивать его, секунд
+PROGRESS_INTERVAL = 0.5
+# Сколько держать открытым поток событий и как часто слать пустой комментарий,
+# чтобы прокси не закрыли соединение, секунд
+STREAM_TIMEOUT = 30 * 60
+KEEPALIVE_INTERVAL = 15
+
+PROGRESS_ID_RE = re.compile(r'^[-\w]{1,64}$', re.ASCII)
+
+STAGE_IMPORT = 'import'
+STAGE_EVALUATE = 'evaluate'
+STAGE_SAVE = 'save'
+STAGE_DOCUMENTS = 'documents'
+STAGE_LABELS = {
+    STAGE_IMPORT: 'Импорт строк',
+    STAGE_EVALUATE: 'Проверка заявок',
+    STAGE_SAVE: 'Сохранение плана',
+    STAGE_DOCUMENTS: 'Формирование документов',
+}
+
+STATUS_RUNNING = 'running'
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+
+
+def _key(progress_id):
+    return f'farmer:progress:{progress_id}'
+
+
+def job_progress_id(job_id):
+    """Id прогресса задачи документов."""
+    return f'job-{job_id}'
+
+
+def read(progress_id):
+    """Последнее записанное состояние или None."""
+    return cache.get(_key(progress_id))
+
+
+async def aread(progress_id):
+    """То же, что read, для асинхронных представлений."""
+    return await cache.aget(_key(progress_id))
+
+
+class Stage:
+    """Этап операции: сделано ``done`` из ``total`` (если известно) с момента ``started``."""
+
+    def __init__(self, name, total=None):
+        self.name = name
+        self.total = total
+        self.done = 0
+        self.fraction = None  # доля выполненного, если ``total`` неизвестен
+        self.started = time.monotonic()
+
+    def as_dict(self, now):
+        elapsed = now - self.started
+        rate = self.done / elapsed if elapsed > 0 else None
+        fraction = self.done / self.total if self.total else self.fraction
+        eta = None
+        if fraction and elapsed > 0:
+            eta = max(elapsed * (1 - fraction) / fraction, 0)
+        return {
+            'stage': self.name,
+            'label': STAGE_LABELS.get(self.name, self.name),
+            'done': self.done,
+            'total': self.total,
+            'percent': round(min(fraction, 1) * 100, 1) if fraction is not None else None,
+            'elapsed': round(elapsed, 3),
+            'rate': round(rate, 1) if rate is not None else None,
+            'eta': round(eta, 1) if eta is not None else None,
+        }
+
+
+class Progress:
+    """
+    Прогресс одной операции. Без id (никто не подписан) ничего не пишет,
+    поэтому вызывающий код не проверяет, нужен ли прогресс.
+    """
+
+    def __init__(self, progress_id=None):
+        self.progress_id = progress_id if progress_id and PROGRESS_ID_RE.match(progress_id) else None
+        self.current = None
+        self.finished = []  # итоги пройденных этапов
+        self._written = 0
+
+    def start(self, stage, total=None):
+        """Начать этап; предыдущий этап считается завершённым."""
+        self._close_stage()
+        self.current = Stage(stage, total)
+        self._write(STATUS_RUNNING, force=True)
+
+    def advance(self, count=1, fraction=None):
+        """Отметить ``count`` выполненных единиц; ``fraction`` — доля этапа, если total неизвестен."""
+        if self.current is None:
+            return
+        self.current.done += count
+        if fraction is not None:
+            self.current.fraction = fraction
+        self._write(STATUS_RUNNING)
+
+    def iterate(self, items, stage, total=None):
+        """Пройти ``items`` этапом ``stage``, отмечая каждый элемент."""
+        self.start(stage, total)
+        for item in items:
+            yield item
+            self.advance()
+
+    def finish(self, **result):
+        self._close_stage()
+        self._write(STATUS_DONE, force=True, result=result)
+
+    def fail(self, error):
+        self._close_stage()
+        self._write(STATUS_FAILED, force=True, error=str(error))
+
+    def _close_stage(self):
+        if self.current is not None:
+            self.finished.append(self.current.as_dict(time.monotonic()))
+            self.current = None
+
+    def _write(self, status, force=False, **extra):
+        if self.progress_id is None:
+            return
+        now = time.monotonic()
+        # Частые отметки не пишем в кэш чаще, чем его опрашивает поток событий
+        if not force and now - self._written < PROGRESS_INTERVAL:
+            return
+        self._written = now
+        state = {
+            'id': self.progress_id,
+            'status': status,
+            'current': self.current.as_dict(now) if self.current is not None else None,
+            'stages': self.finished,
+            'updated_at': time.time(),
+        }
+        state.update(extra)
+        cache.set(_key(self.progress_id), state, timeout=PROGRESS_TIMEOUT)
+
+
+def _event(name, data):
+    return f'event: {name}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n'
+
+
+async def events(progress_id, interval=PROGRESS_INTERVAL, timeout=STREAM_TIMEOUT):
+    """
+    События SSE для ``progress_id``: ``progress`` при каждом изменении состояния,
+    пока операция не завершится. Подписаться можно до начала операции — поток ждёт,
+    пока состояние появится. Если операция так и не завершилась, последнее событие — ``timeout``.
+    """
+    yield f'retry: {int(interval * 1000)}\n\n'
+    last = None
+    started = sent = time.monotonic()
+    while time.monotonic() - started < timeout:
+        state = await cache.aget(_key(progress_id))
+        if state is not None and state != last:
+            last = state
+            sent = time.monotonic()
+            yield _event('progress', state)
+            if state['status'] != STATUS_RUNNING:
+                return
+        elif time.monotonic() - sent >= KEEPALIVE_INTERVAL:
+            sent = time.monotonic()
+            yield ': keepalive\n\n'
+        await asyncio.sleep(interval)
+    yield _event('timeout', {'id': progress_id})
@@ -0,0 +1,171 @@
+# querybudget.py
+# Бюджет SQL-запросов для представлений.
+# Представление объявляет, сколько запросов ему разрешено (@query_budget(n)),
+# middleware считает запросы на каждый запрос пользователя и при превышении
+# пишет предупреждение в лог. Исключение (QUERY_BUDGET_RAISE) включают только
+# тесты: ответ к этому моменту готов и транзакция представления зафиксирована.
+# Для проверок вне HTTP-цикла есть max_queries и check_view_budget.
+# Счётчики работают и с асинхронными представлениями: активные счётчики лежат
+# в contextvar, а обёртка, которая в них пишет, ставится на каждое соединение
+# с БД — запросы из sync_to_async и пула потоков offload тоже учитываются.
+
+import contextvars
+import logging
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.urls import resolve
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(Exception):
+    """Представление выполнило больше запросов, чем объявлено в бюджете."""
+
+    def __init__(self, label, budget, queries):
+        self.label = label
+        self.budget = budget
+        self.queries = queries
+        listing = '\n'.join(f'{i}. {sql}' for i, sql in enumerate(queries, 1))
+        super().__init__(f"{label}: {len(queries)} запросов при бюджете {budget}\n{listing}")
+
+
+def query_budget(budget):
+    """Объявить бюджет запросов для функции-представления или класса-представления."""
+    def decorator(view):
+        view.query_budget = budget
+        return view
+    return decorator
+
+
+def extend_query_budget(request, extra):
+    """Увеличить бюджет текущего запроса, если объём работы известен только в представлении."""
+    if getattr(request, 'query_budget', None) is not None:
+        request.query_budget += extra
+
+
+def budget_of(view_func):
+    budget = getattr(view_func, 'query_budget', None)
+    if budget is None:
+        # Для классов-представлений as_view() сохраняет класс в view_class
+        budget = getattr(getattr(view_func, 'view_class', None), 'query_budget', None)
+    return budget
+
+
+class QueryCounter:
+    """Выполненный SQL внутри counting_queries()."""
+
+    def __init__(self):
+        self.queries = []
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+
+# Активные счётчики текущего контекста (вложенные блоки считают каждый своё)
+_active_counters = contextvars.ContextVar('farmer_query_counters', default=())
+
+
+def _count_query(execute, sql, params, many, context):
+    for counter in _active_counters.get():
+        counter.queries.append(sql)
+    return execute(sql, params, many, context)
+
+
+@receiver(connection_created)
+def install_counter(sender, connection, **kwargs):
+    if _count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_count_query)
+
+
+@contextmanager
+def counting_queries():
+    # Соединения, открытые до загрузки модуля, сигнал connection_created пропустили
+    for connection in connections.all(initialized_only=True):
+        install_counter(None, connection)
+    counter = QueryCounter()
+    token = _active_counters.set(_active_counters.get() + (counter,))
+    try:
+        yield counter
+    finally:
+        _active_counters.reset(token)
+
+
+@contextmanager
+def max_queries(budget, label='block'):
+    """Проверка для тестов: блок должен уложиться в ``budget`` запросов."""
+    with counting_queries() as counter:
+        yield counter
+    if counter.count > budget:
+        raise QueryBudgetExceeded(label, budget, counter.queries)
+
+
+def check_view_budget(client, url, method='get', **kwargs):
+    """
+    Выполнить запрос тестовым клиентом и проверить бюджет представления по ``url``.
+    Бюджет учитывает и запросы middleware (сессия, пользователь), а также
+    расширение через extend_query_budget во время запроса.
+    """
+    budget = budget_of(resolve(urlsplit(url).path).func)
+    if budget is None:
+        raise AssertionError(f"{url}: у представления не объявлен бюджет запросов")
+    with counting_queries() as counter:
+        response = getattr(client, method)(url, **kwargs)
+    request = getattr(response, 'wsgi_request', None) or getattr(response, 'asgi_request', None)
+    budget = getattr(request, 'query_budget', None) or budget
+    if counter.count > budget:
+        raise QueryBudgetExceeded(url, budget, counter.queries)
+    return response
+
+
+class QueryBudgetMiddleware:
+    """
+    Считает запросы каждого HTTP-запроса и сверяет с бюджетом представления.
+    Запросы, выполняемые при отдаче потокового ответа, уже не учитываются.
+    Ответы с ошибкой сервера не проверяются: бюджет описывает успешный путь,
+    а превышение не должно подменять собой исходное исключение.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with counting_queries() as counter:
+            response = self.get_response(request)
+        self.check(request, response, counter)
+        return response
+
+    async def __acall__(self, request):
+        with counting_queries() as counter:
+            response = await self.get_response(request)
+        self.check(request, response, counter)
+        return response
+
+    def check(self, request, response, counter):
+        if response.status_code >= 500 or getattr(request, 'query_budget_exception', False):
+            return
+        budget = getattr(request, 'query_budget', None)
+        if budget is not None and counter.count > budget:
+            error = QueryBudgetExceeded(request.path, budget, counter.queries)
+            if getattr(settings, 'QUERY_BUDGET_RAISE', False):
+                raise error
+            logger.warning('%s', error)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.query_budget = budget_of(view_func)
+
+    def process_exception(self, request, exception):
+        request.query_budget_exception = True
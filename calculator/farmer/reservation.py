@@ -0,0 +1,57 @@
+# reservation.py
+# Атомарное списание сырья под производственный план.
+# Строки остатков блокируются select_for_update в порядке id (без взаимных
+# блокировок между планировщиками), затем списываются одним UPDATE с F().
+
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+
+from .feasibility import shortage_info
+from .models import RawMaterialStock
+
+
+class InsufficientStock(Exception):
+    """
+    Сырья на складе меньше, чем требуется.
+    ``shortages`` — {id сырья: нехватка}, ``material_names`` — {id сырья: название}.
+    """
+
+    def __init__(self, shortages, material_names=None):
+        self.shortages = shortages
+        self.material_names = material_names or {}
+        super().__init__(f"Недостаточно сырья: {shortage_info(shortages, self.material_names)}")
+
+
+def reserve_materials(demand):
+    """
+    Списать сырьё ``demand`` ({id сырья: количество}) одной транзакцией.
+
+    Выполняется за два запроса независимо от числа позиций: SELECT ... FOR UPDATE
+    и один UPDATE. Если хоть одной позиции не хватает, ничего не списывается
+    и выбрасывается InsufficientStock. Остатки никогда не уходят в минус.
+    """
+    demand = {material_id: amount for material_id, amount in demand.items() if amount > 0}
+    if not demand:
+        return
+
+    with transaction.atomic():
+        rows = list(RawMaterialStock.objects.select_for_update().filter(id__in=demand).order_by('id')
+                    .values_list('id', 'name', 'quantity'))
+        names = {material_id: name for material_id, name, _ in rows}
+        available = {material_id: quantity for material_id, _, quantity in rows}
+
+        shortages = {}
+        for material_id, amount in demand.items():
+            quantity = available.get(material_id, 0)
+            if quantity < amount:
+                shortages[material_id] = amount - quantity
+        if shortages:
+            raise InsufficientStock(shortages, names)
+
+        RawMaterialStock.objects.filter(id__in=demand).update(
+            quantity=F('quantity') - Case(
+                *[When(id=material_id, then=Value(amount)) for material_id, amount in demand.items()],
+                default=Value(0),
+                output_field=IntegerField(),
+            )
+        )
@@ -0,0 +1,84 @@
+# scenarios.py
+# Сценарии «что если». Сценарий хранит только отличия от живых данных:
+# остатки сырья, мощности отделов и дополнительные заявки. Создание сценария
+# ничего не копирует. При расчёте живые данные загружаются тем же фиксированным
+# числом запросов, что и обычный расчёт, а правки сценария накладываются поверх
+# загруженных в память объектов; в базе живые данные не меняются.
+
+from .feasibility import (FeasibilityEngine, OrderLine, ALLOCATION_OPTIMIZED, PRIORITY_DUE_DATE, STATUS_OK,
+                          STATUS_DELAY, STATUS_SHORTAGE)
+from .models import ManagementOrder
+
+# Запросов на расчёт одного сценария: три вида правок, строки заказа, продукты,
+# рецепты, остатки, загрузка отделов и сохранённые планы заявок заказа
+SCENARIO_QUERIES = 9
+# Сколько сценариев можно сравнивать за раз
+MAX_COMPARED = 10
+
+
+class ScenarioEngine(FeasibilityEngine):
+    """
+    Расчёт пачки заявок с правками сценария.
+    ``stock`` — {id сырья: остаток}, ``capacities`` — {id отдела: мощность в месяц}.
+    """
+
+    def __init__(self, lines, stock=None, capacities=None, **kwargs):
+        self.stock_overrides = stock or {}
+        self.capacity_overrides = capacities or {}
+        super().__init__(lines, **kwargs)
+
+    def _load(self):
+        super()._load()
+        # Объекты загружены только для этого расчёта — правим их, а не базу
+        for material_id, quantity in self.stock_overrides.items():
+            material = self.materials.get(material_id)
+            if material is not None:
+                material.quantity = quantity
+                self.remaining[material_id] = quantity
+        for product in self.products.values():
+            department = product.production_department
+            if department.id in self.capacity_overrides:
+                department.average_output = self.capacity_overrides[department.id]
+
+
+class ScenarioData:
+    """Правки сценария, загруженные для расчёта и вывода (по запросу на каждый вид правок)."""
+
+    def __init__(self, scenario):
+        self.scenario = scenario
+        self.stock = list(scenario.stock_overrides.select_related('material__stok_id').order_by('material__name'))
+        self.capacities = list(scenario.capacity_overrides.select_related('department').order_by('department__name'))
+        self.orders = list(scenario.extra_orders.select_related('product').order_by('start_date', 'pk'))
+
+    def lines(self):
+        """Заявки сценария: строки заказа ``order_code`` и дополнительные заявки."""
+        lines = []
+        if self.scenario.order_code:
+            lines = [OrderLine.from_order(order)
+                     for order in ManagementOrder.objects.filter(Order_id=self.scenario.order_code)]
+        lines += [OrderLine(order.product_id, order.start_date, order.end_date, order.quantity, source=order,
+                            priority=order.priority) for order in self.orders]
+        return lines
+
+    def engine(self, priority=PRIORITY_DUE_DATE):
+        return ScenarioEngine(self.lines(),
+                              stock={override.material_id: override.quantity for override in self.stock},
+                              capacities={override.department_id: override.average_output
+                                          for override in self.capacities},
+                              allocation=ALLOCATION_OPTIMIZED, priority=priority)
+
+
+def evaluate_scenario(scenario, priority=PRIORITY_DUE_DATE):
+    """Правки, движок и вердикты сценария."""
+    data = ScenarioData(scenario)
+    engine = data.engine(priority)
+    return data, engine, engine.evaluate()
+
+
+def summary(verdicts):
+    """Сколько строк выполнимо, с просрочкой и без сырья — для сравнения сценариев."""
+    counts = {STATUS_OK: 0, STATUS_DELAY: 0, STATUS_SHORTAGE: 0}
+    for verdict in verdicts:
+        counts[verdict.status] += 1
+    counts['quantity'] = sum(verdict.line.quantity for verdict in verdicts if verdict.feasible)
+    return counts
@@ -0,0 +1,165 @@
+# scheduler.py
+# Планирование с конечной мощностью.
+# Мощность отдела — average_output в месяц, т. е. average_output / 30 в день;
+# из неё вычитается уже утверждённая загрузка из таблицы загрузки по дням.
+# Заявки каждого отдела раскладываются по дневным корзинам мощности событийно:
+# заявки становятся доступны в день начала, из доступных через кучу выбирается
+# заявка с лучшим рангом (по умолчанию — с ранним сроком), и она получает
+# свободную мощность дня, пока не будет выполнена. Пустые промежутки между
+# заявками пропускаются, а после последнего занятого дня сроки считаются
+# арифметически, поэтому время — O((n + занятые дни) log n) и не зависит от количества.
+
+import heapq
+import math
+from collections import defaultdict
+from datetime import timedelta
+
+from .timeline import LoadTimeline, orders_load
+
+# Сколько дней после последнего срока учитывать уже утверждённую загрузку
+SCHEDULE_HORIZON_DAYS = 365
+# Точность сравнения остатков (количества дробятся по дням)
+EPSILON = 1e-9
+
+
+class ScheduleJob:
+    """Заявка для планирования: отдел, день начала, срок, количество и ранг в очереди."""
+
+    __slots__ = ('key', 'department_id', 'release', 'due', 'quantity', 'rank')
+
+    def __init__(self, key, department_id, release, due, quantity, rank=0):
+        self.key = key
+        self.department_id = department_id
+        self.release = release
+        self.due = due
+        self.quantity = quantity
+        self.rank = rank
+
+
+class ScheduleResult:
+    """Срок выполнения заявки и просрочка в днях (0 — успевает в срок)."""
+
+    __slots__ = ('completion', 'delay_days')
+
+    def __init__(self, completion, delay_days):
+        self.completion = completion
+        self.delay_days = delay_days
+
+
+def _result(day, offset, due):
+    """Срок ``day`` + ``offset`` дней; за пределами календаря (date.max) заявка невыполнима."""
+    try:
+        completion = day + timedelta(days=offset)
+    except OverflowError:
+        return ScheduleResult(None, None)
+    return ScheduleResult(completion, max((completion - due).days, 0))
+
+
+def _schedule_tail(pending, position, ready, left, results, day, daily_capacity):
+    """
+    Досчитать расписание с начала дня ``day``, после которого занятых дней нет.
+    Мощность всех дней одинакова, поэтому время меряется выработкой с начала ``day``
+    и сроки считаются арифметически: заявка работает до завершения или до начала
+    следующей заявки, которая может оказаться в очереди раньше неё.
+    """
+    used = 0
+    while position < len(pending) or ready:
+        if not ready:
+            # Простой до начала следующей заявки
+            used = max(used, (pending[position].release - day).days * daily_capacity)
+        today = int((used + EPSILON) // daily_capacity)
+        while position < len(pending) and (pending[position].release - day).days <= today:
+            job = pending[position]
+            heapq.heappush(ready, (job.rank, job.due, position, job))
+            position += 1
+
+        job = ready[0][3]
+        finish = used + left[job.key]
+        if position < len(pending):
+            boundary = (pending[position].release - day).days * daily_capacity
+            if boundary < finish - EPSILON:
+                left[job.key] -= boundary - used
+                used = boundary
+                continue
+        used = finish
+        left[job.key] = 0
+        heapq.heappop(ready)
+        # Заявка завершается в день, на который приходится последняя единица выработки
+        offset = max(math.ceil((used - EPSILON) / daily_capacity) - 1, today)
+        results[job.key] = _result(day, offset, job.due)
+
+
+def schedule_department(jobs, daily_capacity, busy=None):
+    """
+    Разложить заявки одного отдела по дням.
+
+    ``daily_capacity`` — мощность отдела в день, ``busy`` — {день: уже занятая мощность}.
+    Возвращает {key: ScheduleResult}; если мощности нет или срок выходит за пределы календаря, срок — None.
+    """
+    busy = busy or {}
+    if daily_capacity <= 0:
+        return {job.key: ScheduleResult(None, None) for job in jobs}
+
+    pending = sorted(jobs, key=lambda job: job.release)
+    left = {job.key: job.quantity for job in jobs}
+    results = {}
+    ready = []
+    position = 0
+    day = None
+    last_busy = max(busy, default=None)
+    while position < len(pending) or ready:
+        if not ready:
+            # Ничего не ждёт — перескакиваем к следующему дню начала
+            next_release = pending[position].release
+            day = next_release if day is None or day < next_release else day
+        if last_busy is None or day > last_busy:
+            # Дальше мощность не занята — остаток считаем без перебора дней
+            _schedule_tail(pending, position, ready, left, results, day, daily_capacity)
+            break
+        while position < len(pending) and pending[position].release <= day:
+            job = pending[position]
+            heapq.heappush(ready, (job.rank, job.due, position, job))
+            position += 1
+
+        free = daily_capacity - busy.get(day, 0)
+        while ready and (free > EPSILON or left[ready[0][3].key] <= EPSILON):
+            job = ready[0][3]
+            taken = min(free, left[job.key])
+            left[job.key] -= taken
+            free -= taken
+            if left[job.key] <= EPSILON:
+                heapq.heappop(ready)
+                results[job.key] = ScheduleResult(day, max((day - job.due).days, 0))
+        day += timedelta(days=1)
+    return results
+
+
+def load_timeline(start_date, end_date, department_ids, exclude_orders=()):
+    """
+    Уже утверждённая загрузка отделов на окне планирования — один запрос.
+    Планы заявок ``exclude_orders`` — это сами раскладываемые заявки, их загрузка
+    занятой не считается (ещё один запрос).
+    """
+    own = orders_load(exclude_orders) if exclude_orders else {}
+    return LoadTimeline(start_date, end_date + timedelta(days=SCHEDULE_HORIZON_DAYS), department_ids, exclude=own)
+
+
+def schedule(jobs, capacities, exclude_orders=(), timeline=None):
+    """
+    Разложить заявки всех отделов. ``capacities`` — {department_id: мощность в месяц}.
+    Занятая мощность — из ``timeline`` или, если он не передан, из load_timeline.
+    """
+    results = {}
+    if not jobs:
+        return results
+    by_department = defaultdict(list)
+    for job in jobs:
+        by_department[job.department_id].append(job)
+
+    if timeline is None:
+        timeline = load_timeline(min(job.release for job in jobs), max(job.due for job in jobs),
+                                 set(by_department), exclude_orders)
+    for department_id, department_jobs in by_department.items():
+        results.update(schedule_department(department_jobs, capacities.get(department_id, 0) / 30,
+                                           timeline.busy(department_id)))
+    return results
@@ -0,0 +1,98 @@
+# signals.py
+# Инкрементальное обновление загрузки отделов по дням и сброс справочника рецептов.
+
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete
+from django.dispatch import receiver
+
+from . import catalog, timeline
+from .models import ManagementOrder, Product, ProductionPlan, Recipe, RawMaterialStock
+
+
+@receiver(pre_save, sender=ProductionPlan)
+def remember_plan_load(sender, instance, raw=False, **kwargs):
+    # Запоминаем прежнее состояние плана, чтобы убрать его из загрузки
+    instance._timeline_snapshot = None if raw or instance.pk is None else timeline.plan_snapshot(instance.pk)
+
+
+@receiver(post_save, sender=ProductionPlan)
+def update_plan_load(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    timeline.apply_snapshot(getattr(instance, '_timeline_snapshot', None), sign=-1)
+    timeline.apply_snapshot(timeline.plan_snapshot(instance.pk))
+
+
+@receiver(pre_delete, sender=ProductionPlan)
+def remember_deleted_plan_load(sender, instance, **kwargs):
+    instance._timeline_snapshot = timeline.plan_snapshot(instance.pk)
+
+
+@receiver(post_delete, sender=ProductionPlan)
+def remove_plan_load(sender, instance, **kwargs):
+    timeline.apply_snapshot(getattr(instance, '_timeline_snapshot', None), sign=-1)
+
+
+@receiver(pre_save, sender=ManagementOrder)
+def remember_order_dates(sender, instance, raw=False, **kwargs):
+    instance._timeline_dates = None
+    if not raw and instance.pk is not None:
+        instance._timeline_dates = ManagementOrder.objects.filter(pk=instance.pk).values_list(
+            'start_date', 'end_date').first()
+
+
+@receiver(post_save, sender=ManagementOrder)
+def move_order_load(sender, instance, raw=False, **kwargs):
+    # При переносе сроков заявки переносим загрузку всех её планов
+    old_dates = getattr(instance, '_timeline_dates', None)
+    if raw or old_dates is None:
+        return
+    plans = ProductionPlan.objects.filter(order=instance).values_list(
+        'product__production_department_id', 'order__start_date', 'order__end_date', 'planned_quantity')
+    for department_id, start_date, end_date, planned_quantity in plans:
+        if (start_date, end_date) == tuple(old_dates):
+            continue
+        timeline.apply_plan(department_id, old_dates[0], old_dates[1], planned_quantity, sign=-1)
+        timeline.apply_plan(department_id, start_date, end_date, planned_quantity)
+
+
+@receiver(pre_save, sender=Product)
+def remember_product_department(sender, instance, raw=False, **kwargs):
+    instance._timeline_department = None
+    if not raw and instance.pk is not None:
+        instance._timeline_department = Product.objects.filter(pk=instance.pk).values_list(
+            'production_department_id', flat=True).first()
+
+
+@receiver(post_save, sender=Product)
+def move_product_load(sender, instance, raw=False, **kwargs):
+    # Продукт перевели в другой отдел: загрузка его планов уходит из прежнего отдела в новый
+    old_department = getattr(instance, '_timeline_department', None)
+    if raw or old_department is None or old_department == instance.production_department_id:
+        return
+    plans = ProductionPlan.objects.filter(product=instance).values_list(
+        'order__start_date', 'order__end_date', 'planned_quantity')
+    for start_date, end_date, planned_quantity in plans:
+        timeline.apply_plan(old_department, start_date, end_date, planned_quantity, sign=-1)
+        timeline.apply_plan(instance.production_department_id, start_date, end_date, planned_quantity)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def invalidate_recipe_catalog(sender, **kwargs):
+    catalog.invalidate()
+
+
+@receiver(pre_save, sender=RawMaterialStock)
+def remember_material_name(sender, instance, raw=False, **kwargs):
+    instance._catalog_name = None
+    if not raw and instance.pk is not None:
+        instance._catalog_name = RawMaterialStock.objects.filter(pk=instance.pk).values_list(
+            'name', flat=True).first()
+
+
+@receiver(post_save, sender=RawMaterialStock)
+def invalidate_material_name(sender, instance, created=False, raw=False, **kwargs):
+    # Название сырья хранится в справочнике, остатки — нет
+    old_name = getattr(instance, '_catalog_name', None)
+    if not raw and not created and old_name is not None and old_name != instance.name:
+        catalog.invalidate()
@@ -1,3 +1,1222 @@
-from django.test import TestCase
+import asyncio
+import heapq
+import json
+import random
+import threading
+import time
+import zipfile
+from datetime import date, timedelta
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.http import HttpResponse
+from django.http.multipartparser import MultiPartParser
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from docx import Document
+
+from . import api, bom, catalog, documents, importer, incremental, jobs, offload, progress, timeline, views
+from .allocation import allocate
+from .bom import BillOfMaterials
+from .documents import render_department_document, stream_zip, ZIP_WRITE_CHUNK
+from .feasibility import (FeasibilityEngine, OrderLine, evaluate_lines, ALLOCATION_OPTIMIZED, PRIORITY_DUE_DATE,
+                          PRIORITY_QUANTITY, PRIORITY_VALUE, STATUS_DELAY, STATUS_OK, STATUS_SHORTAGE)
+from .models import (DepartmentDailyLoad, DocumentJob, ManagementOrder, ProductionPlan, Product, ProductionDepartment,
+                     RawMaterialStock, Recipe, Scenario, ScenarioCapacity, ScenarioOrder, ScenarioStock, Stock)
+from .querybudget import check_view_budget, max_queries, QueryBudgetExceeded, QueryBudgetMiddleware
+from .reservation import InsufficientStock, reserve_materials
+from .scenarios import evaluate_scenario, summary
+from .scheduler import ScheduleJob, schedule_department, EPSILON
+
+# Тесты не трогают общий файловый кэш; расчёты асинхронных представлений идут
+# без пула потоков, иначе соединения пула не видят данных незавершённой транзакции теста
+TEST_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+@override_settings(CACHES=TEST_CACHES, PLANNING_WORKERS=0, QUERY_BUDGET_RAISE=True)
+class PlanningTestCase(TestCase):
+    """Общие данные расчётов: склад, два отдела, сырьё и продукты с рецептами."""
+
+    start = date(2024, 1, 1)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('planner', 'planner@example.com', 'password')
+        cls.stock = Stock.objects.create(name='Основной')
+        # 300 в месяц — 10 в день
+        cls.bakery = ProductionDepartment.objects.create(name='Пекарня', product_type='хлеб', average_output=300)
+        cls.confectionery = ProductionDepartment.objects.create(name='Кондитерская', product_type='торты',
+                                                                average_output=600)
+        cls.flour = RawMaterialStock.objects.create(name='Мука', quantity=1000, stok_id=cls.stock)
+        cls.sugar = RawMaterialStock.objects.create(name='Сахар', quantity=100, stok_id=cls.stock)
+        cls.bread = Product.objects.create(name='Хлеб', production_department=cls.bakery)
+        cls.cake = Product.objects.create(name='Торт', production_department=cls.confectionery)
+        Recipe.objects.create(product=cls.bread, raw_material=cls.flour, required_quantity=2)
+        Recipe.objects.create(product=cls.cake, raw_material=cls.flour, required_quantity=1)
+        Recipe.objects.create(product=cls.cake, raw_material=cls.sugar, required_quantity=1)
+
+    def setUp(self):
+        # Кэш не откатывается вместе с транзакцией теста
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def order(self, product, quantity, days=30, start=None, code='A1', **kwargs):
+        start = start or self.start
+        return ManagementOrder.objects.create(Order_id=code, product_code=product, start_date=start,
+                                              end_date=start + timedelta(days=days), quantity=quantity, **kwargs)
+
+    def line(self, product, quantity, days=30, start=None):
+        start = start or self.start
+        return OrderLine(product.pk, start, start + timedelta(days=days), quantity)
+
+
+def day_by_day(jobs, daily_capacity, busy):
+    # Эталон для проверки планировщика: тот же выбор заявок, но строго по одному дню
+    pending = sorted(jobs, key=lambda job: job.release)
+    left = {job.key: job.quantity for job in jobs}
+    results, ready, position = {}, [], 0
+    day = pending[0].release if pending else None
+    while position < len(pending) or ready:
+        while position < len(pending) and pending[position].release <= day:
+            job = pending[position]
+            heapq.heappush(ready, (job.rank, job.due, position, job))
+            position += 1
+        free = daily_capacity - busy.get(day, 0)
+        while ready and (free > EPSILON or left[ready[0][3].key] <= EPSILON):
+            job = ready[0][3]
+            taken = min(free, left[job.key])
+            left[job.key] -= taken
+            free -= taken
+            if left[job.key] <= EPSILON:
+                heapq.heappop(ready)
+                results[job.key] = (day, max((day - job.due).days, 0))
+        day += timedelta(days=1)
+    return results
+
+
+class SchedulerTests(SimpleTestCase):
+    start = date(2024, 1, 1)
+
+    def test_matches_day_by_day_schedule(self):
+        rng = random.Random(20)
+        for _ in range(200):
+            jobs = []
+            for key in range(rng.randint(1, 8)):
+                release = self.start + timedelta(days=rng.randint(0, 40))
+                jobs.append(ScheduleJob(key, 1, release, release + timedelta(days=rng.randint(0, 30)),
+                                        rng.randint(0, 400), rank=rng.randint(0, 3)))
+            busy = {self.start + timedelta(days=rng.randint(0, 60)): rng.uniform(0, 15) for _ in range(rng.randint(0, 20))}
+            capacity = rng.choice([10, 12.5, 100 / 30])
+            results = schedule_department(jobs, capacity, busy)
+            expected = day_by_day(jobs, capacity, busy)
+            self.assertEqual({key: (result.completion, result.delay_days) for key, result in results.items()},
+                             expected)
+
+    def test_huge_quantity_is_computed_without_stepping_days(self):
+        job = ScheduleJob(1, 1, self.start, self.start + timedelta(days=30), 10 ** 6)
+        result = schedule_department([job], 1000 / 30, {self.start: 5})[1]
+        self.assertEqual(result.completion, self.start + timedelta(days=30000))
+        self.assertEqual(result.delay_days, 29970)
+
+    def test_completion_past_calendar_is_infeasible(self):
+        job = ScheduleJob(1, 1, self.start, self.start + timedelta(days=30), 10 ** 9)
+        result = schedule_department([job], 1 / 30, {})[1]
+        self.assertIsNone(result.completion)
+        self.assertIsNone(result.delay_days)
+
+    def test_no_capacity(self):
+        job = ScheduleJob(1, 1, self.start, self.start, 10)
+        self.assertIsNone(schedule_department([job], 0)[1].completion)
+
+
+class ScheduledVerdictTests(PlanningTestCase):
+    def test_fits_department_capacity(self):
+        engine, (verdict,) = evaluate_lines([self.line(self.bread, 100)])
+        self.assertEqual(verdict.status, STATUS_OK)
+        self.assertEqual(verdict.completion_date, self.start + timedelta(days=9))
+        self.assertIn('завершение 10.01.2024', verdict.message())
+
+    def test_department_without_capacity(self):
+        ProductionDepartment.objects.filter(pk=self.bakery.pk).update(average_output=0)
+        engine, (verdict,) = evaluate_lines([self.line(self.bread, 100)])
+        self.assertEqual(verdict.status, STATUS_DELAY)
+        self.assertIsNone(verdict.completion_date)
+        self.assertIn('не хватает мощности', verdict.message())
+
+        self.order(self.bread, 100)
+        response = self.client.post('/calculate_plan/A1/')
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'не хватает мощности')
+
+    def test_own_saved_plan_is_not_busy_time(self):
+        order = self.order(self.bread, 150)
+        response = self.client.post('/calculate_plan/A1/')
+        self.assertContains(response, 'завершение 15.01.2024')
+
+        response = self.client.post('/save_production_plan/A1/')
+        self.assertEqual(response.status_code, 202)
+        self.assertTrue(ProductionPlan.objects.filter(order=order).exists())
+        self.assertTrue(DepartmentDailyLoad.objects.filter(department=self.bakery, quantity__gt=0).exists())
+
+        engine, (verdict,) = evaluate_lines([OrderLine.from_order(order)])
+        self.assertEqual(verdict.status, STATUS_OK)
+        self.assertEqual(verdict.completion_date, date(2024, 1, 15))
+        response = self.client.post('/calculate_plan/A1/')
+        self.assertContains(response, 'завершение 15.01.2024')
+
+        # Для других заявок отдела сохранённый план по-прежнему занимает мощность
+        engine, (verdict,) = evaluate_lines([self.line(self.bread, 150, days=14)])
+        self.assertEqual(verdict.status, STATUS_DELAY)
+        self.assertEqual(verdict.completion_date, date(2024, 1, 30))
+
+    def test_department_load_in_the_order_window(self):
+        order = self.order(self.bread, 155, code='SAVED')
+        ProductionPlan.objects.create(order=order, product=self.bread, planned_quantity=155)
+        lines = [self.line(self.bread, 100, days=9), self.line(self.bread, 100, days=30, start=date(2024, 3, 1))]
+        with self.assertNumQueries(4):
+            engine, verdicts = evaluate_lines(lines)
+        # Сохранённый план — 5 в день весь январь, т. е. 150 в месяц; в марте отдел свободен
+        self.assertAlmostEqual(verdicts[0].department_load, 150)
+        self.assertEqual(verdicts[1].department_load, 0)
+        self.assertIn('отдел уже загружен на 150.00 в месяц при мощности 300', verdicts[0].message())
+        with self.assertNumQueries(0):
+            self.assertAlmostEqual(engine.current_load(self.bakery.pk, date(2024, 1, 1), date(2024, 1, 15)), 150)
+
+
+class FeasibilityEngineTests(PlanningTestCase):
+    def count_queries(self, lines):
+        with CaptureQueriesContext(connection) as queries:
+            evaluate_lines(lines)
+        return len(queries)
+
+    def test_query_count_does_not_depend_on_batch_size(self):
+        self.count_queries([self.line(self.bread, 1), self.line(self.cake, 1)])  # справочник рецептов попадает в кэш
+        few = self.count_queries([self.line(self.bread, 1), self.line(self.cake, 1)])
+        many = self.count_queries([self.line(product, 1, start=self.start + timedelta(days=i))
+                                   for i in range(50) for product in (self.bread, self.cake)])
+        self.assertEqual(few, many)
+
+    def test_saved_plans_are_read_at_once(self):
+        def plan(index):
+            order = self.order(self.bread, 10, days=9, start=self.start + timedelta(days=index), code=f'P{index}')
+            ProductionPlan.objects.create(order=order, product=self.bread, planned_quantity=10)
+
+        plan(0)
+        lines = [self.line(self.bread, 100)]
+        self.count_queries(lines)
+        one = self.count_queries(lines)
+        for index in range(1, 40):
+            plan(index)
+        self.assertEqual(self.count_queries(lines), one)
+        # Сохранённые планы занимают мощность отдела
+        engine, (verdict,) = evaluate_lines(lines)
+        self.assertEqual(verdict.status, STATUS_DELAY)
+
+    def test_lines_share_stock(self):
+        # Хлеб забирает 2 * 400 муки из 1000, торту на 300 остаётся 200
+        engine, verdicts = evaluate_lines([self.line(self.bread, 400), self.line(self.cake, 300)])
+        self.assertEqual([verdict.status for verdict in verdicts], [STATUS_DELAY, STATUS_SHORTAGE])
+        self.assertEqual(verdicts[1].shortages, {self.flour.pk: 100, self.sugar.pk: 200})
+        self.assertIn('Мука: недостает 100 ед.', verdicts[1].message())
+        self.assertEqual(engine.remaining[self.flour.pk], 200)
+        self.assertEqual(engine.consumed(), {self.flour.pk: 800, self.sugar.pk: 0})
+        # Списание показывается только у строки, которой хватило сырья
+        self.assertEqual(verdicts[0].draws, {self.stock.pk: {self.flour.pk: 800}})
+        self.assertEqual(verdicts[0].warehouses, 'Основной: Мука — 800')
+        self.assertEqual(verdicts[1].draws, {})
+        self.assertEqual(engine.required_by_warehouse(), {self.stock.pk: {self.flour.pk: 1100, self.sugar.pk: 300}})
+
+    def test_same_named_materials_are_kept_apart(self):
+        reserve = Stock.objects.create(name='Резервный')
+        spare_flour = RawMaterialStock.objects.create(name='Мука', quantity=50, stok_id=reserve)
+        pie = Product.objects.create(name='Пирог', production_department=self.confectionery)
+        Recipe.objects.create(product=pie, raw_material=spare_flour, required_quantity=1)
+
+        engine, verdicts = evaluate_lines([self.line(self.bread, 400), self.line(pie, 100)])
+        self.assertEqual(verdicts[1].status, STATUS_SHORTAGE)
+        # Пирогу не хватает резервной муки, хотя на основном складе её осталось 200
+        self.assertEqual(verdicts[1].shortages, {spare_flour.pk: 50})
+        self.assertIn('Мука (Резервный): недостает 50 ед.', verdicts[1].message())
+        self.assertEqual(engine.remaining, {self.flour.pk: 200, spare_flour.pk: 50})
+
+    def test_optimized_allocation_uses_every_warehouse(self):
+        reserve = Stock.objects.create(name='Резервный')
+        spare_flour = RawMaterialStock.objects.create(name='Мука', quantity=500, stok_id=reserve)
+        # 1400 муки: больше, чем на основном складе, но меньше, чем на двух
+        engine, (verdict,) = evaluate_lines([self.line(self.bread, 700, days=80)], allocation=ALLOCATION_OPTIMIZED)
+        self.assertEqual(verdict.status, STATUS_OK)
+        consumed = engine.consumed()
+        self.assertEqual(consumed[self.flour.pk] + consumed[spare_flour.pk], 1400)
+        self.assertEqual(verdict.draws, {self.stock.pk: {self.flour.pk: consumed[self.flour.pk]},
+                                         reserve.pk: {spare_flour.pk: consumed[spare_flour.pk]}})
+        self.assertIn('Резервный: Мука — ', verdict.warehouses)
+
+        engine, (verdict,) = evaluate_lines([self.line(self.bread, 800, days=90)], allocation=ALLOCATION_OPTIMIZED)
+        # Нехватка показывается по строке остатков из рецепта
+        self.assertEqual(verdict.shortages, {self.flour.pk: 100})
+
+    def test_multi_product_form(self):
+        response = self.client.post('/multi-product-production-plan/', {
+            'products': [self.bread.pk, self.cake.pk],
+            'start_dates': ['2024-01-01', '2024-01-01'],
+            'end_dates': ['2024-01-31', '2024-01-31'],
+            'quantities': ['100', '50'],
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['orders']), 2)
+        self.assertIn('Можно произвести 100 кг', response.context['production_possibility']['Хлеб'])
+        self.assertEqual(response.context['warehouses']['Хлеб'], 'Основной: Мука — 200')
+        self.assertContains(response, 'Основной: Мука — 200')
+
+    def test_multi_product_form_rejects_bad_rows(self):
+        response = self.client.post('/multi-product-production-plan/', {
+            'products': [self.bread.pk, self.cake.pk],
+            'start_dates': ['2024-01-01', '2024-01-31'],
+            'end_dates': ['2024-01-31', '2024-01-01'],
+            'quantities': ['100', '50'],
+        })
+        self.assertContains(response, 'Строка 2: дата окончания раньше даты начала', status_code=400)
+        self.assertNotIn('production_possibility', response.context)
+
+
+class BillOfMaterialsTests(SimpleTestCase):
+    def setUp(self):
+        rng = random.Random(2)
+        self.recipes = {product: [(rng.randint(1, 12), rng.randint(1, 5)) for _ in range(rng.randint(0, 4))]
+                        for product in range(1, 30)}
+        self.lines = [OrderLine(rng.randint(1, 35), date(2024, 1, 1), date(2024, 2, 1), rng.randint(0, 100))
+                      for _ in range(300)]
+        # Сырьё 1–6 и 7–12 попарно одноимённое
+        self.group = {material: f'name{material % 6}' for material in range(1, 13)}
+
+    def expected(self, group=None):
+        demands = []
+        for line in self.lines:
+            demand = {}
+            for material, required_quantity in self.recipes.get(line.product_id, ()):
+                key = group[material] if group else material
+                demand[key] = demand.get(key, 0) + required_quantity * line.quantity
+            demands.append(demand)
+        return demands
+
+    def test_line_demands(self):
+        matrix = BillOfMaterials(self.recipes)
+        self.assertEqual(matrix.line_demands(self.lines), self.expected())
+        self.assertEqual(matrix.line_demands(self.lines, group=self.group), self.expected(self.group))
+        self.assertEqual(matrix.line_demands([]), [])
+
+    def test_line_demands_without_numpy(self):
+        with mock.patch.object(bom, 'np', None):
+            matrix = BillOfMaterials(self.recipes)
+            self.assertEqual(matrix.line_demands(self.lines, group=self.group), self.expected(self.group))
+            self.assertEqual(dict(matrix.totals(self.lines)), dict(BillOfMaterials(self.recipes).totals(self.lines)))
+
+    def test_totals_stay_integer(self):
+        quantity = 2 ** 53 + 1
+        matrix = BillOfMaterials({1: [(7, 3)]})
+        lines = [OrderLine(1, date(2024, 1, 1), date(2024, 1, 2), quantity)]
+        self.assertEqual(matrix.totals(lines)[7], 3 * quantity)
+        self.assertEqual(matrix.line_demands(lines), [{7: 3 * quantity}])
+        self.assertEqual(matrix.shortages(lines, {7: 0}), {7: 3 * quantity})
+
+
+class ImportTests(PlanningTestCase):
+    def row(self, day=1, **fields):
+        row = {'Order_id': 'IMP', 'product_code': self.bread.pk, 'start_date': f'2024-03-{day:02d}',
+               'end_date': '2024-04-30', 'quantity': 10}
+        row.update(fields)
+        return row
+
+    def upload(self, content, name='orders.json'):
+        if not isinstance(content, bytes):
+            content = json.dumps(content).encode()
+        return self.client.post('/import_management_orders/', {'json_file': SimpleUploadedFile(name, content)})
+
+    def test_imports_valid_rows_and_reports_the_rest(self):
+        self.order(self.bread, 5, start=date(2024, 3, 2))
+        response = self.upload([
+            self.row(1, priority=3),
+            self.row(2),  # уже есть в базе
+            self.row(3, product_code=999999),
+            self.row(4, start_date='03.04.2024'),
+            self.row(5, quantity='много'),
+            {'Order_id': 'IMP'},
+            self.row(1),  # дубликат внутри файла
+            [1, 2],
+        ])
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['created'], 1)
+        self.assertEqual(data['error_count'], 7)
+        self.assertEqual([error['row'] for error in data['errors']], [2, 3, 4, 5, 6, 7, 8])
+        self.assertIn('уже существует', data['errors'][0]['error'])
+        self.assertIn('не найден', data['errors'][1]['error'])
+        self.assertEqual(ManagementOrder.objects.get(Order_id='IMP').priority, 3)
+
+    def test_rejects_rows_the_model_cannot_store(self):
+        report = importer.import_orders([
+            self.row(1, end_date='2024-02-29'),
+            self.row(2, quantity=0),
+            self.row(3, quantity=-5),
+            self.row(4, quantity=2 ** 31),
+            self.row(5, Order_id='X' * 101),
+            self.row(6, end_date='2024-03-06', Order_id='X' * 100),
+        ])
+        self.assertEqual(report.created, 1)
+        errors = report.as_dict()['errors']
+        self.assertEqual([error['row'] for error in errors], [1, 2, 3, 4, 5])
+        self.assertIn('раньше даты начала', errors[0]['error'])
+        self.assertIn('больше нуля', errors[1]['error'])
+        self.assertIn('длиннее 100', errors[4]['error'])
+
+    def test_import_orders_writes_a_list_in_batches(self):
+        rows = [self.row(day) for day in range(1, 6)] + [self.row(1)]
+        # Продукты, существующие заявки и запись (внутри теста — в точке сохранения) на пачку
+        with self.assertNumQueries(3 * 5):
+            report = importer.import_orders(rows, chunk_size=2)
+        self.assertEqual(report.created, 5)
+        self.assertEqual(report.batches, 3)
+        self.assertEqual(report.as_dict()['errors'][0]['row'], 6)
+
+    def test_nothing_imported(self):
+        response = self.upload([self.row(product_code=999999)])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['created'], 0)
+
+    def test_malformed_file_reports_rows_already_imported(self):
+        content = json.dumps([self.row(day) for day in range(1, 6)])[:-1] + ', {"Order_id": }]'
+        response = self.upload(content.encode())
+        self.assertEqual(response.status_code, 400)
+        data = response.json()
+        self.assertIn('некорректный JSON', data['error'])
+        self.assertEqual(data['created'], 5)
+        self.assertEqual(data['row'], 6)
+        self.assertEqual(ManagementOrder.objects.filter(Order_id='IMP').count(), 5)
+
+    def test_rejects_other_files(self):
+        response = self.upload(b'a;b', name='orders.csv')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(ManagementOrder.objects.exists())
+
+
+class IterJsonItemsTests(SimpleTestCase):
+    def test_items_split_at_every_position(self):
+        items = [{'a': 'строка \\u0416 "x"', 'b': [1, -2.5e3, None, True]}, {'c': {}}]
+        for text in (json.dumps(items), '\n'.join(json.dumps(item) for item in items)):
+            data = text.encode()
+            for size in (1, 2, 3, 7):
+                chunks = [data[i:i + size] for i in range(0, len(data), size)]
+                self.assertEqual(list(importer.iter_json_items(chunks)), items)
+
+    def test_malformed_input_fails_without_reading_the_rest(self):
+        read = [0]
+
+        def chunks():
+            yield b'[{"Order_id": "A"},, {"Order_id": "B" "x"}, '
+            for _ in range(100000):
+                read[0] += 1
+                yield b'{"Order_id": "C"}, ' * 50
+        items = importer.iter_json_items(chunks())
+        self.assertEqual(next(items), {'Order_id': 'A'})
+        with self.assertRaises(importer.ImportFormatError):
+            list(items)
+        self.assertLess(read[0], 3)
+
+    def test_unterminated_item_is_bounded(self):
+        read = [0]
+
+        def chunks():
+            yield b'["'
+            for _ in range(100000):
+                read[0] += 1
+                yield b'x' * 1024
+        with self.assertRaises(importer.ImportFormatError):
+            list(importer.iter_json_items(chunks()))
+        self.assertLessEqual(read[0], importer.MAX_ITEM_SIZE // 1024 + 1)
+
+
+class DepartmentLoadTests(PlanningTestCase):
+    def load(self):
+        return {(row.department_id, row.day): round(row.quantity, 6)
+                for row in DepartmentDailyLoad.objects.all() if abs(row.quantity) > 1e-9}
+
+    def assertMatchesRebuild(self):
+        incremental = self.load()
+        timeline.rebuild()
+        self.assertEqual(incremental, self.load())
+
+    def test_follows_plan_and_order_changes(self):
+        order = self.order(self.bread, 40, days=3)
+        plan = ProductionPlan.objects.create(order=order, product=self.bread, planned_quantity=40)
+        self.assertEqual(self.load()[(self.bakery.pk, self.start)], 10)
+        self.assertMatchesRebuild()
+
+        plan.planned_quantity = 80
+        plan.save()
+        order.end_date = self.start + timedelta(days=7)
+        order.save()
+        self.assertEqual(self.load()[(self.bakery.pk, self.start)], 10)
+        self.assertMatchesRebuild()
+
+        plan.delete()
+        self.assertEqual(self.load(), {})
+
+    def test_product_moved_to_another_department(self):
+        order = self.order(self.bread, 40, days=3)
+        ProductionPlan.objects.create(order=order, product=self.bread, planned_quantity=40)
+        self.bread.production_department = self.confectionery
+        self.bread.save()
+        self.assertEqual(set(self.load()), {(self.confectionery.pk, self.start + timedelta(days=i)) for i in range(4)})
+        self.assertMatchesRebuild()
+
+    def test_department_page_reads_the_table(self):
+        ProductionPlan.objects.create(order=self.order(self.bread, 40, days=3), product=self.bread,
+                                      planned_quantity=40)
+        response = self.client.get('/departments/load/', {'month': '2024-01'})
+        self.assertEqual(response.status_code, 200)
+        bakery = next(department for department in response.json()['departments']
+                      if department['id'] == self.bakery.pk)
+        self.assertEqual(bakery['load'][0], {'period': '2024-01-01', 'quantity': 10})
+
+    def test_timeline_answers_window_load_from_one_query(self):
+        first = self.order(self.bread, 40, days=3)
+        ProductionPlan.objects.create(order=first, product=self.bread, planned_quantity=40)
+        second = self.order(self.bread, 20, days=1, start=self.start + timedelta(days=2), code='B1')
+        ProductionPlan.objects.create(order=second, product=self.bread, planned_quantity=20)
+        with self.assertNumQueries(1):
+            load = timeline.LoadTimeline(self.start, self.start + timedelta(days=30), {self.bakery.pk})
+        # 10 в день по первой заявке и 10 в день по второй на 3-4 января
+        self.assertEqual(load.total(self.bakery.pk, self.start, self.start + timedelta(days=2)), 40)
+        self.assertEqual(load.total(self.bakery.pk, self.start + timedelta(days=10), self.start + timedelta(days=20)),
+                         0)
+        self.assertEqual(load.monthly_load(self.bakery.pk, self.start, self.start + timedelta(days=3)), 450)
+        self.assertEqual(load.total(self.confectionery.pk, self.start, self.start + timedelta(days=3)), 0)
+
+        own = timeline.LoadTimeline(self.start, self.start + timedelta(days=30), {self.bakery.pk},
+                                    exclude=timeline.orders_load([second.pk]))
+        self.assertEqual(own.total(self.bakery.pk, self.start, self.start + timedelta(days=3)), 40)
+        self.assertEqual(own.busy(self.bakery.pk)[self.start + timedelta(days=3)], 10)
+
+
+class RecipeCatalogTests(PlanningTestCase):
+    def recipes(self):
+        with CaptureQueriesContext(connection) as queries:
+            recipes = catalog.get_recipes([self.bread.pk, self.cake.pk])
+        return recipes, len(queries)
+
+    def test_served_from_cache(self):
+        recipes, _ = self.recipes()
+        self.assertEqual(recipes[self.bread.pk], ((self.flour.pk, 'Мука', 2),))
+        self.assertEqual(self.recipes(), (recipes, 0))
+
+    def test_recipe_change_is_never_stale(self):
+        self.recipes()
+        Recipe.objects.create(product=self.bread, raw_material=self.sugar, required_quantity=1)
+        recipes, queries = self.recipes()
+        self.assertEqual(queries, 1)
+        self.assertEqual(len(recipes[self.bread.pk]), 2)
+
+        Recipe.objects.filter(product=self.bread, raw_material=self.sugar).get().delete()
+        recipes, _ = self.recipes()
+        self.assertEqual(len(recipes[self.bread.pk]), 1)
+
+    def test_material_rename_invalidates_but_stock_change_does_not(self):
+        self.recipes()
+        self.flour.quantity = 10
+        self.flour.save()
+        self.assertEqual(self.recipes()[1], 0)
+
+        self.flour.name = 'Мука пшеничная'
+        self.flour.save()
+        recipes, _ = self.recipes()
+        self.assertEqual(recipes[self.bread.pk], ((self.flour.pk, 'Мука пшеничная', 2),))
+
+
+class ReservationTests(PlanningTestCase):
+    def quantities(self):
+        return dict(RawMaterialStock.objects.values_list('id', 'quantity'))
+
+    def test_deducts_in_two_statements(self):
+        with CaptureQueriesContext(connection) as queries:
+            reserve_materials({self.flour.pk: 300, self.sugar.pk: 100})
+        statements = [query['sql'] for query in queries if 'SAVEPOINT' not in query['sql']]
+        self.assertEqual(len(statements), 2)
+        self.assertEqual(self.quantities(), {self.flour.pk: 700, self.sugar.pk: 0})
+
+    def test_shortage_deducts_nothing(self):
+        with self.assertRaises(InsufficientStock) as raised:
+            reserve_materials({self.flour.pk: 300, self.sugar.pk: 101})
+        self.assertEqual(raised.exception.shortages, {self.sugar.pk: 1})
+        self.assertIn('Сахар', str(raised.exception))
+        self.assertEqual(self.quantities(), {self.flour.pk: 1000, self.sugar.pk: 100})
+
+    def test_multi_product_save(self):
+        data = {'product': [self.bread.pk, self.cake.pk], 'start_date': ['2024-01-01'] * 2,
+                'end_date': ['2024-01-31'] * 2, 'quantity': ['100', '50']}
+        response = self.client.post('/save-production-plan-multi/', data)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.quantities(), {self.flour.pk: 750, self.sugar.pk: 50})
+        self.assertEqual(ProductionPlan.objects.count(), 2)
+
+    def test_multi_product_save_draws_from_every_warehouse(self):
+        reserve = Stock.objects.create(name='Резервный')
+        spare_flour = RawMaterialStock.objects.create(name='Мука', quantity=500, stok_id=reserve)
+        # 1400 муки: больше, чем на основном складе, но меньше, чем на двух
+        data = {'product': [self.bread.pk], 'start_date': ['2024-01-01'], 'end_date': ['2024-03-31'],
+                'quantity': ['700']}
+        response = self.client.post('/save-production-plan-multi/', data)
+        self.assertEqual(response.status_code, 302)
+        quantities = self.quantities()
+        self.assertEqual(quantities[self.flour.pk] + quantities[spare_flour.pk], 100)
+        self.assertEqual(quantities[self.sugar.pk], 100)
+
+    def test_multi_product_save_rejects_bad_rows(self):
+        for start_date, end_date, quantity in [('2024-01-31', '2024-01-01', '10'), ('2024-01-01', '2024-01-31', '0'),
+                                               ('2024-01-01', '2024-13-01', '10'), ('2024-01-01', '2024-01-31', 'x')]:
+            data = {'product': [self.bread.pk], 'start_date': [start_date], 'end_date': [end_date],
+                    'quantity': [quantity]}
+            response = self.client.post('/save-production-plan-multi/', data)
+            self.assertEqual(response.status_code, 400)
+        response = self.client.post('/save-production-plan-multi/', {
+            'product': [999999], 'start_date': ['2024-01-01'], 'end_date': ['2024-01-31'], 'quantity': ['10']})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(ManagementOrder.objects.exists())
+        self.assertEqual(self.quantities(), {self.flour.pk: 1000, self.sugar.pk: 100})
+
+    def test_saving_an_order_reserves_only_planned_lines(self):
+        # Хлебу на 400 нужно 40 дней пекарни, а срок — 10 дней: в план попадает только торт
+        self.order(self.bread, 400, days=10)
+        cake = self.order(self.cake, 50)
+        response = self.client.post('/save_production_plan/A1/')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(list(ProductionPlan.objects.values_list('order', flat=True)), [cake.pk])
+        self.assertEqual(self.quantities(), {self.flour.pk: 950, self.sugar.pk: 50})
+
+    def test_multi_product_save_conflicts_on_shortage(self):
+        data = {'product': [self.bread.pk, self.cake.pk], 'start_date': ['2024-01-01'] * 2,
+                'end_date': ['2024-01-31'] * 2, 'quantity': ['400', '300']}
+        response = self.client.post('/save-production-plan-multi/', data)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(self.quantities(), {self.flour.pk: 1000, self.sugar.pk: 100})
+        self.assertFalse(ProductionPlan.objects.exists())
+
+
+class DocumentJobTests(PlanningTestCase):
+    def setUp(self):
+        super().setUp()
+        # Процесс пула закрывает старые соединения, а тесту нужно соединение с его транзакцией
+        patcher = mock.patch.object(jobs, 'close_old_connections')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def job(self, **fields):
+        order = self.order(self.bread, 100, start=self.start + timedelta(days=DocumentJob.objects.count()))
+        plan = ProductionPlan.objects.create(order=order, product=self.bread, planned_quantity=100)
+        return DocumentJob.objects.create(order_code='A1', plan_ids=[plan.pk], **fields)
+
+    def test_runs_once(self):
+        job = self.job()
+        self.assertEqual(jobs.run_job(job.pk), DocumentJob.STATUS_DONE)
+        self.assertIsNone(jobs.run_job(job.pk))
+        job.refresh_from_db()
+        self.assertEqual(job.attempts, 1)
+        self.assertIsNotNone(job.started_at)
+        self.assertTrue(job.result.name.endswith('.zip'))
+        job.result.delete()
+
+    def test_stale_running_jobs_are_requeued_then_failed(self):
+        old = timezone.now() - timedelta(seconds=jobs.DOCUMENT_JOB_TIMEOUT + 60)
+        stale = self.job(status=DocumentJob.STATUS_RUNNING, started_at=old, attempts=1)
+        exhausted = self.job(status=DocumentJob.STATUS_RUNNING, started_at=old, attempts=jobs.DOCUMENT_JOB_ATTEMPTS)
+        fresh = self.job(status=DocumentJob.STATUS_RUNNING, started_at=timezone.now(), attempts=1)
+
+        call_command('run_document_jobs', stdout=StringIO())
+        statuses = dict(DocumentJob.objects.values_list('pk', 'status'))
+        self.assertEqual(statuses, {stale.pk: DocumentJob.STATUS_DONE, exhausted.pk: DocumentJob.STATUS_FAILED,
+                                    fresh.pk: DocumentJob.STATUS_RUNNING})
+        DocumentJob.objects.get(pk=stale.pk).result.delete()
+
+    def test_pool_does_not_fork(self):
+        with mock.patch.object(jobs, '_executor', None), mock.patch.object(jobs, 'ProcessPoolExecutor') as pool:
+            jobs.get_executor()
+        self.assertEqual(pool.call_args.kwargs['mp_context'].get_start_method(), 'spawn')
+
+    @override_settings(DOCUMENT_RENDER_WORKERS=4)
+    def test_render_pool_is_shared_and_not_started_in_job_workers(self):
+        with mock.patch.object(jobs, '_render_executor', None), \
+                mock.patch.object(jobs, 'ProcessPoolExecutor') as pool:
+            self.assertIs(jobs.get_render_executor(), jobs.get_render_executor())
+            self.assertEqual(pool.call_count, 1)
+            with mock.patch.object(jobs, '_in_job_worker', True):
+                self.assertIsNone(jobs.get_render_executor())
+        self.assertEqual(pool.call_args.kwargs['max_workers'], 4)
+
+
+class StreamZipTests(SimpleTestCase):
+    def test_archive_is_built_in_pieces(self):
+        big = random.Random(1).randbytes(3 * ZIP_WRITE_CHUNK)
+        files = [('a.txt', b'first'), ('big.bin', big), ('parts.txt', iter([b'one ', b'two']))]
+        chunks = list(stream_zip(files))
+        self.assertGreater(len(chunks), 3)
+        self.assertLess(max(len(chunk) for chunk in chunks), 2 * ZIP_WRITE_CHUNK)
+        with zipfile.ZipFile(BytesIO(b''.join(chunks))) as archive:
+            self.assertIsNone(archive.testzip())
+            self.assertEqual(archive.read('a.txt'), b'first')
+            self.assertEqual(archive.read('big.bin'), big)
+            self.assertEqual(archive.read('parts.txt'), b'one two')
+
+
+class SavedPlanArchiveTests(PlanningTestCase):
+    def test_multi_product_plan_is_streamed(self):
+        request = RequestFactory().post('/', {
+            'products': [self.bread.pk, self.cake.pk],
+            'start_dates': ['2024-01-01'] * 2,
+            'end_dates': ['2024-01-31'] * 2,
+            'quantities': ['100', '50'],
+        })
+        response = views.save_multi_product_production_plan(request)
+        self.assertTrue(response.streaming)
+        with zipfile.ZipFile(BytesIO(b''.join(response.streaming_content))) as archive:
+            names = archive.namelist()
+            self.assertEqual(len(names), 2)
+            self.assertIn(b'Planned Quantity: 100', archive.read(next(name for name in names if 'Хлеб' in name)))
+
+
+class DepartmentDocumentTests(SimpleTestCase):
+    def read(self, content):
+        document = Document(BytesIO(content))
+        rows = [[cell.text for cell in row.cells] for row in document.tables[0].rows]
+        return document.paragraphs[0].text, rows
+
+    def test_template_is_parsed_once_and_not_shared_between_documents(self):
+        with mock.patch.object(documents, '_local', threading.local()), \
+                mock.patch.object(documents, 'Document', wraps=Document) as parse:
+            first = render_department_document('Пекарня', [('Хлеб', 100, date(2024, 1, 1), date(2024, 1, 31))])
+            second = render_department_document('Кондитерская', [('Торт', 5, date(2024, 2, 1), date(2024, 2, 9)),
+                                                                 ('Пирог', 7, date(2024, 2, 1), date(2024, 2, 9))])
+        self.assertEqual(parse.call_count, 1)
+        self.assertEqual(first[0], 'Пекарня_production_plan.docx')
+        heading, rows = self.read(first[1])
+        self.assertEqual(heading, 'План производства для отдела Пекарня')
+        self.assertEqual(rows[1:], [['Хлеб', '100', '2024-01-01', '2024-01-31']])
+        heading, rows = self.read(second[1])
+        self.assertEqual(heading, 'План производства для отдела Кондитерская')
+        self.assertEqual(rows[0], list(documents.DEPARTMENT_COLUMNS))
+        self.assertEqual([row[0] for row in rows[1:]], ['Торт', 'Пирог'])
+
+
+class PlanExportTests(PlanningTestCase):
+    def setUp(self):
+        super().setUp()
+        for month, product in ((1, self.bread), (3, self.cake)):
+            order = self.order(product, 10 * month, start=date(2024, month, 1), code=f'E{month}')
+            ProductionPlan.objects.create(order=order, product=product, planned_quantity=10 * month)
+
+    def export(self, export_format, **params):
+        response = self.client.get(f'/plans/export/{export_format}/', params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content)
+
+    def test_csv(self):
+        lines = self.export('csv').decode('utf-8-sig').splitlines()
+        self.assertTrue(lines[0].startswith('plan_id,order_id,'))
+        self.assertEqual(len(lines), 3)
+        self.assertIn('E1,', lines[1])
+
+    def test_ndjson_by_period(self):
+        rows = [json.loads(line) for line in self.export('ndjson', date_from='2024-02-15').splitlines()]
+        self.assertEqual([(row['order_id'], row['department'], row['start_date']) for row in rows],
+                         [('E3', 'Кондитерская', '2024-03-01')])
+
+    def test_xlsx(self):
+        with zipfile.ZipFile(BytesIO(self.export('xlsx'))) as archive:
+            sheet = archive.read('xl/worksheets/sheet1.xml').decode()
+        self.assertEqual(sheet.count('<row>'), 3)
+        self.assertIn('<t>Хлеб</t>', sheet)
+
+    def test_unknown_format(self):
+        self.assertEqual(self.client.get('/plans/export/pdf/').status_code, 404)
+
+    def test_invalid_dates(self):
+        for params in ({'date_from': '2024-13-01'}, {'date_to': '2024-02-30'}, {'date_from': '01.01.2024'}):
+            with self.subTest(**params):
+                self.assertEqual(self.client.get('/plans/export/csv/', params).status_code, 400)
+
+
+class DepartmentLoadApiTests(PlanningTestCase):
+    def get(self, **params):
+        return self.client.get('/departments/load/', params)
+
+    def test_weekly_load_for_a_year(self):
+        # 2024-01-01 — понедельник: 14 дней по 10 — две полные недели
+        ProductionPlan.objects.create(order=self.order(self.bread, 140, days=13), product=self.bread,
+                                      planned_quantity=140)
+        response = self.get(year='2024', granularity='week')
+        self.assertEqual(response.status_code, 200)
+        departments = {department['id']: department for department in response.json()['departments']}
+        self.assertEqual(departments[self.bakery.pk]['capacity'], 70)
+        self.assertEqual(departments[self.bakery.pk]['load'], [{'period': '2024-01-01', 'quantity': 70},
+                                                                {'period': '2024-01-08', 'quantity': 70}])
+        self.assertEqual(departments[self.confectionery.pk]['load'], [])
+
+    def test_invalid_parameters(self):
+        self.assertEqual(self.get(granularity='month').status_code, 400)
+        self.assertEqual(self.get(month='2024-13').status_code, 400)
+
+
+class ListingTests(PlanningTestCase):
+    def json(self, url, **params):
+        response = self.client.get(url, {'format': 'json', **params})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_keyset_pages(self):
+        for index in range(5):
+            Product.objects.create(name=f'Булка {index}', production_department=self.bakery)
+        names, params = [], {'q': 'Булка', 'limit': 2}
+        while True:
+            page = self.json('/products/', **params)
+            self.assertLessEqual(len(page['results']), 2)
+            names += [row['name'] for row in page['results']]
+            if page['next'] is None:
+                break
+            params['after'] = page['next']
+        self.assertEqual(names, [f'Булка {index}' for index in range(5)])
+
+    def test_limit_is_clamped(self):
+        for limit in ('0', '-5'):
+            page = self.json('/products/', limit=limit)
+            self.assertEqual(len(page['results']), 1)
+            self.assertIsNotNone(page['next'])
+
+    def test_filters(self):
+        page = self.json('/products/', production_department=self.confectionery.pk)
+        self.assertEqual([row['name'] for row in page['results']], ['Торт'])
+        page = self.json('/products/', is_active='false')
+        self.assertEqual(page['results'], [])
+
+    def test_invalid_filter_values_are_ignored(self):
+        self.order(self.bread, 10)
+        self.assertEqual(len(self.json('/products/', production_department='abc')['results']), 2)
+        self.assertEqual(len(self.json('/orders_list/', start_date='xx')['results']), 1)
+        self.assertEqual(len(self.json('/orders_list/', start_date='2024-01-01')['results']), 1)
+        self.assertEqual(len(self.json('/orders_list/', start_date='2024-01-02')['results']), 0)
+
+
+@override_settings(QUERY_BUDGET_RAISE=True)
+class QueryBudgetTests(PlanningTestCase):
+    def test_views_fit_their_budgets(self):
+        order = self.order(self.bread, 100)
+        ProductionPlan.objects.create(order=order, product=self.bread, planned_quantity=100)
+        for url in ('/', '/orders_list/', '/order_details/A1/', '/products/', '/raw_materials/', '/stocks/',
+                    '/recipes/', '/plans/', '/departments/', '/departments/load/?month=2024-01',
+                    '/calculate_plan/A1/changes/', '/scenarios/'):
+            with self.subTest(url=url):
+                self.assertEqual(check_view_budget(self.client, url).status_code, 200)
+        self.assertEqual(check_view_budget(self.client, '/calculate_plan/A1/', method='post').status_code, 200)
+
+    def test_planning_queries_do_not_grow_with_orders(self):
+        lines = [self.line(product, 1, start=self.start + timedelta(days=i))
+                 for i in range(20) for product in (self.bread, self.cake)]
+        evaluate_lines(lines)
+        with max_queries(4, 'evaluate_lines'):
+            evaluate_lines(lines)
+
+    def run_middleware(self, status=200, exception=False):
+        def get_response(request):
+            if exception:
+                middleware.process_exception(request, ValueError())
+            list(Product.objects.all())
+            list(Stock.objects.all())
+            return HttpResponse(status=status)
+
+        middleware = QueryBudgetMiddleware(get_response)
+        request = RequestFactory().get('/')
+        request.query_budget = 1
+        return middleware(request)
+
+    def test_middleware_checks_successful_responses(self):
+        with self.assertRaises(QueryBudgetExceeded):
+            self.run_middleware()
+
+    def test_middleware_skips_server_errors(self):
+        self.assertEqual(self.run_middleware(status=500).status_code, 500)
+        self.assertEqual(self.run_middleware(exception=True).status_code, 200)
+
+    @override_settings(QUERY_BUDGET_RAISE=False)
+    def test_middleware_only_logs_by_default(self):
+        with self.assertLogs('farmer.querybudget', 'WARNING'):
+            self.assertEqual(self.run_middleware().status_code, 200)
+
+    def test_saving_long_plans_extends_the_budget_by_load_batches(self):
+        products = []
+        for index in range(60):
+            department = ProductionDepartment.objects.create(name=f'Цех {index}', product_type='-',
+                                                             average_output=3000)
+            products.append(Product.objects.create(name=f'Продукт {index}', production_department=department))
+        data = {'product': [product.pk for product in products], 'start_date': ['2024-01-01'] * 60,
+                'end_date': ['2024-12-31'] * 60, 'quantity': ['10'] * 60}
+        response = check_view_budget(self.client, '/save-production-plan-multi/', method='post', data=data)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(ProductionPlan.objects.count(), 60)
+        self.assertEqual(DepartmentDailyLoad.objects.count(), 60 * 366)
+
+
+class PlanningIndexTests(PlanningTestCase):
+    def test_indexes_exist(self):
+        with connection.cursor() as cursor:
+            orders = connection.introspection.get_constraints(cursor, ManagementOrder._meta.db_table)
+            stock = connection.introspection.get_constraints(cursor, RawMaterialStock._meta.db_table)
+        self.assertEqual(orders['farmer_order_code_idx']['columns'], ['Order_id'])
+        self.assertEqual(orders['farmer_order_period_idx']['columns'], ['start_date', 'end_date'])
+        self.assertTrue(orders['farmer_order_product_start_uniq']['unique'])
+        self.assertEqual(stock['farmer_stock_name_idx']['columns'], ['name'])
+
+    def test_duplicate_order_is_rejected(self):
+        self.order(self.bread, 10)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            self.order(self.bread, 20, code='A2')
+        # Тот же день для другого продукта допустим
+        self.order(self.cake, 20, code='A2')
+
+    def test_order_ending_before_start_is_rejected(self):
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            ManagementOrder.objects.create(Order_id='A1', product_code=self.bread, start_date=self.start,
+                                           end_date=self.start - timedelta(days=1), quantity=10)
+        # Заявка на один день допустима
+        ManagementOrder.objects.create(Order_id='A1', product_code=self.bread, start_date=self.start,
+                                       end_date=self.start, quantity=10)
+
+
+class AllocationTests(SimpleTestCase):
+    def assertConsistent(self, result, demands, supply):
+        rows = {row_id: (material, quantity) for material in supply for row_id, quantity in supply[material]}
+        drawn = {row_id: 0 for row_id in rows}
+        for order in result.accepted:
+            per_material = {}
+            for row_id, amount in result.draws[order].items():
+                drawn[row_id] += amount
+                per_material[rows[row_id][0]] = per_material.get(rows[row_id][0], 0) + amount
+            self.assertEqual(per_material, {m: amount for m, amount in demands[order].items() if amount > 0})
+        for row_id, (_, quantity) in rows.items():
+            self.assertEqual(result.remaining[row_id], quantity - drawn[row_id])
+            self.assertGreaterEqual(result.remaining[row_id], 0)
+        self.assertEqual(set(result.shortages), set(range(len(demands))) - result.accepted)
+
+    def test_prefers_more_orders_over_first_come(self):
+        # Первая заявка забрала бы всё сырьё, вместо неё выполняются две другие
+        demands = [{'мука': 10}, {'мука': 6}, {'мука': 4}]
+        supply = {'мука': [(1, 5), (2, 5)]}
+        result = allocate(demands, supply)
+        self.assertEqual(result.accepted, {1, 2})
+        self.assertEqual(result.shortages, {0: {'мука': 10}})
+        self.assertConsistent(result, demands, supply)
+
+    def test_preferred_warehouse_first(self):
+        demands = [{'мука': 3}]
+        supply = {'мука': [(1, 5), (2, 5)]}
+        self.assertEqual(allocate(demands, supply, preferred=[{'мука': 2}]).draws, {0: {2: 3}})
+
+    def test_large_instance(self):
+        rng = random.Random(0)
+        supply = {m: [(m * 10 + w, rng.randint(0, 60)) for w in range(10)] for m in range(200)}
+        demands = [{m: rng.randint(1, 100) for m in rng.sample(range(200), 5)} for _ in range(1000)]
+        started = time.perf_counter()
+        result = allocate(demands, supply)
+        self.assertLess(time.perf_counter() - started, 1)
+        self.assertTrue(0 < len(result.accepted) < 1000)
+        self.assertConsistent(result, demands, supply)
+        # Ремонт ограничен проходами и обменами, а не временем — результат повторяется
+        self.assertEqual(allocate(demands, supply).draws, result.draws)
+
+    def test_repair_is_bounded_by_swaps(self):
+        demands = [{'мука': 10}, {'мука': 6}, {'мука': 4}]
+        supply = {'мука': [(1, 5), (2, 5)]}
+        # Первая заявка стоит в очереди раньше; без обменов остаётся жадное решение
+        rank = [0, 1, 1]
+        self.assertEqual(allocate(demands, supply, rank=rank, max_swaps=0).accepted, {0})
+        self.assertEqual(allocate(demands, supply, rank=rank, passes=1, max_swaps=1).accepted, {1, 2})
+
+
+class PriorityTests(PlanningTestCase):
+    def supplied(self, lines, priority, allocation=None):
+        kwargs = {'allocation': allocation} if allocation else {}
+        engine, verdicts = evaluate_lines(lines, priority=priority, **kwargs)
+        return [verdict.status != STATUS_SHORTAGE for verdict in verdicts]
+
+    def test_scarce_flour_goes_by_priority(self):
+        # Муки (1000) хватает только на одну из заявок
+        late = OrderLine(self.bread.pk, self.start, self.start + timedelta(days=90), 400, priority=1)
+        early = OrderLine(self.bread.pk, self.start, self.start + timedelta(days=60), 300, priority=5)
+        lines = [late, early]
+        for allocation in (None, ALLOCATION_OPTIMIZED):
+            with self.subTest(allocation=allocation):
+                self.assertEqual(self.supplied(lines, PRIORITY_DUE_DATE, allocation), [False, True])
+                self.assertEqual(self.supplied(lines, PRIORITY_QUANTITY, allocation), [False, True])
+                self.assertEqual(self.supplied(lines, PRIORITY_VALUE, allocation), [False, True])
+        self.assertEqual(self.supplied(lines, 'none'), [True, False])
+
+    def test_priority_from_the_request(self):
+        late = self.order(self.bread, 400, days=90)
+        early = self.order(self.bread, 300, days=60, start=self.start + timedelta(days=1))
+        verdicts = self.client.get('/calculate_plan/A1/changes/', {'priority': PRIORITY_DUE_DATE}).json()['verdicts']
+        self.assertEqual(verdicts[str(late.pk)]['status'], STATUS_SHORTAGE)
+        self.assertNotEqual(verdicts[str(early.pk)]['status'], STATUS_SHORTAGE)
+
+
+class ScenarioTests(PlanningTestCase):
+    def setUp(self):
+        super().setUp()
+        # 600 муки и 40 дней работы пекарни — ни сырья, ни мощности не хватает
+        self.order(self.bread, 600, days=30)
+        self.scenario = Scenario.objects.create(name='Больше муки', order_code='A1')
+
+    def statuses(self, scenario=None):
+        data, engine, verdicts = evaluate_scenario(scenario or self.scenario)
+        return [verdict.status for verdict in verdicts]
+
+    def test_overrides_apply_on_top_of_live_data(self):
+        self.assertEqual(self.statuses(), [STATUS_SHORTAGE])
+        ScenarioStock.objects.create(scenario=self.scenario, material=self.flour, quantity=2000)
+        self.assertEqual(self.statuses(), [STATUS_DELAY])
+        ScenarioCapacity.objects.create(scenario=self.scenario, department=self.bakery, average_output=900)
+        self.assertEqual(self.statuses(), [STATUS_OK])
+        ScenarioOrder.objects.create(scenario=self.scenario, product=self.cake, start_date=self.start,
+                                     end_date=self.start + timedelta(days=30), quantity=50)
+        self.assertEqual(self.statuses(), [STATUS_OK, STATUS_OK])
+
+        # Живые данные не изменились
+        self.flour.refresh_from_db()
+        self.bakery.refresh_from_db()
+        self.assertEqual((self.flour.quantity, self.bakery.average_output), (1000, 300))
+        self.assertEqual(ManagementOrder.objects.count(), 1)
+
+    def test_compare(self):
+        other = Scenario.objects.create(name='Как есть', order_code='A1')
+        ScenarioStock.objects.create(scenario=self.scenario, material=self.flour, quantity=2000)
+        response = check_view_budget(self.client, f'/scenarios/compare/?ids={self.scenario.pk}&ids={other.pk}')
+        self.assertEqual([(scenario.pk, counts[STATUS_SHORTAGE]) for scenario, counts in response.context['rows']],
+                         [(self.scenario.pk, 0), (other.pk, 1)])
+
+    def test_detail_edits(self):
+        url = f'/scenarios/{self.scenario.pk}/'
+        response = self.client.post(url, {'kind': 'stock', 'stock-material': self.flour.pk, 'stock-quantity': 2000})
+        self.assertRedirects(response, url)
+        response = check_view_budget(self.client, url)
+        self.assertEqual(response.context['summary'], summary(evaluate_scenario(self.scenario)[2]))
+        self.assertEqual(response.context['summary'][STATUS_SHORTAGE], 0)
+
+        override = self.scenario.stock_overrides.get()
+        for edit_id in ('abc', '', '-1', '²', str(2 ** 64)):
+            with self.subTest(edit_id=edit_id):
+                response = self.client.post(url, {'kind': 'stock', 'action': 'delete', 'edit_id': edit_id})
+                self.assertEqual(response.status_code, 400)
+        response = self.client.post(url, {'kind': 'stock', 'action': 'delete', 'edit_id': override.pk})
+        self.assertRedirects(response, url)
+        self.assertFalse(self.scenario.stock_overrides.exists())
+
+
+class IncrementalRefreshTests(PlanningTestCase):
+    def verdicts(self, full=False):
+        if full:
+            cache.clear()
+        refresh = incremental.refresh('A1')
+        return refresh, {order_id: status for order_id, (status, *_) in refresh.state.verdicts.items()}
+
+    def assertMatchesFullRecompute(self):
+        refresh, verdicts = self.verdicts()
+        self.assertEqual(verdicts, self.verdicts(full=True)[1])
+        return refresh, verdicts
+
+    def test_load_moved_between_days(self):
+        order = self.order(self.bread, 100, days=11)
+        # Другая заявка занимает пекарню со второго по шестой день, третья — с 20 по 25 число
+        other = self.order(self.bread, 50, days=4, start=self.start + timedelta(days=1), code='B1')
+        ProductionPlan.objects.create(order=other, product=self.bread, planned_quantity=50)
+        later = self.order(self.bread, 60, days=5, start=self.start + timedelta(days=19), code='C1')
+        ProductionPlan.objects.create(order=later, product=self.bread, planned_quantity=60)
+        self.assertEqual(self.verdicts()[1], {order.pk: STATUS_DELAY})
+
+        # Загрузка переезжает на уже занятые дни: число дней и сумма загрузки не меняются
+        other.start_date += timedelta(days=19)
+        other.end_date += timedelta(days=19)
+        other.save()
+        refresh, verdicts = self.assertMatchesFullRecompute()
+        self.assertEqual(verdicts, {order.pk: STATUS_OK})
+        self.assertEqual(refresh.changed, {order.pk})
+
+    def test_unrelated_changes_are_not_recomputed(self):
+        bread = self.order(self.bread, 100)
+        cake = self.order(self.cake, 10)
+        self.verdicts()
+        self.order(self.cake, 10, start=self.start + timedelta(days=1), code='B1')
+        self.sugar.quantity = 5
+        self.sugar.save()
+        refresh, verdicts = self.assertMatchesFullRecompute()
+        self.assertEqual(verdicts[cake.pk], STATUS_SHORTAGE)
+        # Хлеб и торт делят муку, поэтому пересчитываются вместе; новая заявка B1 в группу не входит
+        self.assertEqual(refresh.recomputed, {bread.pk, cake.pk})
+
+        refresh, _ = self.verdicts()
+        self.assertEqual(refresh.recomputed, set())
+
+    def test_page_and_feed_see_the_same_changes(self):
+        bread = self.order(self.bread, 100)
+        page = self.client.get('/calculate_plan/A1/').context['revision']
+        feed = self.client.get('/calculate_plan/A1/changes/').json()
+        self.assertTrue(feed['full'])
+        self.assertEqual(feed['changed'], [bread.pk])
+
+        self.flour.quantity = 100
+        self.flour.save()
+        changes = self.client.get('/calculate_plan/A1/changes/', {'since': feed['revision']}).json()
+        self.assertEqual((changes['full'], changes['changed']), (False, [bread.pk]))
+        # Лента уже пересчитала заказ, но страница всё равно видит изменение со своей ревизии
+        response = self.client.get('/calculate_plan/A1/', {'since': page})
+        self.assertEqual(response.context['changed_products'], {'Хлеб'})
+
+        unchanged = self.client.get('/calculate_plan/A1/changes/', {'since': changes['revision']}).json()
+        self.assertEqual((unchanged['full'], unchanged['changed'], unchanged['verdicts']), (False, [], {}))
+        self.assertTrue(self.client.get('/calculate_plan/A1/changes/', {'since': 'чужая:1'}).json()['full'])
+
+
+class FeasibilityApiTests(PlanningTestCase):
+    def post(self, payload, content_type='application/json'):
+        body = payload if isinstance(payload, str) else json.dumps(payload)
+        return self.client.post('/api/feasibility/', body, content_type=content_type)
+
+    def line(self, product=None, quantity=100, **fields):
+        data = {'product_id': (product or self.bread).pk, 'start_date': '2024-01-01', 'end_date': '2024-01-31',
+                'quantity': quantity}
+        data.update(fields)
+        return data
+
+    def test_batch(self):
+        response = check_view_budget(self.client, '/api/feasibility/', method='post', content_type='application/json',
+                                     data={'lines': [self.line(), self.line(self.cake, 300)]})
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        self.assertEqual([result['status'] for result in results], [STATUS_OK, STATUS_SHORTAGE])
+        self.assertEqual(results[0]['completion_date'], '2024-01-10')
+        self.assertEqual(results[0]['department_load'], 0)
+        self.assertEqual(results[1]['shortages'], {str(self.sugar.pk): 200})
+        self.assertIsNone(results[1]['department_load'])
+        self.assertEqual(results[0]['draws'], {str(self.stock.pk): {str(self.flour.pk): 200}})
+        self.assertEqual(results[1]['draws'], {})
+
+    def test_bad_lines(self):
+        bad = [self.line(quantity=api.MAX_API_QUANTITY + 1), self.line(quantity=10 ** 30), self.line(quantity=0),
+               self.line(quantity='5'), self.line(quantity=True), self.line(product_id=2 ** 64),
+               self.line(start_date='01.01.2024'), self.line(end_date='2023-12-31'), self.line(priority=-1),
+               {'product_id': self.bread.pk}, 'строка']
+        response = self.post({'lines': [self.line()] + bad})
+        self.assertEqual(response.status_code, 400)
+        errors = response.json()['errors']
+        self.assertEqual([error['index'] for error in errors], list(range(1, len(bad) + 1)))
+        self.assertIn('целые больше нуля', errors[0]['error'])
+
+    def test_largest_quantity_is_accepted(self):
+        response = self.post({'lines': [self.line(quantity=api.MAX_API_QUANTITY)]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'][0]['status'], STATUS_SHORTAGE)
+
+    def test_bad_requests(self):
+        self.assertEqual(self.post('{').status_code, 400)
+        self.assertEqual(self.post({'lines': 'нет'}).status_code, 400)
+        self.assertEqual(self.post({'lines': [], 'priority': 'random'}).status_code, 400)
+        self.assertEqual(self.post({'lines': [self.line(product_id=999999)]}).status_code, 400)
+        self.assertEqual(self.post('a=1', content_type='application/x-www-form-urlencoded').status_code, 415)
+        self.client.logout()
+        self.assertEqual(self.post({'lines': []}).status_code, 401)
+
+
+class AsyncRequestTests(PlanningTestCase):
+    async def body(self, response):
+        self.assertTrue(response.is_async)
+        return b''.join([chunk async for chunk in response.streaming_content])
+
+    def test_sync_generator_is_iterated_chunk_by_chunk_off_the_event_loop(self):
+        loops = []
+
+        def chunks():
+            for index in range(3):
+                loops.append(asyncio.events._get_running_loop())
+                yield index
+
+        async def consume():
+            iterator = offload.aiterate(chunks())
+            first = await anext(iterator)
+            # Следующий кусок ещё не запрошен и не вычислен
+            self.assertEqual(len(loops), 1)
+            return [first] + [chunk async for chunk in iterator]
+
+        self.assertEqual(asyncio.run(consume()), [0, 1, 2])
+        self.assertEqual(loops, [None] * 3)
+
+    async def test_exports_stream_asynchronously_under_asgi(self):
+        await self.async_client.aforce_login(self.user)
+        order = await ManagementOrder.objects.acreate(Order_id='E1', product_code=self.bread, start_date=self.start,
+                                                      end_date=self.start + timedelta(days=9), quantity=10)
+        await ProductionPlan.objects.acreate(order=order, product=self.bread, planned_quantity=10)
+        response = await self.async_client.get('/plans/export/csv/')
+        self.assertEqual(len((await self.body(response)).decode('utf-8-sig').splitlines()), 2)
+
+    async def test_multipart_is_parsed_off_the_event_loop(self):
+        await self.async_client.aforce_login(self.user)
+        parsed = []
+        parse = MultiPartParser.parse
+
+        def recording_parse(parser):
+            parsed.append(asyncio.events._get_running_loop())
+            return parse(parser)
+
+        row = {'Order_id': 'IMP', 'product_code': self.bread.pk, 'start_date': '2024-03-01',
+               'end_date': '2024-03-31', 'quantity': 10}
+        upload = SimpleUploadedFile('orders.json', json.dumps([row]).encode())
+        with mock.patch.object(MultiPartParser, 'parse', recording_parse):
+            response = await self.async_client.post('/import_management_orders/', {'json_file': upload})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['created'], 1)
+        self.assertEqual(parsed, [None])
+
+
+class ProgressEventsTests(PlanningTestCase):
+    def finished(self, progress_id):
+        tracker = progress.Progress(progress_id)
+        tracker.start(progress.STAGE_IMPORT, total=2)
+        tracker.advance(2)
+        tracker.finish(created=2)
+
+    def test_wsgi_answers_with_state_for_polling(self):
+        self.finished('wsgi')
+        response = self.client.get('/progress/wsgi/')
+        self.assertEqual(response['Content-Type'], 'application/json')
+        data = response.json()
+        self.assertEqual(data['state']['status'], progress.STATUS_DONE)
+        self.assertEqual(data['state']['result'], {'created': 2})
+        self.assertEqual(data['interval'], progress.PROGRESS_INTERVAL)
+
+    def test_unknown_progress_is_polled_as_empty_state(self):
+        self.assertIsNone(self.client.get('/progress/missing/').json()['state'])
+
+    async def test_asgi_streams_events(self):
+        await self.async_client.aforce_login(self.user)
+        self.finished('asgi')
+        response = await self.async_client.get('/progress/asgi/')
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        body = b''.join([chunk async for chunk in response.streaming_content]).decode()
+        self.assertIn('event: progress', body)
+        self.assertIn('"status": "done"', body)
+
+    async def test_asgi_polls_on_request(self):
+        await self.async_client.aforce_login(self.user)
+        self.finished('asgi-json')
+        response = await self.async_client.get('/progress/asgi-json/?format=json')
+        self.assertEqual(response.json()['state']['status'], progress.STATUS_DONE)
@@ -0,0 +1,215 @@
+# timeline.py
+# Материализованная загрузка производственных отделов по дням.
+# Планируемое количество плана равномерно распределяется по дням заявки
+# (границы включительно). Таблица обновляется инкрементально при сохранении
+# и удалении планов, поэтому чтение загрузки не зависит от числа планов.
+
+import math
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F, Sum
+from django.db.models.functions import TruncWeek
+
+from .models import DepartmentDailyLoad, ProductionPlan
+
+# Детализация загрузки и длина периода в днях
+GRANULARITY_DAY = 'day'
+GRANULARITY_WEEK = 'week'
+GRANULARITIES = {GRANULARITY_DAY: 1, GRANULARITY_WEEK: 7}
+
+# Дней загрузки в одной пачке записи add_plans и запросов на пачку
+# (SQLite ограничивает число параметров, поэтому пачка пишется несколькими запросами)
+LOAD_BATCH_SIZE = 1000
+LOAD_BATCH_QUERIES = 8
+
+
+def days_between(start_date, end_date):
+    """Все дни интервала, границы включительно."""
+    return [start_date + timedelta(days=offset) for offset in range((end_date - start_date).days + 1)]
+
+
+def plan_snapshot(plan_id):
+    """Отдел, сроки и количество сохранённого плана (или None)."""
+    return ProductionPlan.objects.filter(pk=plan_id).values_list(
+        'product__production_department_id', 'order__start_date', 'order__end_date', 'planned_quantity'
+    ).first()
+
+
+def apply_plan(department_id, start_date, end_date, planned_quantity, sign=1):
+    """Добавить (sign=1) или убрать (sign=-1) план из загрузки отдела."""
+    days = days_between(start_date, end_date)
+    if not days or not planned_quantity:
+        return
+    share = planned_quantity / len(days)
+
+    # Недостающие дни создаём пустыми, затем одним UPDATE сдвигаем загрузку
+    DepartmentDailyLoad.objects.bulk_create(
+        [DepartmentDailyLoad(department_id=department_id, day=day, quantity=0) for day in days],
+        ignore_conflicts=True,
+    )
+    DepartmentDailyLoad.objects.filter(
+        department_id=department_id, day__range=(start_date, end_date)
+    ).update(quantity=F('quantity') + sign * share)
+
+
+def apply_snapshot(snapshot, sign=1):
+    if snapshot is not None:
+        apply_plan(*snapshot, sign=sign)
+
+
+def add_plans(plans):
+    """
+    Учесть планы, сохранённые через bulk_create (сигналы при этом не срабатывают).
+    Дни загрузки пишутся пачками по LOAD_BATCH_SIZE: чтение — один запрос, каждая
+    пачка — не больше LOAD_BATCH_QUERIES. Возвращает число пачек.
+    """
+    delta = defaultdict(float)
+    for plan in plans:
+        days = days_between(plan.order.start_date, plan.order.end_date)
+        for day in days:
+            delta[(plan.product.production_department_id, day)] += plan.planned_quantity / len(days)
+    if not delta:
+        return 0
+
+    with transaction.atomic():
+        DepartmentDailyLoad.objects.bulk_create(
+            [DepartmentDailyLoad(department_id=department_id, day=day, quantity=0) for department_id, day in delta],
+            ignore_conflicts=True, batch_size=LOAD_BATCH_SIZE,
+        )
+        rows = DepartmentDailyLoad.objects.select_for_update().filter(
+            department_id__in={department_id for department_id, _ in delta},
+            day__range=(min(day for _, day in delta), max(day for _, day in delta)),
+        )
+        changed = []
+        for row in rows:
+            amount = delta.get((row.department_id, row.day))
+            if amount:
+                row.quantity += amount
+                changed.append(row)
+        DepartmentDailyLoad.objects.bulk_update(changed, ['quantity'], batch_size=LOAD_BATCH_SIZE)
+    return math.ceil(len(delta) / LOAD_BATCH_SIZE)
+
+
+def rebuild():
+    """Полный пересчёт таблицы загрузки по всем планам."""
+    load = defaultdict(float)
+    plans = ProductionPlan.objects.values_list('product__production_department_id', 'order__start_date',
+                                               'order__end_date', 'planned_quantity')
+    for department_id, start_date, end_date, planned_quantity in plans.iterator(chunk_size=2000):
+        days = days_between(start_date, end_date)
+        for day in days:
+            load[(department_id, day)] += planned_quantity / len(days)
+
+    with transaction.atomic():
+        DepartmentDailyLoad.objects.all().delete()
+        DepartmentDailyLoad.objects.bulk_create(
+            [DepartmentDailyLoad(department_id=department_id, day=day, quantity=quantity)
+             for (department_id, day), quantity in load.items()],
+            batch_size=1000,
+        )
+    return len(load)
+
+
+def daily_load(start_date, end_date, department_ids=None):
+    """Загрузка по дням: {department_id: [(day, quantity), ...]} — один запрос."""
+    rows = DepartmentDailyLoad.objects.filter(day__range=(start_date, end_date))
+    if department_ids is not None:
+        rows = rows.filter(department_id__in=department_ids)
+    result = defaultdict(list)
+    for department_id, day, quantity in rows.order_by('department_id', 'day').values_list(
+            'department_id', 'day', 'quantity'):
+        result[department_id].append((day, quantity))
+    return result
+
+
+def orders_load(order_ids):
+    """Вклад планов заявок ``order_ids`` в загрузку по дням: {department_id: {day: quantity}} — один запрос."""
+    result = defaultdict(lambda: defaultdict(float))
+    plans = ProductionPlan.objects.filter(order_id__in=order_ids).values_list(
+        'product__production_department_id', 'order__start_date', 'order__end_date', 'planned_quantity')
+    for department_id, start_date, end_date, planned_quantity in plans:
+        days = days_between(start_date, end_date)
+        for day in days:
+            result[department_id][day] += planned_quantity / len(days)
+    return result
+
+
+def _aggregated_rows(start_date, end_date, granularity):
+    rows = DepartmentDailyLoad.objects.filter(day__range=(start_date, end_date))
+    if granularity == GRANULARITY_WEEK:
+        rows = rows.annotate(period=TruncWeek('day'))
+    else:
+        rows = rows.annotate(period=F('day'))
+    return rows.values('department_id', 'period').annotate(total=Sum('quantity')).order_by(
+        'department_id', 'period')
+
+
+def aggregated_load(start_date, end_date, granularity=GRANULARITY_DAY):
+    """
+    Загрузка отделов, сгруппированная в БД по дням или неделям (неделя — с понедельника):
+    {department_id: [(начало периода, quantity), ...]} — один запрос.
+    """
+    return _group_periods(_aggregated_rows(start_date, end_date, granularity))
+
+
+async def aaggregated_load(start_date, end_date, granularity=GRANULARITY_DAY):
+    """То же, что aggregated_load, через асинхронный ORM."""
+    return _group_periods([row async for row in _aggregated_rows(start_date, end_date, granularity)])
+
+
+def _group_periods(rows):
+    result = defaultdict(list)
+    for row in rows:
+        period = row['period']
+        if hasattr(period, 'date'):
+            period = period.date()
+        result[row['department_id']].append((period, row['total']))
+    return result
+
+
+class LoadTimeline:
+    """
+    Загрузка отделов за период в памяти с префиксными суммами:
+    суммарная загрузка любого окна считается за O(log n).
+    ``exclude`` — {department_id: {день: количество}} — загрузка, которую не считаем
+    занятой (собственные планы пересчитываемых заявок, см. orders_load).
+    """
+
+    def __init__(self, start_date, end_date, department_ids=None, exclude=None):
+        exclude = exclude or {}
+        self._days = {}
+        self._loads = {}
+        self._sums = {}
+        for department_id, items in daily_load(start_date, end_date, department_ids).items():
+            own = exclude.get(department_id, {})
+            loads = [quantity - own.get(day, 0) for day, quantity in items]
+            sums = [0]
+            for quantity in loads:
+                sums.append(sums[-1] + quantity)
+            self._days[department_id] = [day for day, _ in items]
+            self._loads[department_id] = loads
+            self._sums[department_id] = sums
+
+    def busy(self, department_id):
+        """Занятая мощность отдела по дням: {день: количество}."""
+        return dict(zip(self._days.get(department_id, ()), self._loads.get(department_id, ())))
+
+    def total(self, department_id, start_date, end_date):
+        """Суммарная запланированная продукция отдела в окне."""
+        days = self._days.get(department_id)
+        if not days:
+            return 0
+        lo = bisect_left(days, start_date)
+        hi = bisect_right(days, end_date)
+        sums = self._sums[department_id]
+        return sums[hi] - sums[lo]
+
+    def monthly_load(self, department_id, start_date, end_date):
+        """Средняя загрузка отдела в окне в пересчёте на месяц (30 дней)."""
+        days = (end_date - start_date).days + 1
+        if days <= 0:
+            return 0
+        return self.total(department_id, start_date, end_date) / days * 30
@@ -11,17 +11,27 @@ urlpatterns = [
     path('orders_list/', views.orders_list, name='orders_list'),
     path('order_details/<str:order_id>/', views.order_details, name='order_details'),
     path('calculate_plan/<str:order_id>/', views.calculate_production_plan, name='calculate_plan'),
+    path('calculate_plan/<str:order_id>/changes/', views.production_plan_changes, name='production_plan_changes'),
     path('multi-product-production-plan/', views.MultiProductProductionPlanView.as_view(),
          name='multi_product_production_plan'),
     path('create_user/', views.create_user, name='create_user'),
     path('save-production-plan-multi/', views.SaveProductionPlanView.as_view(), name='save_production_plan_multi'),
     path('save_production_plan/<str:order_id>/', views.save_production_plan, name='save_production_plan'),
+    path('document_jobs/<int:job_id>/', views.document_job_status, name='document_job_status'),
+    path('document_jobs/<int:job_id>/download/', views.document_job_download, name='document_job_download'),
+    path('progress/<slug:progress_id>/', views.progress_events, name='progress_events'),
     path('success/', views.success_page, name='success_page'),
     path('departments/',  views.ProductionDepartmentsListView.as_view(), name='production_departments_list'),
+    path('departments/load/', views.department_load, name='department_load'),
     path('products/',  views.ProductsListView.as_view(), name='products_list'),
     path('raw_materials/', views.RawMaterialStockListView.as_view(), name='raw_material_stock_list'),
     path('stocks/',  views.StockListView.as_view(), name='stock_list'),
     path('recipes/',  views.recipes_list, name='recipes_list'),
     path('plans/',  views.ProductionPlansListView.as_view(), name='production_plans_list'),
+    path('plans/export/<str:export_format>/', views.export_production_plans, name='export_production_plans'),
+    path('api/feasibility/', views.feasibility_api, name='feasibility_api'),
+    path('scenarios/', views.scenarios_list, name='scenarios_list'),
+    path('scenarios/compare/', views.scenarios_compare, name='scenarios_compare'),
+    path('scenarios/<int:scenario_id>/', views.scenario_detail, name='scenario_detail'),
 
 ]
@@ -1,35 +1,89 @@
 import json
 import random
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 from itertools import groupby
 from operator import attrgetter
 
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.utils.dateformat import DateFormat
+from django.utils.dateparse import parse_date
 from django.utils.timezone import make_aware, is_naive
 from django.views import View
-from docx import Document
 from django.db.models import Count
-from django.http import JsonResponse, HttpResponse
+from django.http import JsonResponse, HttpResponse, FileResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST
 from django.views.generic import ListView, TemplateView
 
-from .forms import ProductionPlanForm, UserCreationForm
-from .models import ProductionDepartment, Product, RawMaterialStock, Stock, Recipe, ProductionPlan, ManagementOrder
+from .feasibility import (FeasibilityEngine, OrderLine, evaluate_lines, shortage_info, STATUS_DELAY,
+                          STATUS_SHORTAGE, ALLOCATION_OPTIMIZED, PRIORITY_CHOICES, PRIORITY_NONE)
+from .importer import import_stream, ImportFormatError, ImportReport, IMPORT_BATCH_QUERIES
+from . import api, incremental, jobs, offload, progress, timeline
+from .reservation import reserve_materials, InsufficientStock
+from .documents import stream_zip
+from .exports import export_plans, EXPORT_FORMATS
+from .admin import (ManagementOrderAdmin, ProductAdmin, RawMaterialStockAdmin, StockAdmin, RecipeAdmin,
+                    ProductionPlanAdmin)
+from .querybudget import query_budget, extend_query_budget
+from .listing import KeysetListMixin, paginate_keyset, wants_json, page_json
+from .forms import (ProductionPlanForm, UserCreationForm, ScenarioForm, ScenarioStockForm, ScenarioCapacityForm,
+                    ScenarioOrderForm)
+from .scenarios import evaluate_scenario, summary, SCENARIO_QUERIES, MAX_COMPARED
+from .models import (ProductionDepartment, Product, RawMaterialStock, Stock, Recipe, ProductionPlan, ManagementOrder,
+                     DocumentJob, Scenario, ScenarioStock, ScenarioCapacity)
 from django.shortcuts import render, get_object_or_404,redirect
 from django.core.exceptions import ValidationError
 from django.db.models import Sum, F
-from django.db import transaction
+from django.db import IntegrityError, transaction
 from collections import defaultdict
-import os
-import tempfile
-from zipfile import ZipFile
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Допустимые расширения файла импорта: массив JSON или NDJSON
+IMPORT_EXTENSIONS = ('.json', '.ndjson', '.jsonl')
+
+# Ответ при нарушении уникальности заявки (продукт + дата начала)
+DUPLICATE_ORDER_MESSAGE = "Ошибка: заявка на этот продукт с той же датой начала уже существует"
+
+# Правки сценария: форма и связь сценария с правками этого вида
+SCENARIO_EDITS = {
+    'stock': (ScenarioStockForm, 'stock_overrides'),
+    'capacity': (ScenarioCapacityForm, 'capacity_overrides'),
+    'order': (ScenarioOrderForm, 'extra_orders'),
+}
+
+def request_progress(request):
+    """Прогресс операции по id, который страница передала в поле progress_id."""
+    return progress.Progress(request.POST.get('progress_id') or request.GET.get('progress_id'))
+
+
+def planning_priority(request):
+    """Порядок распределения дефицитного сырья из формы (priority) или из настроек."""
+    priority = request.POST.get('priority') or request.GET.get('priority')
+    if priority not in dict(PRIORITY_CHOICES):
+        priority = getattr(settings, 'PLANNING_PRIORITY', PRIORITY_NONE)
+    return priority
+
+def form_lines(request, *fields):
+    """Строки заявки из формы по именам полей (продукт, начало, окончание, количество): (строки, ошибки)."""
+    columns = [request.POST.getlist(field) for field in fields]
+    if len({len(column) for column in columns}) > 1:
+        return [], ["Не у всех строк заполнены продукт, сроки и количество"]
+    lines, errors = [], []
+    for row, values in enumerate(zip(*columns), start=1):
+        try:
+            lines.append(api.parse_form_line(*values))
+        except ValueError as error:
+            errors.append(f"Строка {row}: {error}")
+    return lines, errors
+
+@query_budget(4)
 @login_required
 def create_user(request):
     if not request.user.is_superuser:
@@ -47,69 +101,82 @@ def create_user(request):
 
     return render(request, 'farmer/create_user.html', {'form': form})
 
+@query_budget(12)
 @login_required
 @require_POST
-def import_management_orders(request):
+async def import_management_orders(request):
     try:
+        await offload.load_body(request)
         json_file = request.FILES.get('json_file')
-        if not json_file.name.endswith('.json'):
+        if json_file is None or not json_file.name.endswith(IMPORT_EXTENSIONS):
             return JsonResponse({'error': 'Неверный формат файла. Требуется JSON.'}, status=400)
 
-        data = json.load(json_file)
-        for item in data:
-            try:
-                # Проверка и получение продукта по коду
-                product = Product.objects.get(id=item['product_code'])
-
-                # Проверка на дубликаты перед созданием
-                if ManagementOrder.objects.filter(product_code=product, start_date=item['start_date']).exists():
-                    return JsonResponse({
-                                            'error': f'Заявка с кодом продукта {item["product_code"]} на дату {item["start_date"]} уже существует.'},
-                                        status=400)
-
-                # Создание новой заявки
-                ManagementOrder.objects.create(
-                    Order_id=item['Order_id'],
-                    product_code=product,
-                    start_date=item['start_date'],
-                    end_date=item['end_date'],
-                    quantity=item['quantity']
-                )
-            except Product.DoesNotExist:
-                return JsonResponse({'error': f'Продукт с кодом {item["product_code"]} не найден.'}, status=400)
-            except (KeyError, TypeError, ValidationError) as e:
-                return JsonResponse({'error': str(e)}, status=400)
-
-        return JsonResponse({'success': 'Данные успешно импортированы.'})
+        # Файл читается кусками, заявки записываются пачками — в пуле потоков
+        try:
+            report = await offload.run_in_pool(import_stream, json_file.chunks(),
+                                               progress=request_progress(request), size=json_file.size)
+        except ImportFormatError as e:
+            # Строки до ошибки уже записаны — сообщаем, сколько и где остановился разбор
+            report = e.report or ImportReport()
+            extend_query_budget(request, IMPORT_BATCH_QUERIES * max(report.batches - 1, 0))
+            result = report.as_dict()
+            result['error'] = str(e)
+            result['row'] = e.row
+            return JsonResponse(result, status=400)
+        # Бюджет рассчитан на одну пачку, каждая следующая добавляет фиксированное число запросов
+        extend_query_budget(request, IMPORT_BATCH_QUERIES * max(report.batches - 1, 0))
+
+        result = report.as_dict()
+        if report.error_count and not report.created:
+            result['error'] = 'Ни одна заявка не импортирована.'
+            return JsonResponse(result, status=400)
+
+        result['success'] = f'Импортировано заявок: {report.created}. Ошибок: {report.error_count}.'
+        return JsonResponse(result)
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
 
 
-
+@query_budget(3)
 @login_required
 def orders_list(request):
-    orders = ManagementOrder.objects.values('Order_id').annotate(total=Count('id')).order_by('Order_id')
-    return render(request, 'farmer/orders_list.html', {'orders': orders})
+    orders = ManagementOrder.objects.values('Order_id').annotate(total=Count('id'))
+    page = paginate_keyset(request, orders, ('Order_id',), ManagementOrderAdmin.search_fields,
+                           ManagementOrderAdmin.list_filter)
+    if wants_json(request):
+        return page_json(page, page.object_list)
+    return render(request, 'farmer/orders_list.html', {
+        'orders': page.object_list,
+        'page': page,
+        'search': request.GET.get('q', ''),
+    })
+@query_budget(4)
 @login_required
 def order_details(request, order_id):
     # Получаем все заказы с данным Order_id
     orders = ManagementOrder.objects.filter(Order_id=order_id).select_related('product_code')
     # Получаем все рецепты для продуктов в заказах
-    recipes = Recipe.objects.filter(product__in=[order.product_code for order in orders]).select_related('raw_material')
+    recipes = Recipe.objects.filter(product__in=[order.product_code for order in orders]).select_related(
+        'product', 'raw_material')
     # Передаем order_id, коллекцию заказов и рецепты в шаблон
     return render(request, 'farmer/order_details.html', {
         'orders': orders,
         'order_id': order_id,
         'recipes': recipes,
+        'priority': planning_priority(request),
+        'priority_choices': PRIORITY_CHOICES,
     })
+@query_budget(2)
 @login_required
 def home(request):
     return render(request, 'farmer/home.html')
+@query_budget(2)
 @login_required
 def show_import_form(request):
     return render(request, 'farmer/import.html')
 
 
+@query_budget(7)
 class MultiProductProductionPlanView(LoginRequiredMixin,TemplateView):
     template_name = 'farmer/multi_product_production_plan.html'
 
@@ -119,117 +186,50 @@ class MultiProductProductionPlanView(LoginRequiredMixin,TemplateView):
         # Получаем все продукты
         products = Product.objects.all()
         context['products'] = products
+        context['priority'] = priority = planning_priority(self.request)
+        context['priority_choices'] = PRIORITY_CHOICES
 
         if self.request.method == 'POST':
             # Получаем список продуктов и их параметры из POST-запроса
-            products_ids = self.request.POST.getlist('products')
-            start_dates = self.request.POST.getlist('start_dates')
-            end_dates = self.request.POST.getlist('end_dates')
-            quantities = self.request.POST.getlist('quantities')
-
-            # Словарь для хранения общего необходимого количества каждого сырья
-            total_required_materials = defaultdict(int)
+            lines, errors = form_lines(self.request, 'products', 'start_dates', 'end_dates', 'quantities')
+            if errors:
+                context['errors'] = errors
+                return context
+
+            # Проверяем наличие сырья и загрузку отделов для всех строк сразу
+            engine = FeasibilityEngine(lines, allocation=ALLOCATION_OPTIMIZED, priority=priority)
+            if {line.product_id for line in lines} - set(engine.products):
+                context['errors'] = ["Выбран несуществующий продукт"]
+                return context
+            verdicts = engine.evaluate()
 
             orders = []
-            for i, product_id in enumerate(products_ids):
-                product = Product.objects.get(id=product_id)
-                required_quantity = int(quantities[i])
-                start_date = datetime.strptime(start_dates[i], '%Y-%m-%d')
-                end_date = datetime.strptime(end_dates[i], '%Y-%m-%d')
-
-                order = {
-                    'product': product,
-                    'start_date': start_date,
-                    'end_date': end_date,
-                    'quantity': required_quantity
-                }
-                orders.append(order)
-
-                recipes = Recipe.objects.filter(product=product)
-                for recipe in recipes:
-                    total_required_materials[recipe.raw_material.name] += recipe.required_quantity * required_quantity
-
-            # Используем транзакцию для проверки наличия сырья и возможных операций с базой данных
-            with transaction.atomic():
-                # Словарь для хранения информации о возможности производства для каждого заказа
-                production_possibility = {}
-                raw_materials_stock = RawMaterialStock.objects.filter(name__in=total_required_materials.keys())
-                stock_dict = {stock.name: stock.quantity for stock in raw_materials_stock}
-
-                # Проверяем наличие сырья на складе и корректируем остатки по мере использования
-                for order in orders:
-                    product = order['product']
-                    required_quantity = order['quantity']
-                    recipes = Recipe.objects.filter(product=product)
-                    sufficient_resources = True
-                    shortages = {}
-
-                    for recipe in recipes:
-                        material_name = recipe.raw_material.name
-                        required_amount = recipe.required_quantity * required_quantity
-                        available_quantity = stock_dict.get(material_name, 0)
-
-                        if available_quantity < required_amount:
-                            shortages[material_name] = required_amount - available_quantity
-                            sufficient_resources = False
-                        else:
-                            # Временно вычитаем необходимое количество из доступного
-                            stock_dict[material_name] -= required_amount
-
-                    # Проверяем возможность выполнения заказов
-                    if sufficient_resources:
-                        production_department = product.production_department
-                        monthly_output = production_department.average_output
-
-                        # Определяем текущую загруженность производства
-                        overlapping_orders = ProductionPlan.objects.filter(
-                            product__production_department=production_department,
-                            order__end_date__gte=order['start_date'],
-                            order__start_date__lte=order['end_date']
-                        )
-
-                        current_load = 0
-                        for overlapping_order in overlapping_orders:
-                            overlapping_order_start = overlapping_order.order.start_date
-                            if isinstance(overlapping_order_start, datetime):
-                                overlapping_order_start = overlapping_order_start.date()
-                            overlapping_order_end = overlapping_order.order.end_date
-                            if isinstance(overlapping_order_end, datetime):
-                                overlapping_order_end = overlapping_order_end.date()
-                            order_start = order['start_date'].date() if isinstance(order['start_date'], datetime) else order['start_date']
-                            order_end = order['end_date'].date() if isinstance(order['end_date'], datetime) else order['end_date']
-
-                            overlap_days = (min(overlapping_order_end, order_end) - max(overlapping_order_start, order_start)).days
-                            if overlap_days > 0:
-                                overlap_months = overlap_days / 30
-                                current_load += overlapping_order.planned_quantity / overlap_months
-
-                        available_capacity = monthly_output - current_load
-                        required_months = required_quantity / monthly_output
-
-                        if available_capacity <= 0 or required_quantity > available_capacity * required_months:
-                            delay = (required_quantity / available_capacity) - required_months if available_capacity > 0 else required_months
-                            if delay > 0.01:  # Установим порог для задержки
-                                production_possibility[product.name] = f"Производственный отдел не сможет уложиться в сроки, просрочка составит {delay:.2f} дней"
-                            else:
-                                production_possibility[product.name] = f"Можно произвести {required_quantity} кг за {required_months:.2f} месяцев"
-                        else:
-                            production_possibility[product.name] = f"Можно произвести {required_quantity} кг за {required_months:.2f} месяцев"
-                    else:
-                        shortage_info = ', '.join([f"{material}: недостает {amount} ед." for material, amount in shortages.items()])
-                        production_possibility[product.name] = f"Недостаточно сырья: {shortage_info}"
+            production_possibility = {}
+            warehouses = {}
+            for verdict in verdicts:
+                orders.append({
+                    'product': verdict.product,
+                    'start_date': verdict.line.start_date,
+                    'end_date': verdict.line.end_date,
+                    'quantity': verdict.line.quantity
+                })
+                production_possibility[verdict.product.name] = verdict.message(unit='кг')
+                # С каких складов берётся сырьё
+                warehouses[verdict.product.name] = verdict.warehouses
 
             # Отображаем результаты расчёта
             context['orders'] = orders
             context['production_possibility'] = production_possibility
+            context['warehouses'] = warehouses
 
         return context
 
     def post(self, request, *args, **kwargs):
         context = self.get_context_data(**kwargs)
-        return self.render_to_response(context)
+        return self.render_to_response(context, status=400 if context.get('errors') else 200)
 
 
+@query_budget(6)
 def calculate_multi_product_production_plan(request):
     if request.method == 'POST':
         products = request.POST.getlist('products')
@@ -260,150 +260,71 @@ def calculate_multi_product_production_plan(request):
 
 
 def calculate_production_possibility(orders):
-    production_possibility = {}
-    total_required_materials = defaultdict(int)
-
-    for order in orders:
-        product = Product.objects.get(id=order['product_id'])
-        required_quantity = order['quantity']
-        recipes = Recipe.objects.filter(product=product)
-
-        for recipe in recipes:
-            total_required_materials[recipe.raw_material.name] += recipe.required_quantity * required_quantity
-
-    raw_materials_stock = RawMaterialStock.objects.filter(name__in=total_required_materials.keys())
-    stock_dict = {stock.name: stock for stock in raw_materials_stock}
-
-    for order in orders:
-        product = Product.objects.get(id=order['product_id'])
-        required_quantity = order['quantity']
-        recipes = Recipe.objects.filter(product=product)
-        sufficient_resources = True
-        shortages = {}
-
-        for recipe in recipes:
-            material_name = recipe.raw_material.name
-            required_amount = recipe.required_quantity * required_quantity
-            available_quantity = stock_dict[material_name].quantity
-
-            if available_quantity < required_amount:
-                shortages[material_name] = required_amount - available_quantity
-                sufficient_resources = False
-            else:
-                stock_dict[material_name].quantity -= required_amount
-
-        if sufficient_resources:
-            production_department = product.production_department
-            production_time = (order['end_date'] - order['start_date']).days
-            monthly_output = production_department.average_output
-            required_months = required_quantity / monthly_output
-
-            overlapping_orders = ProductionPlan.objects.filter(
-                product__production_department=production_department,
-                order__end_date__gte=datetime.combine(order['start_date'], datetime.min.time()),  # Преобразование в datetime.datetime
-                order__start_date__lte=datetime.combine(order['end_date'], datetime.min.time())  # Преобразование в datetime.datetime
-            )
-
-            current_load = 0
-            for overlapping_order in overlapping_orders:
-                overlap_days = (min(overlapping_order.order.end_date, order['end_date']) - max(
-                    overlapping_order.order.start_date, order['start_date'])).days
-                overlap_months = overlap_days / 30
-                current_load += overlapping_order.planned_quantity / overlap_months
-
-            available_capacity = monthly_output - current_load
-            if available_capacity <= 0 or required_quantity > available_capacity * required_months:
-                delay = (
-                    required_quantity / available_capacity) - required_months if available_capacity > 0 else required_months
-                if delay > 0:
-                    production_possibility[
-                        product.name] = f"Производственный отдел не сможет уложиться в сроки, просрочка составит {delay:.2f} дней"
-                else:
-                    production_possibility[
-                        product.name] = f"Можно произвести {required_quantity} единиц за {required_months:.2f} месяцев"
-        else:
-            shortage_info = ', '.join(
-                [f"{material}: недостает {amount} ед." for material, amount in shortages.items()])
-            production_possibility[product.name] = f"Недостаточно сырья: {shortage_info}"
-
-    return production_possibility
+    engine, verdicts = evaluate_lines([OrderLine.from_dict(order) for order in orders])
+    return {verdict.product.name: verdict.message() for verdict in verdicts}
 
+# Сессия, пользователь и расчёт: заявки, рецепты (если их нет в кэше), остатки, отпечаток
+# загрузки, продукты, остатки по складам, загрузка по дням и собственные планы заказа
+@query_budget(10)
 @login_required
-def calculate_production_plan(request, order_id):
-    # Получаем все заявки с данным order_id
-    orders = ManagementOrder.objects.filter(Order_id=order_id).select_related('product_code',
-                                                                              'product_code__production_department')
-
-    # Словарь для хранения общего необходимого количества каждого сырья
-    total_required_materials = defaultdict(int)
-
-    # Собираем информацию о необходимом количестве сырья для всех продуктов
-    for order in orders:
-        product = order.product_code
-        required_quantity = order.quantity
-        recipes = Recipe.objects.filter(product=product)
-
-        for recipe in recipes:
-            total_required_materials[recipe.raw_material.name] += recipe.required_quantity * required_quantity
-
-    # Используем транзакцию для проверки наличия сырья и возможных операций с базой данных
-    with transaction.atomic():
-        # Словарь для хранения информации о возможности производства для каждого заказа
-        production_possibility = {}
-        materials_shortage = {}
-        raw_materials_stock = RawMaterialStock.objects.filter(name__in=total_required_materials.keys())
-        stock_dict = {stock.name: stock.quantity for stock in raw_materials_stock}
-
-        # Проверяем наличие сырья на складе и корректируем остатки по мере использования
-        for order in orders:
-            product = order.product_code
-            required_quantity = order.quantity
-            recipes = Recipe.objects.filter(product=product)
-            sufficient_resources = True
-            shortages = {}
-
-            for recipe in recipes:
-                material_name = recipe.raw_material.name
-                required_amount = recipe.required_quantity * required_quantity
-                available_quantity = stock_dict.get(material_name, 0)
-
-                if available_quantity < required_amount:
-                    shortages[material_name] = required_amount - available_quantity
-                    sufficient_resources = False
-                else:
-                    # Временно вычитаем необходимое количество из доступного
-                    stock_dict[material_name] -= required_amount
-
-            # Проверяем возможность выполнения заказов
-            if sufficient_resources:
-                production_department = product.production_department
-                production_time = (order.end_date - order.start_date).days
-                monthly_output = production_department.average_output
-                required_months = required_quantity / monthly_output
-
-                if production_time < required_months * 30:
-                    delay = (required_months * 30) - production_time
-                    production_possibility[
-                        product.name] = f"Производственный отдел не сможет уложиться в сроки, просрочка составит {delay:.2f} дней"
-                else:
-                    production_possibility[
-                        product.name] = f"Можно произвести {required_quantity} единиц за {required_months:.2f} месяцев"
-            else:
-                shortage_info = ', '.join(
-                    [f"{material}: недостает {amount} ед." for material, amount in shortages.items()])
-                production_possibility[product.name] = f"Недостаточно сырья: {shortage_info}"
+async def calculate_production_plan(request, order_id):
+    await offload.load_body(request)
+    # Пересчитываем только заявки, задетые изменениями с прошлого расчёта заказа
+    priority = planning_priority(request)
+    result = await offload.run_in_pool(incremental.refresh, order_id, priority, request_progress(request))
+    production_possibility = {order.product_code.name: result.state.verdicts[order.pk][1] for order in result.orders}
+    warehouses = {order.product_code.name: result.state.verdicts[order.pk][2] for order in result.orders}
+    # Отмечаем изменившееся с ревизии, которую страница показывала (since), иначе — с прошлого расчёта
+    changes = result.changes_since(request.GET.get('since'))
+    changed = changes[0] if changes else result.changed
 
     # Отображаем результаты расчёта
     context = {
-        'orders': orders,
+        'orders': result.orders,
         'production_possibility': production_possibility,
+        'warehouses': warehouses,
+        'changed_products': {order.product_code.name for order in result.orders if order.pk in changed},
+        'revision': result.token,
+        # Общая нехватка сырья по всему заказу
+        'materials_shortage': result.shortages(),
+        'priority': priority,
+        # Пользователь уже загружен login_required; ленивый request.user загрузил бы его повторно
+        'user': await request.auser(),
     }
-    return render(request, 'farmer/production_plan.html', context)
+    return await offload.run_in_pool(render, request, 'farmer/production_plan.html', context)
+
+
+# Те же запросы, что у calculate_production_plan
+@query_budget(10)
+@login_required
+def production_plan_changes(request, order_id):
+    """
+    Какие заявки заказа изменили вердикт после ревизии ``since`` — для выборочного обновления страниц.
+    Без ``since`` или с ревизией из другого состояния отдаётся весь заказ (full).
+    """
+    result = incremental.refresh(order_id, planning_priority(request))
+    changes = result.changes_since(request.GET.get('since'))
+    full = changes is None
+    changed, removed = (set(result.state.verdicts), set()) if full else changes
+    return JsonResponse({
+        'order_id': order_id,
+        'revision': result.token,
+        'full': full,
+        'changed': sorted(changed),
+        'removed': sorted(removed),
+        'verdicts': {order.pk: {'product': order.product_code.name,
+                                'status': result.state.verdicts[order.pk][0],
+                                'message': result.state.verdicts[order.pk][1],
+                                'warehouses': result.state.verdicts[order.pk][2]}
+                     for order in result.orders if order.pk in changed},
+    })
 
+@query_budget(2)
 @login_required
 def success_page(request):
     return render(request, 'farmer/success_page.html')
 
+@query_budget(24)
 def save_multi_product_production_plan(request):
     if request.method == 'POST':
         products = request.POST.getlist('products')
@@ -420,166 +341,120 @@ def save_multi_product_production_plan(request):
                 'quantity': int(quantity)
             })
 
-        production_plans = []
+        feasible = []
         manager_report = []
 
-        total_required_materials = defaultdict(int)
-        for order in orders:
-            product = Product.objects.get(id=order['product_id'])
-            required_quantity = order['quantity']
-            recipes = Recipe.objects.filter(product=product)
-            for recipe in recipes:
-                total_required_materials[recipe.raw_material.name] += recipe.required_quantity * required_quantity
-
-        raw_materials_stock = RawMaterialStock.objects.filter(name__in=total_required_materials.keys())
-        stock_dict = {stock.name: stock for stock in raw_materials_stock}
-
-        for order in orders:
-            product = Product.objects.get(id=order['product_id'])
-            required_quantity = order['quantity']
-            recipes = Recipe.objects.filter(product=product)
-            sufficient_resources = True
-            shortages = {}
-
-            for recipe in recipes:
-                material_name = recipe.raw_material.name
-                required_amount = recipe.required_quantity * required_quantity
-                available_quantity = stock_dict[material_name].quantity
-
-                if available_quantity < required_amount:
-                    shortages[material_name] = required_amount - available_quantity
-                    sufficient_resources = False
-                else:
-                    stock_dict[material_name].quantity -= required_amount
-
-            if sufficient_resources:
-                production_department = product.production_department
-                production_time = (order['end_date'] - order['start_date']).days
-                monthly_output = production_department.average_output
-                required_months = required_quantity / monthly_output
-
-                overlapping_orders = ProductionPlan.objects.filter(
-                    product__production_department=production_department,
-                    order__end_date__gte=order['start_date'],
-                    order__start_date__lte=order['end_date']
-                )
-
-                current_load = 0
-                for overlapping_order in overlapping_orders:
-                    overlap_days = (min(overlapping_order.order.end_date, order['end_date']) - max(
-                        overlapping_order.order.start_date, order['start_date'])).days
-                    overlap_months = overlap_days / 30
-                    current_load += overlapping_order.planned_quantity / overlap_months
-
-                available_capacity = monthly_output - current_load
-                if available_capacity <= 0 or required_quantity > available_capacity * required_months:
-                    delay = (
-                                    required_quantity / available_capacity) - required_months if available_capacity > 0 else required_months
-                    if delay > 0:
-                        manager_report.append(
-                            f"Производственный отдел {product.name} не сможет уложиться в сроки, просрочка составит {delay:.2f} дней")
-                    else:
-                        manager_report.append(
-                            f"Производственный отдел {product.name} может произвести {required_quantity} единиц за {required_months:.2f} месяцев")
-                else:
-                    manager_report.append(
-                        f"Производственный отдел {product.name} может произвести {required_quantity} единиц за {required_months:.2f} месяцев")
-
-                    # Создаем заказ и план производства
-                    management_order = ManagementOrder.objects.create(
-                        product=product,
-                        start_date=order['start_date'],
-                        end_date=order['end_date'],
-                        quantity=required_quantity
-                    )
-
-                    production_plan = ProductionPlan.objects.create(
-                        order=management_order,
-                        planned_quantity=required_quantity,
-                        actual_quantity=0,  # изначально фактическое количество 0
-                    )
-
-                    production_plans.append(production_plan)
+        engine, verdicts = evaluate_lines([OrderLine.from_dict(order) for order in orders])
+        order_id = generate_order_id()
+        for verdict in verdicts:
+            product = verdict.product
+            required_quantity = verdict.line.quantity
+            if verdict.status == STATUS_SHORTAGE:
+                manager_report.append(
+                    f"Недостаточно сырья для производства {product.name}: {shortage_info(verdict.shortages, verdict.material_names)}")
+            elif verdict.status == STATUS_DELAY:
+                manager_report.append(
+                    f"Производственный отдел {product.name} не сможет уложиться в сроки, просрочка составит {verdict.delay:.2f} дней")
             else:
-                shortage_info = ', '.join(
-                    [f"{material}: недостает {amount} ед." for material, amount in shortages.items()])
-                manager_report.append(f"Недостаточно сырья для производства {product.name}: {shortage_info}")
-
-        # Создаем временный файл ZIP для отчетов
-        with tempfile.TemporaryDirectory() as temp_dir:
-            zip_filename = os.path.join(temp_dir, 'production_plans.zip')
-            with ZipFile(zip_filename, 'w') as zip_file:
-                for plan in production_plans:
-                    filename = f"ProductionPlan_{plan.order.product.name}_{plan.order.start_date}.txt"
-                    filepath = os.path.join(temp_dir, filename)
-                    with open(filepath, 'w') as file:
-                        file.write(f"Product: {plan.order.product.name}\n")
-                        file.write(f"Start Date: {plan.order.start_date}\n")
-                        file.write(f"End Date: {plan.order.end_date}\n")
-                        file.write(f"Planned Quantity: {plan.planned_quantity}\n")
-                        file.write(f"Actual Quantity: {plan.actual_quantity}\n")
-                    zip_file.write(filepath, filename)
-
-            # Отправляем ZIP файл в ответ
-            with open(zip_filename, 'rb') as file:
-                response = HttpResponse(file.read(), content_type='application/zip')
-                response['Content-Disposition'] = f'attachment; filename="production_plans.zip"'
-                return response
+                manager_report.append(
+                    f"Производственный отдел {product.name} может произвести {required_quantity} единиц за {verdict.required_months:.2f} месяцев")
+                feasible.append(verdict)
+
+        # Создаем заказы и планы производства пачками, а не по одному на строку
+        try:
+            with transaction.atomic():
+                management_orders = ManagementOrder.objects.bulk_create([
+                    ManagementOrder(Order_id=order_id,
+                                    product_code=verdict.product,
+                                    start_date=verdict.line.start_date,
+                                    end_date=verdict.line.end_date,
+                                    quantity=verdict.line.quantity)
+                    for verdict in feasible
+                ])
+                production_plans = ProductionPlan.objects.bulk_create([
+                    ProductionPlan(order=management_order, product=verdict.product,
+                                   planned_quantity=verdict.line.quantity)
+                    for management_order, verdict in zip(management_orders, feasible)
+                ])
+                batches = timeline.add_plans(production_plans)
+        except IntegrityError:
+            return HttpResponse(DUPLICATE_ORDER_MESSAGE, status=409)
+        # Бюджет рассчитан на одну пачку дней загрузки
+        extend_query_budget(request, timeline.LOAD_BATCH_QUERIES * max(batches - 1, 0))
+
+        # Отчеты собираются в памяти и отдаются потоковым ZIP-архивом
+        def plan_files():
+            for plan in production_plans:
+                filename = f"ProductionPlan_{plan.product.name}_{plan.order.start_date}.txt"
+                content = (f"Product: {plan.product.name}\n"
+                           f"Start Date: {plan.order.start_date}\n"
+                           f"End Date: {plan.order.end_date}\n"
+                           f"Planned Quantity: {plan.planned_quantity}\n")
+                yield filename, content.encode('utf-8')
+
+        response = StreamingHttpResponse(offload.streaming_content(request, stream_zip(plan_files())),
+                                         content_type='application/zip')
+        response['Content-Disposition'] = f'attachment; filename="production_plans.zip"'
+        return response
     else:
         return HttpResponse("Invalid request method", status=405)
 
 
+@query_budget(24)
 class SaveProductionPlanView(LoginRequiredMixin,View):
     def post(self, request):
         # Получаем данные из POST-запроса
-        print(request.POST)
         products = request.POST.getlist('product')
         start_dates = request.POST.getlist('start_date')
         end_dates = request.POST.getlist('end_date')
         quantities = request.POST.getlist('quantity')
 
         if products and start_dates and end_dates and quantities:
-                # Создаем новый заказ
+            # Создаем новый заказ
             order_id = generate_order_id()
 
+            lines, errors = form_lines(request, 'product', 'start_date', 'end_date', 'quantity')
+            if errors:
+                return HttpResponse(f"Ошибка: {'; '.join(errors)}", status=400)
+            # Сырьё распределяется между складами так же, как при расчёте плана
+            engine = FeasibilityEngine(lines, allocation=ALLOCATION_OPTIMIZED, priority=planning_priority(request))
+            if {line.product_id for line in lines} - set(engine.products):
+                return HttpResponse("Ошибка: выбран несуществующий продукт", status=400)
+            verdicts = engine.evaluate()
+            shortages = [verdict.message() for verdict in verdicts if verdict.status == STATUS_SHORTAGE]
+            if shortages:
+                return HttpResponse(f"Ошибка: {'; '.join(shortages)}", status=409)
+            product_objects = engine.products
 
-            # Обновляем количество продуктов на складе и создаем производственные планы
-            for product_id, start_date, end_date, quantity in zip(products, start_dates, end_dates, quantities):
-
-
-                start_date = datetime.strptime(start_date, '%Y-%m-%d').date()
-                end_date = datetime.strptime(end_date, '%Y-%m-%d').date()
-
-
-                new_order = ManagementOrder.objects.create(Order_id=order_id,
-                                                           product_code_id=product_id,
-                                                           start_date=start_date,
-                                                           end_date=end_date,
-                                                           quantity=quantity)  # Указываем product_code
-                product = Product.objects.get(id=product_id)
-                # Получаем рецепты для данного продукта
-                recipes = Recipe.objects.filter(product=product)
-                # Обновляем количество сырья на складе
-                for recipe in recipes:
-                    raw_material = recipe.raw_material
-                    required_quantity = recipe.required_quantity * quantity
-                    # Проверяем наличие достаточного количества сырья на складе
-                    if raw_material.quantity < required_quantity:
-                        # Если не хватает сырья, выводим сообщение об ошибке
-                        raise Exception(f"Недостаточно сырья {raw_material.name} на складе")
-                    # Обновляем количество сырья на складе
-                    raw_material.quantity -= required_quantity
-                    raw_material.save()
-
-            for product, start_date, end_date, quantity in zip(products, start_dates, end_dates, quantities):
-                ProductionPlan.objects.create(
-                    order=new_order,
-                    product_id=product,
-                    planned_quantity=quantity
-                )
-
-                    # Перенаправляем пользователя после сохранения
-            return redirect('farmer:production_plan_list')
+            try:
+                with transaction.atomic():
+                    # Списываем сырьё целиком или не списываем совсем
+                    reserve_materials(engine.reserved())
+
+                    new_orders = ManagementOrder.objects.bulk_create([
+                        ManagementOrder(Order_id=order_id,
+                                        product_code_id=line.product_id,
+                                        start_date=line.start_date,
+                                        end_date=line.end_date,
+                                        quantity=line.quantity)
+                        for line in lines
+                    ])
+                    production_plans = ProductionPlan.objects.bulk_create([
+                        ProductionPlan(order=new_order,
+                                       product=product_objects[line.product_id],
+                                       planned_quantity=line.quantity)
+                        for new_order, line in zip(new_orders, lines)
+                    ])
+                    batches = timeline.add_plans(production_plans)
+            except InsufficientStock as e:
+                return HttpResponse(f"Ошибка: {e}", status=409)
+            except IntegrityError:
+                return HttpResponse(DUPLICATE_ORDER_MESSAGE, status=409)
+            # Бюджет рассчитан на одну пачку дней загрузки
+            extend_query_budget(request, timeline.LOAD_BATCH_QUERIES * max(batches - 1, 0))
+
+            # Перенаправляем пользователя после сохранения
+            return redirect('farmer:production_plans_list')
         else:
             # Вывести сообщение об ошибке или выполнить другое действие в случае пустых списков
             return HttpResponse("Ошибка: Не удалось получить данные из формы")
@@ -589,210 +464,279 @@ def generate_order_id():
     # Генерируем уникальный идентификатор, например, добавляя случайное число к префиксу
     unique_id = random.randint(10000, 99999)
     return unique_id
+def save_order_plan(request, order_id):
+    """Рассчитать и сохранить план заказа, поставить задачу на документы. Синхронно — для пула потоков."""
+    priority = planning_priority(request)
+    plan_progress = request_progress(request)
+    # Получаем все заявки с данным order_id
+    orders = ManagementOrder.objects.filter(Order_id=order_id).select_related('product_code',
+                                                                              'product_code__production_department')
+
+    production_plans = []
+    manager_report = []
+
+    # Распределение сырья такое же, как при расчёте плана
+    lines = [OrderLine.from_order(order) for order in orders]
+    plan_progress.start(progress.STAGE_EVALUATE, len(lines))
+    engine, verdicts = evaluate_lines(lines, allocation=ALLOCATION_OPTIMIZED, priority=priority)
+    plan_progress.advance(len(verdicts))
+    planned = set()
+    for index, verdict in enumerate(verdicts):
+        product = verdict.product
+        if verdict.feasible:
+            planned.add(index)
+            production_plans.append(
+                ProductionPlan(order=verdict.line.source, product=product,
+                               planned_quantity=verdict.line.quantity))
+        else:
+            manager_report.append((product.name, verdict.message()))
+
+    plan_progress.start(progress.STAGE_SAVE, len(production_plans))
+    try:
+        with transaction.atomic():
+            # Списываем под блокировкой строк только сырьё заявок, попавших в план
+            reserve_materials(engine.reserved(planned))
+
+            # Сохраняем производственный план в базе данных
+            ProductionPlan.objects.bulk_create(production_plans)
+            # bulk_create не вызывает сигналы, поэтому загрузку отделов обновляем явно
+            batches = timeline.add_plans(production_plans)
+    except InsufficientStock as e:
+        # Остатки изменились после расчёта — другой планировщик успел списать сырьё
+        plan_progress.fail(e)
+        return HttpResponse(f"Ошибка: {e}", status=409)
+    # Бюджет рассчитан на одну пачку дней загрузки
+    extend_query_budget(request, timeline.LOAD_BATCH_QUERIES * max(batches - 1, 0))
+    plan_progress.advance(len(production_plans))
+
+    # Документы генерируются в фоне, пользователь сразу получает номер задачи
+    job = DocumentJob.objects.create(
+        order_code=order_id,
+        plan_ids=[plan.pk for plan in production_plans],
+        manager_report=[list(item) for item in manager_report],
+    )
+    jobs.submit(job)
+    plan_progress.finish(job_id=job.pk)
+    return JsonResponse({
+        'job_id': job.pk,
+        'status_url': reverse('farmer:document_job_status', args=[job.pk]),
+        'progress_url': reverse('farmer:progress_events', args=[progress.job_progress_id(job.pk)]),
+    }, status=202)
+
+
+@query_budget(24)
 @login_required
-def save_production_plan(request, order_id):
-    if request.method == 'POST':
-        # Получаем все заявки с данным order_id
-        orders = ManagementOrder.objects.filter(Order_id=order_id).select_related('product_code',
-                                                                                  'product_code__production_department')
+@require_POST
+async def save_production_plan(request, order_id):
+    await offload.load_body(request)
+    return await offload.run_in_pool(save_order_plan, request, order_id)
 
-        # Словарь для хранения информации о возможности производства для каждого заказа
-        production_possibility = {}
-        production_plans = []
-        manager_report = []
 
-        # Словарь для хранения общего необходимого количества каждого сырья
-        total_required_materials = defaultdict(int)
-        for order in orders:
-            product = order.product_code
-            required_quantity = order.quantity
-            recipes = Recipe.objects.filter(product=product)
-            for recipe in recipes:
-                total_required_materials[recipe.raw_material.name] += recipe.required_quantity * required_quantity
-
-        raw_materials_stock = RawMaterialStock.objects.filter(name__in=total_required_materials.keys())
-        stock_dict = {stock.name: stock for stock in raw_materials_stock}
-
-        for order in orders:
-            product = order.product_code
-            required_quantity = order.quantity
-            recipes = Recipe.objects.filter(product=product)
-            sufficient_resources = True
-            shortages = {}
-
-            for recipe in recipes:
-                material_name = recipe.raw_material.name
-                required_amount = recipe.required_quantity * required_quantity
-                available_quantity = stock_dict[material_name].quantity
-
-                if available_quantity < required_amount:
-                    shortages[material_name] = required_amount - available_quantity
-                    sufficient_resources = False
-                else:
-                    stock_dict[material_name].quantity -= required_amount
-
-            if sufficient_resources:
-                production_department = product.production_department
-                production_time = (order.end_date - order.start_date).days
-                monthly_output = production_department.average_output
-                required_months = required_quantity / monthly_output
-
-                if production_time < required_months * 30:
-                    delay = (required_months * 30) - production_time
-                    production_possibility[
-                        product.name] = f"Производственный отдел не сможет уложиться в сроки, просрочка составит {delay:.2f} дней"
-                    manager_report.append((product.name,
-                                           f"Производственный отдел не сможет уложиться в сроки, просрочка составит {delay:.2f} дней"))
-                else:
-                    production_possibility[
-                        product.name] = f"Можно произвести {required_quantity} единиц за {required_months:.2f} месяцев"
-                    production_plans.append(
-                        ProductionPlan(order=order, product=product, planned_quantity=required_quantity))
-            else:
-                shortage_info = ', '.join(
-                    [f"{material}: недостает {amount} ед." for material, amount in shortages.items()])
-                production_possibility[product.name] = f"Недостаточно сырья: {shortage_info}"
-                manager_report.append((product.name, f"Недостаточно сырья: {shortage_info}"))
-
-        # Обновляем количество сырья на складе
-        for stock in stock_dict.values():
-            stock.save()
-
-        # Сохраняем производственный план в базе данных
-        ProductionPlan.objects.bulk_create(production_plans)
-
-        # Генерируем документы
-        temp_dir = tempfile.mkdtemp()
-        department_files = generate_department_documents(production_plans, temp_dir)
-        manager_report_file = generate_manager_report(manager_report, temp_dir)
-
-        # Создаем zip-архив с документами
-        zip_path = os.path.join(temp_dir, 'production_plan_documents.zip')
-        with ZipFile(zip_path, 'w') as zip_file:
-            for file_path in department_files:
-                zip_file.write(file_path, os.path.basename(file_path))
-            zip_file.write(manager_report_file, os.path.basename(manager_report_file))
-
-        # Отправляем архив пользователю
-        with open(zip_path, 'rb') as zip_file:
-            response = HttpResponse(zip_file.read(), content_type='application/zip')
-            response['Content-Disposition'] = f'attachment; filename=production_plan_documents.zip'
-            return response
-
-def generate_department_documents(production_plans, temp_dir):
-    department_plans = defaultdict(list)
-    for plan in production_plans:
-        department_plans[plan.product.production_department.name].append(plan)
-
-    file_paths = []
-    for department, plans in department_plans.items():
-        document = Document()
-        document.add_heading(f'План производства для отдела {department}', 0)
-
-        for plan in plans:
-            document.add_heading(plan.product.name, level=1)
-            document.add_paragraph(f'Запланированное количество: {plan.planned_quantity}')
-            document.add_paragraph(f'Дата начала: {plan.order.start_date}')
-            document.add_paragraph(f'Дата окончания: {plan.order.end_date}')
-
-        file_path = os.path.join(temp_dir, f'{department}_production_plan.docx')
-        document.save(file_path)
-        file_paths.append(file_path)
-
-    return file_paths
-
-def generate_manager_report(manager_report, temp_dir):
-    document = Document()
-    document.add_heading('Отчет для менеджеров', 0)
-
-    for product_name, issue in manager_report:
-        document.add_heading(product_name, level=1)
-        document.add_paragraph(issue)
-
-    file_path = os.path.join(temp_dir, 'manager_report.docx')
-    document.save(file_path)
-    return file_path
+@query_budget(2)
+@login_required
+async def progress_events(request, progress_id):
+    """
+    Прогресс операции потоком server-sent events (см. progress.py). Поток возможен
+    только под ASGI; под WSGI и по ?format=json — текущее состояние для опроса.
+    """
+    if wants_json(request) or not isinstance(request, ASGIRequest):
+        return JsonResponse({
+            'state': await progress.aread(progress_id),
+            'interval': progress.PROGRESS_INTERVAL,
+            'timeout': progress.STREAM_TIMEOUT,
+        })
+    response = StreamingHttpResponse(progress.events(progress_id), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Прокси (nginx) не должен копить события до конца ответа
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@query_budget(6)
+@csrf_exempt
+@require_POST
+def feasibility_api(request):
+    """
+    Пакетная проверка строк заявок в JSON (см. api.py). Для внешних систем: вместо
+    перенаправления на вход отвечает 401, CSRF-токен не нужен — принимается только
+    application/json, который браузер не отправит с чужого сайта без разрешения CORS.
+    """
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Требуется вход'}, status=401)
+    if request.content_type != 'application/json':
+        return JsonResponse({'error': 'Ожидается application/json'}, status=415)
+    try:
+        payload = json.loads(request.body)
+    except ValueError:
+        return JsonResponse({'error': 'Некорректный JSON'}, status=400)
+    try:
+        data = api.evaluate_request(payload, planning_priority(request))
+    except api.ApiError as error:
+        return JsonResponse({'error': str(error), 'errors': error.errors}, status=400)
+    return JsonResponse(data)
 
-class ProductionDepartmentsListView(LoginRequiredMixin,ListView):
-    model = ProductionDepartment
-    template_name = 'farmer/production_departments_list.html'
-    context_object_name = 'departments'
 
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
+@query_budget(3)
+@login_required
+def document_job_status(request, job_id):
+    job = get_object_or_404(DocumentJob, pk=job_id)
+    data = {'job_id': job.pk, 'status': job.status, 'error': job.error}
+    if job.status == DocumentJob.STATUS_DONE:
+        data['download_url'] = reverse('farmer:document_job_download', args=[job.pk])
+    return JsonResponse(data)
+
+
+@query_budget(3)
+@login_required
+def document_job_download(request, job_id):
+    job = get_object_or_404(DocumentJob, pk=job_id, status=DocumentJob.STATUS_DONE)
+    return FileResponse(job.result.open('rb'), as_attachment=True, filename='production_plan_documents.zip')
 
-        # Получаем выбранный месяц из GET параметров
-        month_str = self.request.GET.get('month')
+@query_budget(2)
+@login_required
+def export_production_plans(request, export_format):
+    if export_format not in EXPORT_FORMATS:
+        return HttpResponse("Неизвестный формат выгрузки", status=404)
+
+    # Необязательный период выгрузки по датам заявок
+    period = {}
+    for field in ('date_from', 'date_to'):
+        value = request.GET.get(field)
+        try:
+            period[field] = parse_date(value) if value else None
+        except ValueError:
+            period[field] = None
+        if value and period[field] is None:
+            return HttpResponse(f"Неверная дата {field}, требуется ГГГГ-ММ-ДД", status=400)
+    date_from, date_to = period['date_from'], period['date_to']
+
+    content_type, extension = EXPORT_FORMATS[export_format]
+    content = offload.streaming_content(request, export_plans(export_format, date_from, date_to))
+    response = StreamingHttpResponse(content, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="production_plans.{extension}"'
+    return response
+
+def selected_period(request):
+    """Период из GET параметров: месяц (?month=ГГГГ-ММ) или целый год (?year=ГГГГ)."""
+    year_str = request.GET.get('year')
+    month_str = request.GET.get('month')
+    if year_str:
+        selected_month = datetime(int(year_str), 1, 1)
+        start_date = selected_month.date()
+        end_date = start_date.replace(month=12, day=31)
+    else:
         if month_str:
             selected_month = datetime.strptime(month_str, '%Y-%m')
         else:
             selected_month = datetime.now()
-
         # Определяем временной интервал для выбранного месяца
-        start_date = datetime(selected_month.year, selected_month.month, 1)
-        end_date = (start_date + timedelta(days=31)).replace(day=1) - timedelta(seconds=1)
-
-        # Преобразование в осознанное время только если время наивное
-        if is_naive(start_date):
-            start_date = make_aware(start_date)
-        if is_naive(end_date):
-            end_date = make_aware(end_date)
-
-        # Получение только утвержденных заказов, которые включены в производственный план в выбранный месяц
-        production_plans = ProductionPlan.objects.select_related('order', 'product__production_department').filter(
-            order__start_date__lte=end_date,
-            order__end_date__gte=start_date
-        )
-
-        # Группировка заказов по производственным отделам
-        departments = ProductionDepartment.objects.all()
-        load_data = []
-        for department in departments:
-            department_orders = []
-            for plan in production_plans:
-                if plan.product.production_department == department:
-                    department_orders.append({
-                        'order_id': plan.order.Order_id,
-                        'product': plan.product.name,
-                        'start_date': plan.order.start_date.strftime('%Y-%m-%d'),
-                        'end_date': plan.order.end_date.strftime('%Y-%m-%d'),
-                        'quantity': plan.order.quantity,
-                        'monthly_output': department.average_output
-                    })
-            load_data.append({
-                'department': department.name,
-                'load': department_orders
-            })
+        start_date = date(selected_month.year, selected_month.month, 1)
+        end_date = (start_date + timedelta(days=31)).replace(day=1) - timedelta(days=1)
+    return selected_month, start_date, end_date
+
+
+@query_budget(3)
+class ProductionDepartmentsListView(LoginRequiredMixin,ListView):
+    model = ProductionDepartment
+    template_name = 'farmer/production_departments_list.html'
+    context_object_name = 'departments'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
 
-        context['load_data'] = load_data
+        # Сама загрузка запрашивается страницей асинхронно через department_load
+        selected_month, start_date, end_date = selected_period(self.request)
+        year_str = self.request.GET.get('year', '')
         context['start_date'] = start_date.strftime('%Y-%m-%d')
         context['end_date'] = end_date.strftime('%Y-%m-%d')
         context['selected_month'] = selected_month.strftime('%Y-%m')
+        context['selected_year'] = year_str
+        context['granularity'] = timeline.GRANULARITY_WEEK if year_str else timeline.GRANULARITY_DAY
         return context
 
-class ProductsListView(LoginRequiredMixin,ListView):
+
+@query_budget(4)
+@login_required
+async def department_load(request):
+    """Загрузка отделов по дням или неделям в JSON. Агрегация выполняется в БД, чтение — асинхронным ORM."""
+    try:
+        selected_month, start_date, end_date = selected_period(request)
+    except ValueError:
+        return JsonResponse({'error': 'Неверный период.'}, status=400)
+    granularity = request.GET.get('granularity', timeline.GRANULARITY_DAY)
+    if granularity not in timeline.GRANULARITIES:
+        return JsonResponse({'error': 'Неверная детализация.'}, status=400)
+
+    load = await timeline.aaggregated_load(start_date, end_date, granularity)
+    departments = []
+    async for department in ProductionDepartment.objects.order_by('pk'):
+        departments.append({
+            'id': department.id,
+            'name': department.name,
+            'capacity': round(department.average_output / 30 * timeline.GRANULARITIES[granularity], 2),
+            'load': [{'period': period.strftime('%Y-%m-%d'), 'quantity': round(quantity, 2)}
+                     for period, quantity in load.get(department.id, [])],
+        })
+
+    return JsonResponse({
+        'start_date': start_date.strftime('%Y-%m-%d'),
+        'end_date': end_date.strftime('%Y-%m-%d'),
+        'granularity': granularity,
+        'departments': departments,
+    })
+
+@query_budget(3)
+class ProductsListView(LoginRequiredMixin,KeysetListMixin,ListView):
     model = Product
     template_name = 'farmer/products_list.html'
     context_object_name = 'products'
+    admin_class = ProductAdmin
+    keyset = ('name', 'pk')
+    json_fields = ('id', 'name', 'production_department_id', 'production_department__name', 'is_active')
+
+    def get_queryset(self):
+        return super().get_queryset().select_related('production_department')
 
-class RawMaterialStockListView(LoginRequiredMixin,ListView):
+@query_budget(3)
+class RawMaterialStockListView(LoginRequiredMixin,KeysetListMixin,ListView):
     model = RawMaterialStock
     template_name = 'farmer/raw_material_stock_list.html'
     context_object_name = 'raw_materials'
+    admin_class = RawMaterialStockAdmin
+    keyset = ('name', 'pk')
+    json_fields = ('id', 'name', 'quantity', 'stok_id_id', 'stok_id__name')
+
+    def get_queryset(self):
+        return super().get_queryset().select_related('stok_id')
 
-class StockListView(LoginRequiredMixin,ListView):
+@query_budget(3)
+class StockListView(LoginRequiredMixin,KeysetListMixin,ListView):
     model = Stock
     template_name = 'farmer/stock_list.html'
     context_object_name = 'stocks'
+    admin_class = StockAdmin
+    keyset = ('name', 'pk')
+    json_fields = ('id', 'name')
 
+@query_budget(3)
 @login_required
 def recipes_list(request):
-    # Получаем все рецепты
+    # Получаем страницу рецептов, отсортированных по продукту
     recipes = Recipe.objects.select_related('product', 'raw_material')
+    page = paginate_keyset(request, recipes, ('product__name', 'pk'), RecipeAdmin.search_fields)
+    if wants_json(request):
+        return page_json(page, [{
+            'id': recipe.id,
+            'product_id': recipe.product_id,
+            'product': recipe.product.name,
+            'raw_material_id': recipe.raw_material_id,
+            'raw_material': recipe.raw_material.name,
+            'required_quantity': recipe.required_quantity,
+        } for recipe in page.object_list])
 
     # Группируем рецепты по продукту
     grouped_recipes = {}
-    for recipe in recipes:
+    for recipe in page.object_list:
         if recipe.product.name not in grouped_recipes:
             grouped_recipes[recipe.product.name] = []
         grouped_recipes[recipe.product.name].append(recipe)
@@ -800,33 +744,124 @@ def recipes_list(request):
     # Передаем сгруппированные рецепты в шаблон
     return render(request, 'farmer/recipes_list.html', {
         'grouped_recipes': grouped_recipes,
+        'page': page,
+        'search': request.GET.get('q', ''),
     })
 
-class RecipesListView(LoginRequiredMixin,ListView):
-    model = Recipe
-    template_name = 'farmer/recipes_list.html'
-    context_object_name = 'recipes'
-
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        recipes = self.get_queryset()
-
-        grouped_recipes = defaultdict(list)
-        for recipe in recipes:
-            grouped_recipes[recipe.product.name].append(recipe)
-
-        context['grouped_recipes'] = grouped_recipes
-        return context
-
-class ProductionPlansListView(LoginRequiredMixin,ListView):
+@query_budget(3)
+class ProductionPlansListView(LoginRequiredMixin,KeysetListMixin,ListView):
     model = ProductionPlan
     template_name = 'farmer/production_plans_list.html'
     context_object_name = 'plans'
+    admin_class = ProductionPlanAdmin
+    keyset = ('order__Order_id', 'pk')
+    json_fields = ('id', 'order_id', 'order__Order_id', 'order__end_date', 'product_id', 'product__name',
+                   'planned_quantity')
+
+    def get_queryset(self):
+        return super().get_queryset().select_related('order', 'product')
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        plans = self.get_queryset().select_related('order', 'product').order_by('order__Order_id')
-        grouped_plans = groupby(plans, key=attrgetter('order'))
+        grouped_plans = groupby(self.object_list, key=attrgetter('order'))
         grouped_plans_list = [(order, list(plans)) for order, plans in grouped_plans]
         context['grouped_plans'] = grouped_plans_list
         return context
+
+
+@query_budget(4)
+@login_required
+def scenarios_list(request):
+    """Список сценариев и создание нового. Новый сценарий не копирует данных — только название и код заказа."""
+    form = ScenarioForm(request.POST or None)
+    if request.method == 'POST' and form.is_valid():
+        scenario = form.save()
+        return redirect('farmer:scenario_detail', scenario_id=scenario.pk)
+    return render(request, 'farmer/scenarios_list.html', {
+        'scenarios': Scenario.objects.order_by('-created_at'),
+        'form': form,
+        'max_compared': MAX_COMPARED,
+    })
+
+
+def save_scenario_edit(scenario, kind, form):
+    # Остаток сырья и мощность отдела в сценарии заменяются, а не дублируются
+    if kind == 'stock':
+        ScenarioStock.objects.update_or_create(scenario=scenario, material=form.cleaned_data['material'],
+                                               defaults={'quantity': form.cleaned_data['quantity']})
+    elif kind == 'capacity':
+        ScenarioCapacity.objects.update_or_create(scenario=scenario, department=form.cleaned_data['department'],
+                                                  defaults={'average_output': form.cleaned_data['average_output']})
+    else:
+        order = form.save(commit=False)
+        order.scenario = scenario
+        order.save()
+
+
+@query_budget(16)
+@login_required
+def scenario_detail(request, scenario_id):
+    """Правки сценария и расчёт заявок сценария поверх живых данных."""
+    scenario = get_object_or_404(Scenario, pk=scenario_id)
+    forms = {kind: form_class(prefix=kind) for kind, (form_class, _) in SCENARIO_EDITS.items()}
+
+    if request.method == 'POST':
+        kind = request.POST.get('kind')
+        if kind not in SCENARIO_EDITS:
+            return HttpResponse("Неизвестная правка сценария", status=400)
+        form_class, relation = SCENARIO_EDITS[kind]
+        if request.POST.get('action') == 'delete':
+            try:
+                edit_id = int(request.POST.get('edit_id', ''))
+            except ValueError:
+                edit_id = 0
+            # Номер вне диапазона id не дошёл бы до базы
+            if not 0 < edit_id <= api.MAX_API_ID:
+                return HttpResponse("Неверный номер правки сценария", status=400)
+            getattr(scenario, relation).filter(pk=edit_id).delete()
+            return redirect('farmer:scenario_detail', scenario_id=scenario.pk)
+        form = form_class(request.POST, prefix=kind)
+        if form.is_valid():
+            save_scenario_edit(scenario, kind, form)
+            return redirect('farmer:scenario_detail', scenario_id=scenario.pk)
+        forms[kind] = form
+
+    priority = planning_priority(request)
+    data, engine, verdicts = evaluate_scenario(scenario, priority)
+    results = [{
+        'product': verdict.product.name,
+        'start_date': verdict.line.start_date,
+        'end_date': verdict.line.end_date,
+        'quantity': verdict.line.quantity,
+        'extra': not isinstance(verdict.line.source, ManagementOrder),
+        'status': verdict.status,
+        'message': verdict.message(),
+        'warehouses': verdict.warehouses,
+    } for verdict in verdicts]
+
+    return render(request, 'farmer/scenario_detail.html', {
+        'scenario': scenario,
+        'data': data,
+        'forms': forms,
+        'results': results,
+        'summary': summary(verdicts),
+        'materials_shortage': engine.named(engine.batch_shortages()),
+        'priority': priority,
+        'priority_choices': PRIORITY_CHOICES,
+    })
+
+
+@query_budget(3)
+@login_required
+def scenarios_compare(request):
+    """Сводка по нескольким сценариям рядом: сколько заявок выполнимо, с просрочкой и без сырья."""
+    ids = [value for value in request.GET.getlist('ids') if value.isdigit()][:MAX_COMPARED]
+    scenarios = list(Scenario.objects.filter(pk__in=ids).order_by('pk'))
+    extend_query_budget(request, SCENARIO_QUERIES * len(scenarios))
+    priority = planning_priority(request)
+    rows = [(scenario, summary(evaluate_scenario(scenario, priority)[2])) for scenario in scenarios]
+    return render(request, 'farmer/scenarios_compare.html', {
+        'rows': rows,
+        'priority': priority,
+        'priority_choices': PRIORITY_CHOICES,
+    })